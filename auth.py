@@ -0,0 +1,112 @@
+"""密码哈希与校验
+
+使用加盐的PBKDF2-SHA256, 存储格式为 pbkdf2_sha256$迭代次数$盐$哈希(均为十六进制)。
+旧版本的32位MD5哈希仍可校验, 登录成功后会自动升级为新格式。
+"""
+import os
+import hmac
+import hashlib
+import threading
+from time import monotonic
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+
+ALGORITHM = 'pbkdf2_sha256'
+# 迭代次数越大越安全也越慢, 可通过环境变量调整
+PBKDF2_ITERATIONS = int(os.environ.get('STUDENT_MANAGER_PBKDF2_ITERATIONS', 100000))
+SALT_BYTES = 16
+PARALLEL_THRESHOLD = 8  # 少于该数量的密码直接在当前进程计算
+
+
+@metrics.timed('auth.hash')
+def hash_password(password, iterations=None):
+    """生成带随机盐的密码哈希"""
+    iterations = iterations or PBKDF2_ITERATIONS
+    salt = os.urandom(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return f"{ALGORITHM}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def _is_legacy(stored):
+    return '$' not in stored and len(stored) == 32
+
+
+@metrics.timed('auth.verify')
+def verify_password(stored, password):
+    """校验密码, 兼容旧版MD5哈希"""
+    if _is_legacy(stored):
+        legacy = hashlib.md5(password.encode('utf-8')).hexdigest()
+        return hmac.compare_digest(stored, legacy)
+    try:
+        algorithm, iterations, salt, digest = stored.split('$')
+        if algorithm != ALGORITHM:
+            return False
+        actual = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'),
+                                     bytes.fromhex(salt), int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual.hex(), digest)
+
+
+def needs_rehash(stored):
+    """旧版MD5或迭代次数低于当前配置的哈希需要升级"""
+    if _is_legacy(stored):
+        return True
+    try:
+        return int(stored.split('$')[1]) < PBKDF2_ITERATIONS
+    except (IndexError, ValueError):
+        return True
+
+
+@metrics.timed('auth.hash_batch')
+def hash_passwords(passwords, workers=None):
+    """批量计算密码哈希, 数量较多时分配到多个进程并行计算"""
+    passwords = list(passwords)
+    if len(passwords) < PARALLEL_THRESHOLD or (workers or os.cpu_count() or 1) < 2:
+        return [hash_password(password) for password in passwords]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, len(passwords) // ((workers or os.cpu_count()) * 4))
+        return list(executor.map(hash_password, passwords, chunksize=chunksize))
+
+
+class CredentialCache:
+    """短时间内已验证通过的凭据缓存
+
+    只缓存验证成功的结果, 键是以进程内随机密钥计算的HMAC,
+    内存中不保留明文密码。存储的哈希变化(如修改密码)后旧缓存自然失效。
+    可以在多个线程中同时调用verify, KDF计算不持有锁。
+    """
+
+    def __init__(self, ttl=300, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._key = os.urandom(32)
+        self._entries = {}  # 键 -> 过期时间
+        self._lock = threading.Lock()
+
+    def _cache_key(self, username, stored, password):
+        message = '\0'.join((username, stored, password)).encode('utf-8')
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def verify(self, username, stored, password):
+        """校验密码, 命中缓存时不再计算KDF"""
+        key = self._cache_key(username, stored, password)
+        now = monotonic()
+        expires = self._entries.get(key)
+        if expires is not None and expires > now:
+            metrics.increment('auth.cache_hit')
+            return True
+        if not verify_password(stored, password):
+            return False
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries = {k: v for k, v in self._entries.items() if v > now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = now + self.ttl
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
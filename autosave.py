@@ -0,0 +1,105 @@
+"""后台提交
+
+交互界面每次修改后只调用schedule(), 由后台线程延迟提交: 最后一次修改后delay秒内没有
+新的修改, 或距离第一次未提交的修改已有max_delay秒时提交一次, 短时间内的多次修改合并为
+一次写入。commit由调用方提供, 需要自己处理与界面线程的互斥(见main.py中的lock)。
+state供界面显示: 'idle'、'pending'(等待提交)、'saving'、'saved'、'failed'。
+"""
+import threading
+from time import monotonic
+
+import metrics
+
+
+class BackgroundSaver:
+    """延迟并合并提交的后台线程"""
+
+    def __init__(self, commit, delay=0.5, max_delay=2.0):
+        self._commit = commit
+        self.delay = delay
+        self.max_delay = max_delay
+        self.state = 'idle'
+        self.state_time = monotonic()   # state最近一次变化的时间
+        self.error = None               # 最近一次提交失败的异常, 由界面取走后清空
+        self._first = None              # 第一次未提交的修改的时间
+        self._last = None               # 最近一次修改的时间
+        self._stopping = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='background-saver', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _set_state(self, state):
+        self.state = state
+        self.state_time = monotonic()
+
+    def busy(self):
+        return self.state in ('pending', 'saving')
+
+    def schedule(self):
+        """有新的修改, 稍后提交"""
+        metrics.increment('autosave.scheduled')
+        with self._cond:
+            now = monotonic()
+            if self._first is None:
+                self._first = now
+            self._last = now
+            self._set_state('pending')
+            self._cond.notify()
+
+    def flush(self):
+        """在调用线程中立即提交, 已安排的提交随之取消, 返回是否成功"""
+        with self._cond:
+            self._first = self._last = None
+            self._set_state('saving')
+        return self._run_commit()
+
+    def take_error(self):
+        """取走最近一次提交失败的异常, 没有时返回None"""
+        with self._cond:
+            error, self.error = self.error, None
+            return error
+
+    def stop(self):
+        """提交尚未提交的修改后结束后台线程"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run_commit(self):
+        metrics.increment('autosave.commit')
+        try:
+            self._commit()
+        except Exception as e:
+            with self._cond:
+                self.error = e
+                self._set_state('failed')
+            return False
+        with self._cond:
+            if self._first is None:     # 提交期间又有新的修改时保持pending
+                self._set_state('saved')
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    if self._first is None:
+                        self._cond.wait()
+                        continue
+                    due = min(self._last + self.delay, self._first + self.max_delay)
+                    remaining = due - monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                stopping = self._stopping
+                if self._first is None and stopping:
+                    return
+                self._first = self._last = None
+                self._set_state('saving')
+            self._run_commit()
+            if stopping:
+                return
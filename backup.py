@@ -0,0 +1,358 @@
+"""二进制快照和定期备份
+
+备份保存在数据文件旁边的data.json.backups目录(SQLite存储为data.db.backups)中,
+每个备份是一个二进制快照文件, 文件名为备份时间(UTC), 按时间轮换:
+保留最近KEEP_RECENT个, 另外保留最近KEEP_DAYS天中每天的最后一个。
+
+快照文件结构(整数均为小端):
+- 魔数MAGIC, 然后 uint32头部长度 + uint32头部CRC32 + 头部JSON
+  (版本、备份时间、压缩方式、各表的列、各表的记录数)
+- 若干数据块, 每块 BLOCK_HEADER(表, 压缩方式, 记录数, 压缩后长度, 未压缩数据的CRC32) + 压缩后的数据
+- 结束块: 表为END, 记录数为全部记录数, 用于发现被截断的文件
+数据块按列存放: 键(学号、账户名)和COLUMNS中的字符串字段为字符串列, 数值字段为float64列,
+字段或值的类型与COLUMNS不一致的少数记录整条以JSON另外存放(行号的uint32数组 + 字符串列)。
+字符串列为用NUL分隔的UTF-8字节(有字符串含NUL时为各字符串长度的uint32数组加拼接后的字节)。
+读取时校验每一块的CRC, 备份损坏或不完整时抛出ValueError, 不会读出部分数据。
+"""
+import os
+import sys
+import json
+import lzma
+import zlib
+import struct
+from array import array
+from itertools import accumulate
+from datetime import datetime, timezone
+from time import time, strftime, gmtime, localtime
+
+import metrics
+from storage import SCORE_FIELDS
+
+MAGIC = b'SMSNAP1\n'
+FORMAT_VERSION = 1
+BLOCK_ROWS = 65536
+BLOCK_HEADER = struct.Struct('<BBIII')
+STUDENTS, ACCOUNTS, END = 0, 1, 255
+TABLES = {STUDENTS: 'students', ACCOUNTS: 'accounts'}
+# 各表按列存放的字段及类型('s'字符串, 'd' float64), 写入头部, 读取时以头部为准
+COLUMNS = {
+    'students': [['name', 's']] + [[field, 'd'] for field in SCORE_FIELDS],
+    'accounts': [['password', 's'], ['role', 's']],
+}
+CODECS = {'none': 0, 'zlib': 1, 'lzma': 2}
+KEEP_RECENT = 24
+KEEP_DAYS = 30
+SUFFIX = '.snap'
+_MISSING = float('nan')
+_UTC = timezone.utc
+
+
+def _compress(codec, data):
+    if codec == 1:
+        return zlib.compress(data, 1)  # 更高的压缩级别慢很多, 只小10%左右, 需要更小时用lzma
+    if codec == 2:
+        return lzma.compress(data, preset=1)
+    return data
+
+
+def _decompress(codec, data):
+    if codec == 1:
+        return zlib.decompress(data)
+    if codec == 2:
+        return lzma.decompress(data)
+    if codec == 0:
+        return data
+    raise ValueError(f"未知的压缩方式: {codec}")
+
+
+def _pack_numbers(values):
+    numbers = array('d', values)
+    if sys.byteorder == 'big':
+        numbers.byteswap()
+    return numbers.tobytes()
+
+
+def _unpack_numbers(data):
+    numbers = array('d')
+    numbers.frombytes(data)
+    if sys.byteorder == 'big':
+        numbers.byteswap()
+    return numbers
+
+
+def _pack_strings(strings):
+    """字符串列: 通常用NUL分隔后整体编码, 读取时一次split; 有字符串含NUL时改为记录各自的长度"""
+    text = '\0'.join(strings)
+    if text.count('\0') == max(len(strings) - 1, 0):
+        blob = text.encode('utf-8')
+        return struct.pack('<BII', 0, len(strings), len(blob)) + blob
+    lengths = array('I', map(len, strings))
+    if sys.byteorder == 'big':
+        lengths.byteswap()
+    blob = ''.join(strings).encode('utf-8')
+    return struct.pack('<BII', 1, len(lengths), len(blob)) + lengths.tobytes() + blob
+
+
+def _unpack_strings(data, pos):
+    """从pos开始读取一个字符串列, 返回(字符串列表, 结束位置)"""
+    separated, count, size = struct.unpack_from('<BII', data, pos)
+    pos += 9
+    if separated == 0:
+        text = data[pos:pos + size].decode('utf-8')
+        return (text.split('\0') if count else []), pos + size
+    lengths = array('I')
+    lengths.frombytes(data[pos:pos + count * 4])
+    if sys.byteorder == 'big':
+        lengths.byteswap()
+    pos += count * 4
+    text = data[pos:pos + size].decode('utf-8')
+    ends = list(accumulate(lengths))
+    return [text[end - length:end] for end, length in zip(ends, lengths)], pos + size
+
+
+def _encode_block(items, columns):
+    """把一块记录按列编码, columns为[(字段, 类型)], 类型's'为字符串列, 'd'为float64列
+
+    字段不是正好这些、或值的类型不符(整数、None等)的记录很少, 整条以JSON另外保存,
+    这样其余记录可以整列检查和打包, 读出的记录与写入的完全相同。
+    """
+    keys = [key for key, _ in items]
+    records = [record for _, record in items]
+    fields = frozenset(field for field, _ in columns)
+    odd = {i for i, record in enumerate(records) if record.keys() != fields}
+    values = []
+    for field, kind in columns:
+        expected = str if kind == 's' else float
+        column = [record.get(field) for record in records]
+        if not set(map(type, column)) <= {expected}:
+            odd.update(i for i, value in enumerate(column) if type(value) is not expected)
+        values.append(column)
+    for i in odd:
+        for column, (_, kind) in zip(values, columns):
+            column[i] = '' if kind == 's' else _MISSING
+    odd = sorted(odd)
+    parts = [_pack_strings(keys)]
+    for column, (_, kind) in zip(values, columns):
+        parts.append(_pack_strings(column) if kind == 's' else _pack_numbers(column))
+    rows = array('I', odd)
+    if sys.byteorder == 'big':
+        rows.byteswap()
+    parts.append(struct.pack('<I', len(rows)) + rows.tobytes())
+    parts.append(_pack_strings([json.dumps(records[i], ensure_ascii=False, separators=(',', ':'))
+                                for i in odd]))
+    return b''.join(parts)
+
+
+def _decode_block(data, count, columns):
+    """_encode_block的逆运算, 返回(键, 记录)的迭代器"""
+    keys, pos = _unpack_strings(data, 0)
+    values = []
+    for _, kind in columns:
+        if kind == 's':
+            column, pos = _unpack_strings(data, pos)
+        else:
+            column = _unpack_numbers(data[pos:pos + count * 8])
+            pos += count * 8
+        values.append(column)
+    names = [field for field, _ in columns]
+    records = [dict(zip(names, row)) for row in zip(*values)]
+    odd_count, = struct.unpack_from('<I', data, pos)
+    pos += 4
+    rows = array('I')
+    rows.frombytes(data[pos:pos + odd_count * 4])
+    if sys.byteorder == 'big':
+        rows.byteswap()
+    odd, _ = _unpack_strings(data, pos + odd_count * 4)
+    for i, text in zip(rows, odd):
+        records[i] = json.loads(text)
+    return zip(keys, records)
+
+
+def _blocks(table):
+    items = iter(table.items())
+    while True:
+        block = [item for _, item in zip(range(BLOCK_ROWS), items)]
+        if not block:
+            return
+        yield block
+
+
+@metrics.timed('backup.write')
+def write_snapshot(path, students, accounts, codec='zlib', created=None):
+    """把students和accounts写成二进制快照, 先写临时文件再替换, 返回写出的字节数"""
+    if codec not in CODECS:
+        raise ValueError(f"不支持的压缩方式: {codec}, 可选 {', '.join(CODECS)}")
+    code = CODECS[codec]
+    header = json.dumps({
+        'version': FORMAT_VERSION,
+        'created': round(created if created is not None else time(), 3),
+        'codec': codec,
+        'columns': COLUMNS,
+        'counts': {'students': len(students), 'accounts': len(accounts)},
+    }, ensure_ascii=False).encode('utf-8')
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    rows = 0
+    with open(tmp_file, 'wb') as f:
+        size = f.write(MAGIC + struct.pack('<II', len(header), zlib.crc32(header)) + header)
+        for table, records in ((STUDENTS, students), (ACCOUNTS, accounts)):
+            for block in _blocks(records):
+                data = _encode_block(block, COLUMNS[TABLES[table]])
+                packed = _compress(code, data)
+                size += f.write(BLOCK_HEADER.pack(table, code, len(block), len(packed), zlib.crc32(data)))
+                size += f.write(packed)
+                rows += len(block)
+        size += f.write(BLOCK_HEADER.pack(END, 0, rows, 0, 0))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+    return size
+
+
+def read_header(path):
+    """读取快照的头部信息, 不是有效的快照时抛出ValueError"""
+    with open(path, 'rb') as f:
+        return _read_header(f, path)
+
+
+def _read_header(f, path):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"不是备份文件: {path}")
+    prefix = f.read(8)
+    if len(prefix) < 8:
+        raise ValueError(f"备份文件不完整: {path}")
+    length, crc = struct.unpack('<II', prefix)
+    data = f.read(length)
+    if len(data) < length or zlib.crc32(data) != crc:
+        raise ValueError(f"备份文件头部已损坏: {path}")
+    header = json.loads(data)
+    if header.get('version') != FORMAT_VERSION:
+        raise ValueError(f"不支持的备份文件版本: {header.get('version')}")
+    return header
+
+
+@metrics.timed('backup.read')
+def read_snapshot(path):
+    """读取二进制快照, 返回(students, accounts)两个字典
+
+    任何一块校验失败或文件被截断时抛出ValueError。
+    """
+    tables = {STUDENTS: {}, ACCOUNTS: {}}
+    with open(path, 'rb') as f:
+        header = _read_header(f, path)
+        columns = {table: header['columns'][name] for table, name in TABLES.items()}
+        rows = 0
+        while True:
+            block_header = f.read(BLOCK_HEADER.size)
+            if len(block_header) < BLOCK_HEADER.size:
+                raise ValueError(f"备份文件不完整: {path}")
+            table, code, count, length, crc = BLOCK_HEADER.unpack(block_header)
+            if table == END:
+                if count != rows:
+                    raise ValueError(f"备份文件记录数不一致: {path}")
+                break
+            packed = f.read(length)
+            try:
+                data = _decompress(code, packed) if len(packed) == length else None
+            except (zlib.error, lzma.LZMAError):
+                data = None
+            if data is None or zlib.crc32(data) != crc or table not in tables:
+                raise ValueError(f"备份文件已损坏(第{rows + 1}条记录所在的数据块): {path}")
+            tables[table].update(_decode_block(data, count, columns[table]))
+            rows += count
+    return tables[STUDENTS], tables[ACCOUNTS]
+
+
+class Backup:
+    """一个备份文件"""
+    __slots__ = ('path', 'time', 'size')
+
+    def __init__(self, path, time, size):
+        self.path = path
+        self.time = time
+        self.size = size
+
+    def describe(self):
+        """一行说明, 如"2024-06-01 12:00:00  1.2MB" """
+        return f"{strftime('%Y-%m-%d %H:%M:%S', localtime(self.time))}  {self.size / 2**20:.1f}MB"
+
+
+def parse_time(text):
+    """解析"2024-06-01 12:00[:00]"或"2024-06-01"形式的本地时间, 返回时间戳"""
+    try:
+        return datetime.fromisoformat(text.strip()).timestamp()
+    except ValueError:
+        raise ValueError(f"时间格式错误: {text}, 应为 2024-06-01 12:00") from None
+
+
+class BackupSet:
+    """备份目录中按时间排列的备份"""
+
+    def __init__(self, directory, keep=KEEP_RECENT, keep_days=KEEP_DAYS):
+        self.directory = directory
+        self.keep = keep
+        self.keep_days = keep_days
+
+    def _name(self, created):
+        return strftime('%Y%m%d-%H%M%S', gmtime(created)) + f"-{int(created * 1000) % 1000:03d}{SUFFIX}"
+
+    @staticmethod
+    def _parse_name(name):
+        try:
+            stamp = datetime.strptime(name[:-len(SUFFIX)] + '000', '%Y%m%d-%H%M%S-%f')
+        except ValueError:
+            return None
+        return stamp.replace(tzinfo=_UTC).timestamp()
+
+    def list(self):
+        """全部备份, 按时间从早到晚"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        backups = []
+        for name in names:
+            created = self._parse_name(name) if name.endswith(SUFFIX) else None
+            if created is not None:
+                path = os.path.join(self.directory, name)
+                backups.append(Backup(path, created, os.path.getsize(path)))
+        return sorted(backups, key=lambda backup: backup.time)
+
+    def due(self, interval):
+        """最近一次备份距今是否已超过interval秒"""
+        backups = self.list()
+        return not backups or time() - backups[-1].time >= interval
+
+    def create(self, students, accounts, codec='zlib'):
+        """备份students和accounts并轮换旧备份, 返回Backup"""
+        os.makedirs(self.directory, exist_ok=True)
+        created = time()
+        path = os.path.join(self.directory, self._name(created))
+        size = write_snapshot(path, students, accounts, codec, created)
+        self.rotate()
+        return Backup(path, self._parse_name(os.path.basename(path)), size)
+
+    def find(self, at=None):
+        """at(时间戳)时刻或之前的最后一个备份, at为None时为最新的备份, 没有时抛出ValueError"""
+        candidates = [backup for backup in self.list() if at is None or backup.time <= at]
+        if not candidates:
+            raise ValueError("没有该时间之前的备份" if at is not None else "还没有备份")
+        return candidates[-1]
+
+    def rotate(self):
+        """删除轮换规则之外的旧备份, 返回删除的个数"""
+        backups = self.list()
+        keep = {backup.path for backup in backups[-self.keep:]} if self.keep else set()
+        days = {}
+        for backup in backups:
+            days[strftime('%Y-%m-%d', localtime(backup.time))] = backup.path
+        if self.keep_days:
+            keep.update(path for _, path in sorted(days.items())[-self.keep_days:])
+        removed = 0
+        for backup in backups:
+            if backup.path not in keep:
+                try:
+                    os.remove(backup.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
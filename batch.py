@@ -0,0 +1,120 @@
+"""批量操作
+
+从文件或标准输入逐行读取JSON格式的操作并应用到GradeService, 整批只加载和保存一次。
+空行和以#开头的行会被忽略。支持的操作:
+
+    {"op": "add", "id": "1001", "name": "张三", "chinese": 90, "math": 80, "english": 70}
+    {"op": "update", "id": "1001", "math": 95}
+    {"op": "delete", "id": "1001"}
+    {"op": "get", "id": "1001"}
+    {"op": "password", "user": "1001", "password": "新密码"}
+    {"op": "reset_password", "user": "1001"}
+
+get的结果以JSON行写到输出流; 出错的行会被跳过并报告, 不影响其他行。
+"""
+import json
+
+from storage import SUBJECTS
+from importer import parse_score
+from service import DEFAULT_PASSWORD
+
+
+class BatchResult:
+    """批量操作结果: 成功执行的操作数和出错的行"""
+
+    def __init__(self):
+        self.applied = 0
+        self.errors = []    # [(行号, 错误信息)]
+
+    def add_error(self, line_no, message):
+        self.errors.append((line_no, message))
+
+
+def iter_operations(lines):
+    """逐行解析操作, 生成(行号, 操作字典或解析错误)"""
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            operation = json.loads(line)
+        except ValueError as e:
+            yield line_no, ValueError(f"不是有效的JSON: {e}")
+            continue
+        if not isinstance(operation, dict):
+            yield line_no, ValueError("每行必须是一个JSON对象")
+            continue
+        yield line_no, operation
+
+
+def _field(operation, name):
+    value = operation.get(name)
+    if value is None or value == '':
+        raise ValueError(f"缺少字段: {name}")
+    return str(value)
+
+
+def _scores(operation, required):
+    """读取各科成绩, 返回 {科目: 成绩}; required为False时只包含给出的科目"""
+    scores = {}
+    for subject in SUBJECTS:
+        if subject in operation:
+            scores[subject] = parse_score(operation[subject], subject)
+        elif required:
+            raise ValueError(f"缺少字段: {subject}")
+    return scores
+
+
+def apply_operation(service, operation, out, new_accounts):
+    """执行一条操作
+
+    新学生的学号记入new_accounts(按插入顺序的字典), 账户在整批结束后统一创建。
+    """
+    op = operation.get('op')
+    if op == 'add':
+        student_id = _field(operation, 'id')
+        service.register_student(student_id, _field(operation, 'name'),
+                                 _scores(operation, True), create_account=False)
+        new_accounts[student_id] = None
+    elif op == 'update':
+        service.update_scores(_field(operation, 'id'), _scores(operation, False))
+    elif op == 'delete':
+        student_id = _field(operation, 'id')
+        service.remove_student(student_id)
+        new_accounts.pop(student_id, None)
+    elif op == 'get':
+        student_id = _field(operation, 'id')
+        record = dict(service.get_student(student_id), id=student_id)
+        out.write(json.dumps(record, ensure_ascii=False) + '\n')
+    elif op in ('password', 'reset_password'):
+        username = _field(operation, 'user')
+        password = _field(operation, 'password') if op == 'password' else DEFAULT_PASSWORD
+        if username in new_accounts:  # 本批新增的学生先创建账户
+            del new_accounts[username]
+            service.add_student_account(username, None)
+        service.set_password(username, password)
+    else:
+        raise ValueError(f"未知的操作: {op}")
+
+
+def run_batch(service, lines, out):
+    """执行一批操作, 返回BatchResult
+
+    这里不提交修改, 由调用方在结束后统一提交一次。
+    """
+    result = BatchResult()
+    new_accounts = {}
+    for line_no, operation in iter_operations(lines):
+        if isinstance(operation, ValueError):
+            result.add_error(line_no, str(operation))
+            continue
+        try:
+            apply_operation(service, operation, out, new_accounts)
+        except ValueError as e:
+            result.add_error(line_no, str(e))
+            continue
+        result.applied += 1
+
+    # 密码哈希较慢, 新学生的账户最后一起并行创建
+    service.add_student_accounts(list(new_accounts))
+    return result
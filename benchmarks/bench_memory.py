@@ -0,0 +1,38 @@
+"""比较字典存储与列式存储的内存占用
+
+用法: python benchmarks/bench_memory.py [学生数 ...]
+默认测试 10^5 和 10^6 个学生。
+"""
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from columnar import ColumnarStudentStore  # noqa: E402
+from synthetic import make_students  # noqa: E402
+
+
+def measure(factory, count):
+    """返回构造存储后的内存占用(字节)"""
+    tracemalloc.start()
+    store = factory(make_students(count))
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(store) == count
+    return current
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10 ** 5, 10 ** 6]
+    print(f"{'学生数':>10} {'dict(MB)':>10} {'列式(MB)':>10} {'每条dict(B)':>12} {'每条列式(B)':>12}")
+    for count in sizes:
+        dict_bytes = measure(dict, count)
+        columnar_bytes = measure(ColumnarStudentStore, count)
+        print(f"{count:>10} {dict_bytes / 2**20:>10.1f} {columnar_bytes / 2**20:>10.1f} "
+              f"{dict_bytes / count:>12.0f} {columnar_bytes / count:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
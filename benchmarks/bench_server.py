@@ -0,0 +1,199 @@
+"""HTTP接口压力测试
+
+用法: python benchmarks/bench_server.py [--url http://127.0.0.1:8000] [--students 1000]
+      [--connections 32] [--duration 10] [--write-ratio 0.1]
+
+不指定--url时在临时目录中启动 main.py serve(使用较小的PBKDF2迭代次数以便快速准备数据),
+先通过/import写入测试学生, 然后由多个保持连接的客户端并发发送请求:
+读请求为 GET /students/<学号>, 写请求为 PATCH /students/<学号>。
+结束后输出每秒请求数和读写请求各自的p50/p99延迟。
+"""
+import os
+import sys
+import json
+import socket
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from time import perf_counter
+from urllib.parse import urlsplit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+class Client:
+    """保持连接的最小HTTP/1.1客户端"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.token = None
+        self._reader = self._writer = None
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, data=None, body=None):
+        if data is not None:
+            body = json.dumps(data).encode('utf-8')
+        body = body or b''
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n"
+        if self.token:
+            head += f"Authorization: Bearer {self.token}\r\n"
+        self._writer.write(head.encode('latin-1') + b'\r\n' + body)
+        await self._writer.drain()
+
+        status = int((await self._reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        payload = await self._reader.readexactly(length)
+        return status, json.loads(payload) if payload else None
+
+    async def login(self, username, password):
+        status, data = await self.request('POST', '/login', {'username': username, 'password': password})
+        if status != 200:
+            raise RuntimeError(f"登录失败: {data}")
+        self.token = data['token']
+
+    def close(self):
+        self._writer.close()
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+async def seed(host, port, count):
+    client = Client(host, port)
+    await client.connect()
+    await client.login('admin', '123456')
+    rng = random.Random(0)
+    lines = ['id,name,chinese,math,english']
+    lines += [f"B{i:07d},学生{i},{rng.randint(0, 100)},{rng.randint(0, 100)},{rng.randint(0, 100)}"
+              for i in range(count)]
+    status, data = await client.request('POST', '/import', body='\n'.join(lines).encode('utf-8'))
+    client.close()
+    if status != 200:
+        raise RuntimeError(f"导入测试数据失败: {data}")
+    return [f"B{i:07d}" for i in range(count)]
+
+
+async def worker(host, port, ids, deadline, write_ratio, latencies, errors, seed_value):
+    rng = random.Random(seed_value)
+    client = Client(host, port)
+    await client.connect()
+    await client.login('admin', '123456')
+    while perf_counter() < deadline:
+        student_id = rng.choice(ids)
+        is_write = rng.random() < write_ratio
+        start = perf_counter()
+        if is_write:
+            status, _ = await client.request('PATCH', f'/students/{student_id}',
+                                             {'math': rng.randint(0, 100)})
+        else:
+            status, _ = await client.request('GET', f'/students/{student_id}')
+        latencies['write' if is_write else 'read'].append(perf_counter() - start)
+        if status != 200:
+            errors.append(status)
+    client.close()
+
+
+async def run(host, port, args):
+    ids = await seed(host, port, args.students)
+    latencies = {'read': [], 'write': []}
+    errors = []
+    start = perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*(worker(host, port, ids, deadline, args.write_ratio, latencies, errors, i)
+                           for i in range(args.connections)))
+    elapsed = perf_counter() - start
+
+    report = {'connections': args.connections, 'seconds': round(elapsed, 2), 'errors': len(errors)}
+    total = 0
+    for kind, values in latencies.items():
+        values.sort()
+        total += len(values)
+        report[kind] = {
+            'requests': len(values),
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+        }
+    report['requests'] = total
+    report['rps'] = round(total / elapsed, 1)
+    return report
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def wait_for_port(host, port, timeout=30):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if loop.time() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP接口压力测试")
+    parser.add_argument('--url', help="已启动的服务地址, 省略时自动启动临时服务")
+    parser.add_argument('--students', type=int, default=1000, help="测试学生数, 默认1000")
+    parser.add_argument('--connections', type=int, default=32, help="并发连接数, 默认32")
+    parser.add_argument('--duration', type=float, default=10, help="测试时长(秒), 默认10")
+    parser.add_argument('--write-ratio', type=float, default=0.1, help="写请求比例, 默认0.1")
+    parser.add_argument('--json', action='store_true', help="以JSON格式输出结果")
+    args = parser.parse_args()
+
+    process = None
+    workdir = None
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port = parts.hostname, parts.port or 80
+    else:
+        host, port = '127.0.0.1', free_port()
+        workdir = tempfile.TemporaryDirectory()
+        env = dict(os.environ, STUDENT_MANAGER_PBKDF2_ITERATIONS='1000')
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'main.py'), 'serve',
+                                    '--host', host, '--port', str(port)],
+                                   cwd=workdir.name, env=env, stderr=subprocess.DEVNULL)
+    try:
+        if process is not None:
+            asyncio.run(wait_for_port(host, port))
+        report = asyncio.run(run(host, port, args))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+            workdir.cleanup()
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+        return
+    print(f"{report['requests']}个请求, {report['seconds']}秒, {report['rps']}请求/秒, "
+          f"{report['connections']}个连接, 错误{report['errors']}个")
+    for kind in ('read', 'write'):
+        r = report[kind]
+        print(f"{'读' if kind == 'read' else '写'}: {r['requests']}个, p50 {r['p50_ms']}ms, p99 {r['p99_ms']}ms")
+
+
+if __name__ == '__main__':
+    main()
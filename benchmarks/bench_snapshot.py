@@ -0,0 +1,67 @@
+"""比较二进制快照(备份格式)与data.json的保存和加载耗时、文件大小
+
+用法: python benchmarks/bench_snapshot.py [学生数 ...]
+默认测试 10^4、10^5 和 10^6 个学生。JSON为JsonStorage写出完整快照(compact)
+和完整解析快照(不按需读取)的耗时; 二进制快照分别测试不压缩、zlib和lzma。
+加载耗时都包括构造出全部学生记录(字典)的时间。
+"""
+import os
+import sys
+import gc
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import make_students, FAKE_HASH  # noqa: E402
+from storage import JsonStorage  # noqa: E402
+from backup import CODECS, write_snapshot, read_snapshot  # noqa: E402
+
+
+def timed(func):
+    gc.collect()
+    start = perf_counter()
+    result = func()
+    return perf_counter() - start, result
+
+
+def bench_json(path, students, accounts):
+    storage = JsonStorage(path, journal=False)
+    storage.load({})
+    storage.students.update(students)
+    storage.accounts.update(accounts)
+    save, _ = timed(storage.compact)
+    storage.close()
+    size = os.path.getsize(path)
+    storage = JsonStorage(path, journal=False)
+    load, loaded = timed(lambda: storage.load({}))
+    assert len(loaded[0]) == len(students)
+    storage.close()
+    return save, load, size
+
+
+def bench_binary(path, students, accounts, codec):
+    save, size = timed(lambda: write_snapshot(path, students, accounts, codec))
+    load, loaded = timed(lambda: read_snapshot(path))
+    assert len(loaded[0]) == len(students)
+    return save, load, size
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [10**4, 10**5, 10**6]
+    print(f"{'学生数':>10} {'格式':>8} {'保存(ms)':>10} {'加载(ms)':>10} {'大小(MB)':>10}")
+    for count in counts:
+        students = dict(make_students(count))
+        accounts = {key: {'password': FAKE_HASH, 'role': 'student'} for key in students}
+        with tempfile.TemporaryDirectory() as workdir:
+            results = [('json', bench_json(os.path.join(workdir, 'data.json'), students, accounts))]
+            for codec in CODECS:
+                path = os.path.join(workdir, f'{codec}.snap')
+                results.append((codec, bench_binary(path, students, accounts, codec)))
+            for name, (save, load, size) in results:
+                print(f"{count:>10} {name:>8} {save * 1000:>10.1f} {load * 1000:>10.1f} {size / 2**20:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
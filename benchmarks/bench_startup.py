@@ -0,0 +1,62 @@
+"""比较按需读取(偏移索引+mmap)与完整解析data.json的启动时间
+
+用法: python benchmarks/bench_startup.py [学生数 ...]
+默认测试 10^4、10^5 和 10^6 个学生。每种方式在新的子进程中计时:
+启动时间为创建GradeService(进入登录界面前)的耗时, 另外给出第一次查询一个学生
+(需要建立学号索引)的耗时和进程的峰值内存。
+"""
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import write_dataset, student_id  # noqa: E402
+
+# 在子进程中执行, 输出各阶段耗时(秒)和峰值内存(MB)
+PROBE = """
+import sys, json, resource
+from time import perf_counter
+sys.path.insert(0, sys.argv[1])
+start = perf_counter()
+from service import GradeService
+service = GradeService()
+startup = perf_counter() - start
+start = perf_counter()
+service.get_student(sys.argv[2])
+first_query = perf_counter() - start
+try:  # ru_maxrss在exec之后仍包含父进程的峰值, Linux上改用VmHWM
+    with open('/proc/self/status') as f:
+        peak = int(next(line for line in f if line.startswith('VmHWM')).split()[1]) / 1024
+except OSError:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps([startup, first_query, peak]))
+"""
+
+
+def probe(workdir, student_id, lazy):
+    env = dict(os.environ, STUDENT_MANAGER_STORAGE='json', STUDENT_MANAGER_COLUMNAR='0',
+               STUDENT_MANAGER_LAZY='1' if lazy else '0')
+    output = subprocess.run([sys.executable, '-c', PROBE, ROOT, student_id], cwd=workdir,
+                            env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [10**4, 10**5, 10**6]
+    print(f"{'学生数':>10} {'方式':>6} {'启动(ms)':>10} {'首次查询(ms)':>12} {'峰值内存(MB)':>12}")
+    for count in counts:
+        with tempfile.TemporaryDirectory() as workdir:
+            write_dataset(workdir, count)
+            for lazy in (False, True):
+                startup, first_query, peak = probe(workdir, student_id(count // 2), lazy)
+                print(f"{count:>10} {'按需' if lazy else '完整':>6} {startup * 1000:>10.1f} "
+                      f"{first_query * 1000:>12.1f} {peak:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
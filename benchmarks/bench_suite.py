@@ -0,0 +1,302 @@
+"""性能基准测试套件
+
+用法: python benchmarks/bench_suite.py [--sizes 1000,10000,100000] [--backend json|sqlite|sharded]
+      [--output 结果.json] [--compare 旧结果.json] [--data-dir 目录]
+
+对每个学生数用synthetic.py生成确定性的数据(--data-dir指定时缓存在该目录, 可在多次运行
+之间复用, 10^7个学生的数据生成较慢), 然后在新的子进程中测量:
+
+- load_ms: 创建交互界面对象(加载数据)的耗时, load_rss_mb为此时的峰值内存
+- first_query_ms / query_p50_us / query_p99_us: 第一次和之后按学号查询的耗时
+- scan_ms: 读取全部学生记录; sort_ms: 全部学生按总分排序
+- rank_build_ms / rank_p50_us / rank_p99_us / top_ms: 排名索引的建立、查询名次和前100名
+- search_build_ms / search_p50_us / search_p99_us: 搜索索引的建立和按姓名前缀搜索
+- stats_ms: 全部科目的统计分析; shard_stats_ms: 按分片(班级)分别统计, 未加载的分片在进程池中计算
+- mutation_p50_ms / mutation_p99_ms / mutation_mean_ms: 修改一名学生并立即提交(flush)
+- ui_mutation_p99_ms: 交互界面中修改一名学生的耗时(save只交给后台线程, 不等待写入)
+- batch_mutation_ms: 一次提交多条修改时平均每条修改的耗时
+- save_ms: 写出完整快照(仅JSON后端)
+- exam_record_ms: 把全体学生的成绩记为一次考试; trend_p50_us / trend_p99_us: 查询一名学生
+  在各次考试中的成绩; exam_averages_us: 各次考试平均分; improved_ms / improved_scan_ms:
+  相邻两次考试进步最多的前10名(预先计算)和前IMPROVED_TOP+1名(扫描成绩列)
+- report_ms / report_incremental_ms: 生成全部HTML成绩单和班级报告, 以及修改几名学生后
+  再次生成(只重新生成内容有变化的报告)
+- roster_open_ms / roster_frame_ms / search_frame_ms / stats_frame_ms: 用fakescreen无界面地
+  驱动学生列表、搜索和统计界面, 打开界面和之后每一帧的耗时
+- roster_sort_frame_ms / roster_filter_frame_ms: 学生列表改为按绩点排序、再筛选第一门科目
+  不及格的学生后, 包括切换在内平均每帧(翻一页)的耗时
+- peak_rss_mb: 子进程的峰值内存
+
+结果以JSON输出(默认到标准输出), 所有指标都是越小越好。--compare与之前保存的结果对比,
+有指标变慢超过--threshold时列出并以返回码1退出, 可用于比较不同版本。
+"""
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from time import perf_counter, strftime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic import write_dataset, student_id  # noqa: E402
+
+DEFAULT_SIZES = (10 ** 3, 10 ** 4, 10 ** 5)
+RENDER_FRAMES = 50
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def _timed(func, *args):
+    """返回(耗时秒数, 返回值)"""
+    start = perf_counter()
+    value = func(*args)
+    return perf_counter() - start, value
+
+
+def _latencies(func, args_list, scale):
+    """依次调用func, 返回耗时的p50和p99(乘以scale换算单位)"""
+    times = [_timed(func, *args)[0] * scale for args in args_list]
+    return round(_percentile(times, 50), 3), round(_percentile(times, 99), 3)
+
+
+def _peak_rss_mb():
+    """进程的峰值内存, Linux上读取VmHWM(ru_maxrss在exec之后仍包含父进程的峰值)"""
+    try:
+        with open('/proc/self/status') as f:
+            return int(next(line for line in f if line.startswith('VmHWM')).split()[1]) / 1024
+    except (OSError, StopIteration):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_probe(args):
+    """在数据目录(当前目录)中测量各项指标, 结果以JSON输出到标准输出"""
+    import fakescreen
+    fakescreen.install()
+    import curses
+    from main import EnhancedStudentGradeSystem
+    from schema import SCHEMA
+    from stats import class_statistics
+    from timeseries import IMPROVED_TOP
+
+    ms = 1000.0
+    result = {}
+    screen = fakescreen.FakeScreen()
+    seconds, system = _timed(EnhancedStudentGradeSystem, screen)
+    result['load_ms'] = seconds * ms
+    result['load_rss_mb'] = _peak_rss_mb()
+    count = len(system.students)
+    rng = random.Random(args.seed)
+    ids = [student_id(rng.randrange(count)) for _ in range(args.queries)]
+
+    # 查询
+    result['first_query_ms'] = _timed(system.get_student, ids[0])[0] * ms
+    # 在遍历全部学生之前测量, 此时分片存储只加载了一个分片, 其余分片在进程池中计算
+    result['shard_stats_ms'] = _timed(system.shard_statistics)[0] * ms
+    result['query_p50_us'], result['query_p99_us'] = _latencies(
+        system.get_student, [(i,) for i in ids], 1e6)
+    start = perf_counter()
+    for _ in system.students.values():
+        pass
+    result['scan_ms'] = (perf_counter() - start) * ms
+    start = perf_counter()
+    sorted(system.students.items(), key=lambda item: item[1]['total'], reverse=True)
+    result['sort_ms'] = (perf_counter() - start) * ms
+
+    # 排名和搜索
+    result['rank_build_ms'] = _timed(system.ranking.rank, 'total', 0.0)[0] * ms
+    result['rank_p50_us'], result['rank_p99_us'] = _latencies(
+        system.ranking.rank, [('total', system.students[i]['total']) for i in ids], 1e6)
+    result['top_ms'] = _timed(system.ranking.top, 'total', 100)[0] * ms
+    result['search_build_ms'] = _timed(system.search_index.build)[0] * ms
+    prefixes = [system.students[i]['name'][:2] for i in ids]
+    result['search_p50_us'], result['search_p99_us'] = _latencies(
+        system.search_index.search, [(prefix,) for prefix in prefixes], 1e6)
+    result['stats_ms'] = _timed(class_statistics, system.students)[0] * ms
+
+    # 修改: 逐条提交, 然后一次提交一批, 最后恢复原来的成绩, 缓存的数据可以重复使用
+    subject = SCHEMA.subjects[0]
+    changed = list(dict.fromkeys(ids[:args.mutations]))
+    originals = {i: system.students[i] for i in changed}
+
+    def new_score(record):
+        score = record[subject.key]
+        return score - 0.5 if score >= subject.full_mark else score + 0.5
+
+    def mutate(i, save):
+        system.update_scores(i, {subject.key: new_score(system.students[i])})
+        save()
+
+    # 修改前后各记录一次考试, 用于测量成绩历史的查询
+    exams_file = system.exams.path
+    if os.path.exists(exams_file):
+        os.remove(exams_file)
+    result['exam_record_ms'] = _timed(system.record_exam, 'before')[0] * ms
+    times = [_timed(mutate, i, system.flush)[0] * ms for i in changed]
+    result['mutation_p50_ms'] = _percentile(times, 50)
+    result['mutation_p99_ms'] = _percentile(times, 99)
+    result['mutation_mean_ms'] = sum(times) / len(times)
+    times = [_timed(mutate, i, system.save)[0] * ms for i in changed]
+    result['ui_mutation_p99_ms'] = _percentile(times, 99)
+    system.flush()
+    start = perf_counter()
+    for i in changed:
+        system.update_scores(i, {subject.key: new_score(system.students[i])})
+    system.flush()
+    result['batch_mutation_ms'] = (perf_counter() - start) * ms / len(changed)
+    system.record_exam('after')
+    result['trend_p50_us'], result['trend_p99_us'] = _latencies(
+        system.exams.trajectory, [(i,) for i in ids], 1e6)
+    result['exam_averages_us'] = _timed(system.exams.averages, 'total')[0] * 1e6
+    result['improved_ms'] = _timed(system.exams.most_improved, subject.key, 10)[0] * ms
+    result['improved_scan_ms'] = _timed(
+        system.exams.most_improved, subject.key, IMPROVED_TOP + 1)[0] * ms
+    # 成绩单: 第一次全部生成, 再修改几名学生后增量生成
+    report_dir = tempfile.mkdtemp(prefix='reports-')
+    result['report_ms'] = _timed(system.generate_reports, report_dir)[0] * ms
+    for i in changed:
+        system.update_scores(i, {subject.key: new_score(system.students[i])})
+    result['report_incremental_ms'] = _timed(system.generate_reports, report_dir)[0] * ms
+    shutil.rmtree(report_dir)
+    os.remove(exams_file)
+    for i, record in originals.items():
+        system._commit_change('students', i, record)
+    system.flush()
+    if hasattr(system.storage, 'compact'):
+        result['save_ms'] = _timed(system.storage.compact)[0] * ms
+
+    # 界面绘制
+    system.current_user = 'admin'
+    result['roster_open_ms'] = _timed(system.show_all_students)[0] * ms
+    screen.feed([curses.KEY_NPAGE] * RENDER_FRAMES)
+    result['roster_frame_ms'] = _timed(system.show_all_students)[0] * ms / (RENDER_FRAMES + 1)
+    screen.feed([curses.KEY_LEFT] + [curses.KEY_NPAGE] * RENDER_FRAMES)
+    result['roster_sort_frame_ms'] = _timed(system.show_all_students)[0] * ms / (RENDER_FRAMES + 2)
+    screen.feed([curses.KEY_LEFT, 'f', 10, '<60', 10] + [curses.KEY_NPAGE] * RENDER_FRAMES)
+    result['roster_filter_frame_ms'] = _timed(system.show_all_students)[0] * ms / (RENDER_FRAMES + 2)
+    typed = []
+    for prefix in prefixes[:RENDER_FRAMES // 3]:
+        typed.extend(prefix)
+        typed.extend([curses.KEY_BACKSPACE] * len(prefix))
+    screen.feed(typed)
+    result['search_frame_ms'] = _timed(system.search_students)[0] * ms / (len(typed) + 1)
+    screen.feed([curses.KEY_RIGHT] * RENDER_FRAMES)
+    result['stats_frame_ms'] = _timed(system.show_statistics)[0] * ms / (RENDER_FRAMES + 1)
+
+    result['peak_rss_mb'] = _peak_rss_mb()
+    system.close()
+    print(json.dumps({key: round(value, 3) for key, value in result.items()}))
+
+
+def prepare_data(data_dir, count, backend, seed):
+    """生成(或复用已缓存的)数据目录, 返回(目录, 生成耗时秒数或None)"""
+    directory = os.path.join(data_dir, f"{backend}-{count}-{seed}")
+    done_marker = os.path.join(directory, '.complete')
+    if os.path.exists(done_marker):
+        return directory, None
+    seconds, _ = _timed(write_dataset, directory, count, backend, seed)
+    open(done_marker, 'w').close()
+    return directory, seconds
+
+
+def probe(directory, args):
+    env = dict(os.environ, STUDENT_MANAGER_STORAGE=args.backend, STUDENT_MANAGER_COLUMNAR='0',
+               STUDENT_MANAGER_LAZY='1')
+    command = [sys.executable, os.path.abspath(__file__), '--probe', '--seed', str(args.seed),
+               '--queries', str(args.queries), '--mutations', str(args.mutations)]
+    output = subprocess.run(command, cwd=directory, env=env, check=True,
+                            stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new, threshold):
+    """列出比旧结果慢(大)超过threshold比例的指标, 返回是否有变慢的指标"""
+    previous = {(r['backend'], r['students']): r['metrics'] for r in old['results']}
+    regressed = False
+    for result in new['results']:
+        base = previous.get((result['backend'], result['students']))
+        if base is None:
+            continue
+        for name, value in result['metrics'].items():
+            before = base.get(name)
+            if not before or value is None:
+                continue
+            ratio = value / before
+            if ratio > 1 + threshold:
+                regressed = True
+                print(f"变慢: {result['backend']} {result['students']} {name}: "
+                      f"{before:g} -> {value:g} ({ratio:.2f}x)", file=sys.stderr)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="学生成绩管理系统性能基准测试")
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help="学生数, 逗号分隔, 支持10^3到10^7")
+    parser.add_argument('--backend', choices=('json', 'sqlite', 'sharded'), default='json')
+    parser.add_argument('--seed', type=int, default=0, help="数据和查询的随机种子")
+    parser.add_argument('--queries', type=int, default=1000, help="查询、排名、搜索各测量多少次")
+    parser.add_argument('--mutations', type=int, default=1000, help="修改并保存多少次")
+    parser.add_argument('--data-dir', help="缓存生成数据的目录, 默认使用临时目录")
+    parser.add_argument('--output', help="结果JSON文件, 默认输出到标准输出")
+    parser.add_argument('--compare', help="与之前保存的结果JSON对比")
+    parser.add_argument('--threshold', type=float, default=0.2, help="对比时视为变慢的比例, 默认0.2")
+    parser.add_argument('--probe', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.probe:
+        run_probe(args)
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report = {
+            'revision': _git_revision(),
+            'time': strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'results': [],
+        }
+        for size in (int(size) for size in args.sizes.split(',')):
+            directory, generate_s = prepare_data(args.data_dir or tmp_dir, size, args.backend, args.seed)
+            print(f"测试 {args.backend} {size}个学生...", file=sys.stderr)
+            report['results'].append({
+                'backend': args.backend,
+                'students': size,
+                'generate_s': generate_s and round(generate_s, 3),
+                'metrics': probe(directory, args),
+            })
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            return 1 if compare(json.load(f), report, args.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
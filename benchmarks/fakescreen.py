@@ -0,0 +1,96 @@
+"""不需要终端的curses屏幕, 用于无界面地驱动交互界面
+
+FakeScreen实现了main.py用到的窗口方法, 按脚本依次返回按键, 脚本用完后返回ESC,
+保证任何界面最终都会退出。install()替换掉curses中必须先调用initscr()的函数。
+越界写入与真实终端一样抛出curses.error, 因此也能发现绘制越界的问题。
+"""
+import curses
+
+ESC = 27
+
+
+def install():
+    """让curses的全局函数在没有终端时也能调用"""
+    curses.curs_set = lambda visibility: 1
+    curses.echo = curses.noecho = curses.cbreak = curses.start_color = curses.doupdate = lambda: None
+    curses.has_colors = lambda: True
+    curses.init_pair = lambda pair, fg, bg: None
+    curses.color_pair = lambda pair: pair << 8
+
+
+class FakeScreen:
+    """固定大小的屏幕, 记录每一行的内容和写入次数"""
+
+    def __init__(self, height=40, width=120, keys=()):
+        self.height = height
+        self.width = width
+        self.rows = [''] * height
+        self.keys = list(keys)
+        self.writes = 0         # addstr/addch的调用次数
+        self.refreshes = 0      # refresh/noutrefresh的调用次数
+        self._cursor = (0, 0)
+
+    def feed(self, keys):
+        """追加按键, 整数为键码, 字符串中的每个字符作为一次输入"""
+        for key in keys:
+            if isinstance(key, str):
+                self.keys.extend(key)
+            else:
+                self.keys.append(key)
+
+    def text(self):
+        return '\n'.join(self.rows)
+
+    def getmaxyx(self):
+        return self.height, self.width
+
+    def getyx(self):
+        return self._cursor
+
+    def move(self, y, x):
+        if not (0 <= y < self.height and 0 <= x < self.width):
+            raise curses.error(f"move({y}, {x}) 超出屏幕")
+        self._cursor = (y, x)
+
+    def _put(self, y, x, text):
+        if not (0 <= y < self.height and 0 <= x < self.width) or \
+                (y == self.height - 1 and x + len(text) >= self.width):
+            raise curses.error(f"addstr({y}, {x}) 超出屏幕")
+        row = self.rows[y].ljust(x)
+        self.rows[y] = (row[:x] + text + row[x + len(text):])[:self.width]
+        self.writes += 1
+        self._cursor = (y, min(x + len(text), self.width - 1))
+
+    def addstr(self, y, x, text, attr=0):
+        self._put(y, x, text)
+
+    def addch(self, y, x, ch, attr=0):
+        self._put(y, x, ch if isinstance(ch, str) else chr(ch))
+
+    def clrtoeol(self):
+        y, x = self._cursor
+        self.rows[y] = self.rows[y][:x]
+
+    def erase(self):
+        self.rows = [''] * self.height
+
+    clear = erase
+
+    def refresh(self):
+        self.refreshes += 1
+
+    noutrefresh = refresh
+
+    def timeout(self, delay):
+        pass
+
+    def keypad(self, flag):
+        pass
+
+    def getch(self):
+        key = self.keys.pop(0) if self.keys else ESC
+        return ord(key) if isinstance(key, str) else key
+
+    def get_wch(self):
+        key = self.keys.pop(0) if self.keys else ESC
+        return chr(key) if isinstance(key, int) and key < 256 else key
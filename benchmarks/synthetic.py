@@ -0,0 +1,90 @@
+"""确定性的模拟学生数据
+
+同样的学生数和随机种子总是生成完全相同的记录, 不同版本的测试结果可以直接对比。
+
+用法: python benchmarks/synthetic.py 学生数 输出目录 [--backend json|sqlite|sharded] [--seed 0]
+在输出目录中写出data.json(或data.db)和每个学生的账户, 可以在该目录中直接运行main.py。
+"""
+import os
+import sys
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from schema import SCHEMA  # noqa: E402
+from storage import JsonStorage, SqliteStorage  # noqa: E402
+from sharding import ShardedStorage  # noqa: E402
+
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗'
+GIVEN_NAMES = '伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉兰'
+# 账户使用固定的假哈希, 避免生成数据时计算PBKDF2
+FAKE_HASH = 'pbkdf2_sha256$1000$' + '0' * 32 + '$' + '0' * 64
+WRITE_BATCH = 10 ** 6   # JSON后端每写入这么多学生提交一次, 已提交的记录不再占用内存
+SHARD_PREFIX = 4        # 分片存储按学号前4位分片, 每个分片最多10^4个学生
+
+
+def student_id(i):
+    return f"{i:08d}"
+
+
+def make_students(count, seed=0):
+    """按当前科目配置逐个生成(学号, 记录), 学号为00000000起的连续编号
+
+    姓名为两到三个汉字, 各科成绩近似正态分布(均值为满分的75%), 精确到0.5分。
+    """
+    rng = random.Random(seed)
+    for i in range(count):
+        name = rng.choice(SURNAMES) + ''.join(rng.choice(GIVEN_NAMES) for _ in range(rng.randint(1, 2)))
+        scores = {}
+        for subject in SCHEMA.subjects:
+            score = rng.gauss(subject.full_mark * 0.75, subject.full_mark * 0.12)
+            scores[subject.key] = min(subject.full_mark, max(0.0, round(score * 2) / 2))
+        yield student_id(i), SCHEMA.build_record(name, scores)
+
+
+def write_dataset(directory, count, backend='json', seed=0):
+    """在directory中写出count个学生及其账户, 返回数据文件路径
+
+    JSON后端写出带偏移索引的快照(与默认的按需读取方式一致), 并记录科目配置,
+    这样在该目录中启动时不会触发迁移。
+    """
+    os.makedirs(directory, exist_ok=True)
+    if backend == 'sqlite':
+        path = os.path.join(directory, 'data.db')
+        storage = SqliteStorage(path)
+        batch = count or 1
+    elif backend == 'sharded':
+        path = os.path.join(directory, 'data.json')
+        storage = ShardedStorage(path, journal=False, lazy=True, prefix_length=SHARD_PREFIX)
+        batch = WRITE_BATCH
+    else:
+        path = os.path.join(directory, 'data.json')
+        storage = JsonStorage(path, journal=False, lazy=True)
+        batch = WRITE_BATCH
+    storage.load({'admin': {'password': FAKE_HASH, 'role': 'admin'}})
+    for i, (key, record) in enumerate(make_students(count, seed), 1):
+        storage.put('students', key, record)
+        storage.put('accounts', key, {'password': FAKE_HASH, 'role': 'student'})
+        if i % batch == 0:
+            storage.commit()
+    storage.commit()
+    storage.close()
+    with open(path + '.schema', 'w', encoding='utf-8') as f:
+        f.write(SCHEMA.fingerprint())
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成确定性的模拟学生数据")
+    parser.add_argument('count', type=int, help="学生数")
+    parser.add_argument('directory', help="输出目录")
+    parser.add_argument('--backend', choices=('json', 'sqlite', 'sharded'), default='json')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    path = write_dataset(args.directory, args.count, args.backend, args.seed)
+    print(f"已写出{args.count}个学生: {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""列式学生存储
+
+每个学生不再是一个6个键的字典, 而是若干并行数组中的一行:
+成绩为array('d')列, 姓名为字符串表中的下标。对外仍是字典接口,
+读取时临时组装出与JSON存储相同结构的记录。
+"""
+from array import array
+from collections.abc import MutableMapping
+
+from storage import SCORE_FIELDS
+_MISSING = float('nan')
+
+
+class ColumnarStudentStore(MutableMapping):
+    """学号 -> 记录 的列式映射"""
+
+    def __init__(self, items=()):
+        self._rows = {}                 # 学号 -> 行号, 保持插入顺序
+        self._free = []                 # 删除后可复用的行号
+        self._strings = []              # 字符串表
+        self._string_ids = {}           # 字符串 -> 字符串表下标
+        self._names = array('I')        # 每行姓名在字符串表中的下标
+        self._columns = {field: array('d') for field in SCORE_FIELDS}
+        for key, value in items:
+            self[key] = value
+
+    def _intern(self, text):
+        idx = self._string_ids.get(text)
+        if idx is None:
+            idx = len(self._strings)
+            self._strings.append(text)
+            self._string_ids[text] = idx
+        return idx
+
+    def __getitem__(self, key):
+        row = self._rows[key]
+        record = {'name': self._strings[self._names[row]]}
+        for field, column in self._columns.items():
+            record[field] = column[row]
+        return record
+
+    def __setitem__(self, key, value):
+        row = self._rows.get(key)
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+            else:
+                row = len(self._names)
+                self._names.append(0)
+                for column in self._columns.values():
+                    column.append(_MISSING)
+            self._rows[key] = row
+        self._names[row] = self._intern(value.get('name', ''))
+        for field, column in self._columns.items():
+            score = value.get(field)
+            column[row] = _MISSING if score is None else score
+
+    def __delitem__(self, key):
+        self._free.append(self._rows.pop(key))
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def clear(self):
+        self.__init__()
+
+    def columns(self, fields):
+        """返回各成绩列, 没有空闲行时直接返回内部数组而不复制"""
+        if not self._free:
+            return {field: self._columns[field] for field in fields}
+        rows = list(self._rows.values())
+        return {field: array('d', map(self._columns[field].__getitem__, rows))
+                for field in fields}
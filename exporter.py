@@ -0,0 +1,184 @@
+"""流式导出
+
+学生记录经过 筛选 -> 选列 -> 写出 的生成器管道逐条处理, 不会在内存中
+构造完整的输出。支持三种格式:
+- csv: 带表头的CSV
+- jsonl: 每行一个JSON对象
+- columnar: 按行组分块的二进制列式文件, 见write_columnar
+"""
+import csv
+import json
+import sys
+import struct
+from array import array
+from time import perf_counter
+
+from storage import SCORE_FIELDS
+
+EXPORT_COLUMNS = ('id', 'name') + SCORE_FIELDS
+TEXT_COLUMNS = ('id', 'name')
+FORMATS = ('csv', 'jsonl', 'columnar')
+
+COLUMNAR_MAGIC = b'SCOL1\n'
+ROW_GROUP_SIZE = 65536
+
+
+class ExportStats:
+    """导出统计: 行数、耗时和每秒行数"""
+
+    def __init__(self, rows, seconds):
+        self.rows = rows
+        self.seconds = seconds
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds > 0 else float('inf')
+
+
+def check_options(columns, field=None):
+    """检查导出列和筛选字段, 不合法时抛出ValueError"""
+    for column in columns:
+        if column not in EXPORT_COLUMNS:
+            raise ValueError(f"未知的导出列: {column}")
+    if field is not None and field not in SCORE_FIELDS:
+        raise ValueError(f"不支持按该字段筛选: {field}")
+
+
+def iter_rows(students, columns=EXPORT_COLUMNS, field=None, low=None, high=None):
+    """按成绩范围筛选并选出指定列, 逐条生成元组"""
+    for student_id, record in students.items():
+        if field is not None:
+            score = record[field]
+            if (low is not None and score < low) or (high is not None and score > high):
+                continue
+        yield tuple(student_id if column == 'id' else record[column] for column in columns)
+
+
+def write_csv(f, columns, rows):
+    writer = csv.writer(f)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def write_jsonl(f, columns, rows):
+    count = 0
+    for row in rows:
+        f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+        f.write('\n')
+        count += 1
+    return count
+
+
+def _encode_column(column, values):
+    """把一个行组中的一列编码为字节串
+
+    数值列为小端float64数组; 文本列为各值UTF-8字节长度的uint32数组加拼接后的字节。
+    """
+    if column in TEXT_COLUMNS:
+        encoded = [str(value).encode('utf-8') for value in values]
+        lengths = array('I', map(len, encoded))
+        if sys.byteorder == 'big':
+            lengths.byteswap()
+        return lengths.tobytes() + b''.join(encoded)
+    numbers = array('d', values)
+    if sys.byteorder == 'big':
+        numbers.byteswap()
+    return numbers.tobytes()
+
+
+def _write_row_group(f, columns, group):
+    f.write(struct.pack('<I', len(group)))
+    for i, column in enumerate(columns):
+        chunk = _encode_column(column, [row[i] for row in group])
+        f.write(struct.pack('<I', len(chunk)))
+        f.write(chunk)
+
+
+def write_columnar(f, columns, rows, row_group_size=ROW_GROUP_SIZE):
+    """写出二进制列式文件
+
+    文件结构: 魔数, 一行JSON头(列名), 若干行组, 最后是行数为0的结束标记。
+    每个行组: uint32行数, 然后每列一个 uint32字节数 + 列数据块,
+    读取时可以按字节数跳过不需要的列。内存占用只与行组大小有关。
+    """
+    f.write(COLUMNAR_MAGIC)
+    f.write(json.dumps({'columns': list(columns)}).encode('utf-8') + b'\n')
+    count = 0
+    group = []
+    for row in rows:
+        group.append(row)
+        if len(group) >= row_group_size:
+            _write_row_group(f, columns, group)
+            count += len(group)
+            group = []
+    if group:
+        _write_row_group(f, columns, group)
+        count += len(group)
+    f.write(struct.pack('<I', 0))
+    return count
+
+
+def read_columnar(f):
+    """逐行读取列式文件, 生成 {列名: 值} 字典"""
+    if f.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError("不是有效的列式导出文件")
+    columns = json.loads(f.readline())['columns']
+    while True:
+        (count,) = struct.unpack('<I', f.read(4))
+        if count == 0:
+            return
+        decoded = []
+        for column in columns:
+            (size,) = struct.unpack('<I', f.read(4))
+            chunk = f.read(size)
+            if column in TEXT_COLUMNS:
+                lengths = array('I')
+                lengths.frombytes(chunk[:4 * count])
+                if sys.byteorder == 'big':
+                    lengths.byteswap()
+                values, pos = [], 4 * count
+                for length in lengths:
+                    values.append(chunk[pos:pos + length].decode('utf-8'))
+                    pos += length
+            else:
+                values = array('d')
+                values.frombytes(chunk)
+                if sys.byteorder == 'big':
+                    values.byteswap()
+            decoded.append(values)
+        for i in range(count):
+            yield {column: values[i] for column, values in zip(columns, decoded)}
+
+
+def guess_format(path):
+    """根据扩展名推断导出格式"""
+    lower = path.lower()
+    if lower.endswith('.csv'):
+        return 'csv'
+    if lower.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return 'columnar'
+
+
+def export_students(students, path, fmt=None, columns=EXPORT_COLUMNS,
+                    field=None, low=None, high=None):
+    """导出学生记录到文件, 返回ExportStats"""
+    fmt = fmt or guess_format(path)
+    if fmt not in FORMATS:
+        raise ValueError(f"未知的导出格式: {fmt}")
+    check_options(columns, field)
+    rows = iter_rows(students, columns, field, low, high)
+
+    start = perf_counter()
+    if fmt == 'columnar':
+        with open(path, 'wb') as f:
+            count = write_columnar(f, columns, rows)
+    else:
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = write_csv if fmt == 'csv' else write_jsonl
+            count = writer(f, columns, rows)
+    return ExportStats(count, perf_counter() - start)
@@ -0,0 +1,244 @@
+"""操作历史: 多级撤销/重做和审计日志
+
+每次提交(GradeService.save)的全部修改作为一条历史记录, 只保存差异:
+新增的记录保存新值, 删除的记录保存旧值, 修改只保存变化了的字段的(旧值, 新值)。
+同一次提交中对同一条记录的多次修改合并为一次。后台延迟提交时(交互界面)每次操作结束后
+调用stage(), 各次操作的修改分开, 提交成功后才由commit()依次记为历史记录。
+
+内存中只保留最近的若干条记录(条数和字段总数都有上限, 最近的一条即使超出上限也保留),
+会话再长内存占用也不会增长;
+每条记录在提交时就追加到审计文件(data.json.audit, JSON行格式, 密码哈希不写入),
+撤销和重做也会写入, 超出内存上限的旧记录仍可以在审计文件中查到。
+撤销/重做前检查记录是否仍是这次修改之后(之前)的状态, 已被其他操作改过时拒绝执行。
+"""
+import os
+import json
+from time import time
+from collections import deque
+from contextlib import contextmanager
+
+from schema import SCHEMA
+
+CREATE, DELETE, UPDATE = 'create', 'delete', 'update'
+REDACTED_FIELDS = ('password',)    # 不写入审计文件的字段
+
+
+class Entry:
+    """一条历史记录, changes为[(表名, 键, 类型, 数据)]
+
+    类型为CREATE/DELETE时数据是完整的新记录/旧记录, UPDATE时是 {字段: (旧值, 新值)},
+    字段不存在用None表示。
+    """
+    __slots__ = ('seq', 'time', 'user', 'changes', 'size')
+
+    def __init__(self, seq, user, changes):
+        self.seq = seq
+        self.time = time()
+        self.user = user
+        self.changes = changes
+        self.size = sum(len(data) for _, _, _, data in changes)
+
+    def describe(self):
+        """一行文字说明, 如"修改学生00000001: 数学 80→90" """
+        table, key, kind, data = self.changes[0]
+        if table == 'students':
+            if kind == CREATE:
+                text = f"添加学生{key}({data.get('name')})"
+            elif kind == DELETE:
+                text = f"删除学生{key}({data.get('name')})"
+            else:
+                fields = [f"{SCHEMA.label(field)} {_short(old)}→{_short(new)}"
+                          for field, (old, new) in data.items() if field in SCHEMA.keys or field == 'name']
+                text = f"修改学生{key}: {', '.join(fields) or '派生成绩'}"
+        else:
+            action = {CREATE: '创建账户', DELETE: '删除账户', UPDATE: '修改账户'}[kind]
+            text = f"{action}{key}"
+        students = [change for change in self.changes if change[0] == 'students']
+        if len(students) > 1:
+            text += f" 等{len(students)}名学生"
+        elif len(self.changes) > 1 and table == 'students':
+            text += " (含账户)"
+        return text
+
+
+def _short(value):
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+def _diff(old, new):
+    """两条记录之间变化的字段"""
+    return {field: (old.get(field), new.get(field)) for field in old.keys() | new.keys()
+            if old.get(field) != new.get(field)}
+
+
+def _redact(record):
+    return {field: ('***' if field in REDACTED_FIELDS else value) for field, value in record.items()}
+
+
+class History:
+    """撤销栈和重做栈, 以及审计文件"""
+    MAX_ENTRIES = 1000      # 内存中最多保留的历史条数
+    MAX_FIELDS = 200000     # 内存中所有历史保存的字段总数上限
+
+    def __init__(self, audit_file=None):
+        self.audit_file = audit_file
+        self.user = None        # 记录在审计文件中的操作者
+        self._undo = deque()
+        self._redo = []
+        self._size = 0          # 撤销栈和重做栈中的字段总数
+        self._pending = {}      # 未提交的修改: (表名, 键) -> [修改前, 修改后]
+        self._staged = []       # 已经结束、等待提交的操作, 每项同_pending
+        self._paused = 0
+        self._seq = 0
+
+    @contextmanager
+    def paused(self):
+        """with语句块中的修改不进入历史(如迁移、密码哈希升级、撤销本身)"""
+        self._paused += 1
+        try:
+            yield
+        finally:
+            self._paused -= 1
+
+    def record(self, table, key, old, new):
+        """记录一条尚未提交的修改, new为None表示删除"""
+        if self._paused:
+            return
+        change = self._pending.get((table, key))
+        if change is None:
+            self._pending[(table, key)] = [old, new]
+        else:
+            change[1] = new
+
+    def stage(self):
+        """结束一次操作, 它的修改等待commit()时记为一条历史记录, 之后的修改不再与它合并"""
+        if self._pending:
+            self._staged.append(self._pending)
+            self._pending = {}
+
+    def discard(self, changes=None):
+        """放弃未提交的修改(提交失败时), changes为[(表名, 键)]时只放弃这些记录的修改"""
+        if changes is None:
+            self._pending.clear()
+            self._staged.clear()
+            return
+        for pending in self._staged + [self._pending]:
+            for change in changes:
+                pending.pop(change, None)
+
+    def commit(self):
+        """把等待提交的操作和未提交的修改依次记为历史记录, 返回最后一条, 没有实际变化时返回None
+
+        写审计文件失败时抛出OSError, 此时历史记录已经生效。
+        """
+        self.stage()
+        staged, self._staged = self._staged, []
+        entries = [entry for entry in map(self._add, staged) if entry is not None]
+        for entry in entries:
+            self._write_audit('change', entry)
+        return entries[-1] if entries else None
+
+    def _add(self, pending):
+        """把一次操作的修改记为一条历史记录放入撤销栈, 没有实际变化时返回None"""
+        changes = []
+        for (table, key), (old, new) in pending.items():
+            if old is None and new is not None:
+                changes.append((table, key, CREATE, dict(new)))
+            elif new is None and old is not None:
+                changes.append((table, key, DELETE, dict(old)))
+            elif old is not None and old != new:
+                changes.append((table, key, UPDATE, _diff(old, new)))
+        if not changes:
+            return None
+        self._seq += 1
+        entry = Entry(self._seq, self.user, changes)
+        self._size -= sum(e.size for e in self._redo)
+        self._redo.clear()
+        self._undo.append(entry)
+        self._size += entry.size
+        self._trim(entry)
+        return entry
+
+    def _trim(self, keep):
+        """超出上限时从最旧的记录开始丢弃, 先丢弃撤销栈底部的再丢弃重做栈底部的, keep不丢弃"""
+        while len(self._undo) + len(self._redo) > self.MAX_ENTRIES or self._size > self.MAX_FIELDS:
+            if self._undo and self._undo[0] is not keep:
+                self._size -= self._undo.popleft().size
+            elif self._redo and self._redo[0] is not keep:
+                self._size -= self._redo.pop(0).size
+            else:
+                break
+
+    def clear(self):
+        """清空撤销栈和重做栈(如切换用户时), 审计文件不受影响"""
+        self._undo.clear()
+        self._redo.clear()
+        self._size = 0
+
+    def can_undo(self):
+        return bool(self._undo)
+
+    def can_redo(self):
+        return bool(self._redo)
+
+    def entries(self):
+        """(可撤销的记录(新的在前), 可重做的记录(下一个在前))"""
+        return list(reversed(self._undo)), list(reversed(self._redo))
+
+    def plan(self, undo, lookup):
+        """计算撤销(或重做)最近一条记录要写入的值, 返回(记录, [(表名, 键, 值)]), 值为None表示删除
+
+        lookup(表名, 键)返回当前记录。当前状态与历史不符时抛出ValueError。
+        """
+        stack = self._undo if undo else self._redo
+        if not stack:
+            raise ValueError("没有可撤销的操作" if undo else "没有可重做的操作")
+        entry = stack[-1]
+        writes = []
+        for table, key, kind, data in (reversed(entry.changes) if undo else entry.changes):
+            current = lookup(table, key)
+            if kind == UPDATE:
+                expected_index, target_index = (1, 0) if undo else (0, 1)
+                if current is None or any(current.get(field) != values[expected_index]
+                                          for field, values in data.items()):
+                    raise ValueError(f"{key}已被其他操作修改, 无法{'撤销' if undo else '重做'}")
+                value = dict(current)
+                for field, values in data.items():
+                    if values[target_index] is None:
+                        value.pop(field, None)
+                    else:
+                        value[field] = values[target_index]
+            else:
+                present = (kind == CREATE) == undo    # 撤销新增/重做删除前记录应当存在
+                if present and current != data or not present and current is not None:
+                    raise ValueError(f"{key}已被其他操作修改, 无法{'撤销' if undo else '重做'}")
+                value = None if present else data
+            writes.append((table, key, value))
+        return entry, writes
+
+    def finish(self, undo):
+        """撤销(或重做)已提交后, 把记录移到另一个栈, 写审计文件失败时抛出OSError"""
+        if undo:
+            entry = self._undo.pop()
+            self._redo.append(entry)
+        else:
+            entry = self._redo.pop()
+            self._undo.append(entry)
+        self._trim(entry)
+        self._write_audit('undo' if undo else 'redo', entry)
+
+    def _write_audit(self, op, entry):
+        if not self.audit_file:
+            return
+        changes = []
+        for table, key, kind, data in entry.changes:
+            if kind == UPDATE:
+                data = {field: ('***', '***') if field in REDACTED_FIELDS else values
+                        for field, values in data.items()}
+            else:
+                data = _redact(data)
+            changes.append({'table': table, 'key': key, 'kind': kind, 'data': data})
+        line = json.dumps({'op': op, 'seq': entry.seq, 'time': round(time(), 3), 'pid': os.getpid(),
+                           'user': self.user, 'changes': changes}, ensure_ascii=False)
+        with open(self.audit_file, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
@@ -0,0 +1,123 @@
+"""CSV批量导入
+
+逐行读取CSV(Excel另存为CSV即可), 校验后写入学生信息并批量创建账户,
+整个导入只在最后提交一次。第一行必须是表头, 中英文列名均可:
+学号/id, 姓名/name, 各科为科目配置中的显示名称或键名(默认为语文/chinese, 数学/math, 英语/english)
+"""
+import csv
+import math
+
+from schema import SCHEMA
+from storage import SUBJECTS
+
+SCORE_MIN = 0.0
+SCORE_MAX = 100.0
+
+COLUMN_ALIASES = {
+    'id': 'id', '学号': 'id',
+    'name': 'name', '姓名': 'name',
+}
+for _subject in SCHEMA.subjects:
+    COLUMN_ALIASES[_subject.key] = COLUMN_ALIASES[_subject.label.lower()] = _subject.key
+REQUIRED_COLUMNS = ('id', 'name') + SUBJECTS
+
+
+class ImportResult:
+    """导入结果: 成功导入的学号和出错的行"""
+
+    def __init__(self):
+        self.imported = []
+        self.errors = []    # [(行号, 错误信息)]
+
+    def add_error(self, line_no, message):
+        self.errors.append((line_no, message))
+
+
+def iter_csv_rows(f):
+    """逐行解析CSV, 生成(行号, {字段: 文本})
+
+    表头缺少必需列时抛出ValueError。
+    """
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+        raise ValueError("文件为空")
+    fields = [COLUMN_ALIASES.get(column.strip().lower()) for column in header]
+    missing = [column for column in REQUIRED_COLUMNS if column not in fields]
+    if missing:
+        raise ValueError(f"表头缺少列: {', '.join(missing)}")
+
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue  # 跳过空行
+        yield reader.line_num, {
+            field: cell.strip() for field, cell in zip(fields, row) if field
+        }
+
+
+def parse_score(text, subject=None):
+    """解析并校验成绩, 给出科目时按该科的满分检查范围, 不合法时抛出ValueError"""
+    try:
+        score = float(text)
+    except (TypeError, ValueError):
+        raise ValueError(f"成绩不是有效数字: {text!r}")
+    high = SCHEMA.subject(subject).full_mark if subject is not None else SCORE_MAX
+    if math.isnan(score) or not SCORE_MIN <= score <= high:
+        raise ValueError(f"成绩超出范围{SCORE_MIN:g}~{high:g}: {text}")
+    return score
+
+
+def parse_rows(rows):
+    """校验iter_csv_rows生成的各行, 返回(有效行[(行号, 学号, 姓名, 成绩)], 记下出错行的ImportResult)
+
+    只检查行本身, 不访问已有数据, 可以在其他线程中执行。
+    """
+    result = ImportResult()
+    parsed = []
+    for line_no, row in rows:
+        student_id = row.get('id', '')
+        name = row.get('name', '')
+        if not student_id:
+            result.add_error(line_no, "学号为空")
+            continue
+        if not name:
+            result.add_error(line_no, "姓名为空")
+            continue
+        try:
+            scores = {subject: parse_score(row.get(subject), subject) for subject in SUBJECTS}
+        except ValueError as e:
+            result.add_error(line_no, str(e))
+            continue
+        parsed.append((line_no, student_id, name, scores))
+    return parsed, result
+
+
+def apply_rows(system, parsed, result, password_hashes=None):
+    """把parse_rows校验过的行写入system, 返回result
+
+    已存在的学号和文件内重复的学号都会作为错误行报告, 不会覆盖原有数据。
+    password_hashes为预先计算好的初始密码哈希(至少与parsed一样多)时直接使用。
+    这里不提交修改, 由调用方在导入结束后统一提交一次。
+    """
+    for line_no, student_id, name, scores in parsed:
+        if student_id in system.students:
+            result.add_error(line_no, f"学号已存在: {student_id}")
+            continue
+        system.create_student(student_id, name, scores)
+        result.imported.append(student_id)
+    result.errors.sort(key=lambda error: error[0])
+
+    system.add_student_accounts(result.imported, password_hashes)
+    return result
+
+
+def import_students(system, rows):
+    """把iter_csv_rows生成的行导入system, 返回ImportResult(不提交)"""
+    parsed, result = parse_rows(rows)
+    return apply_rows(system, parsed, result)
+
+
+def import_file(system, path, encoding='utf-8-sig'):
+    """从CSV文件导入, utf-8-sig可以兼容Excel导出的带BOM文件"""
+    with open(path, 'r', encoding=encoding, newline='') as f:
+        return import_students(system, iter_csv_rows(f))
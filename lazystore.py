@@ -0,0 +1,265 @@
+"""按需解码的JSON快照
+
+写快照时另外生成偏移索引文件(data.json.idx), 记录每张表的学号和每条记录的值在快照
+中的字节范围。加载时只需读取索引的首行并校验它与快照是否匹配, 快照和索引都通过mmap
+读取: 按学号查找时在按学号排序的序号表上二分, 每条记录在被访问时才解码,
+不需要在内存中建立 学号 -> 记录 的字典。
+
+索引文件格式: 第一行是JSON头部, 之后依次是每张表的
+- 全部学号(UTF-8)首尾相接
+- 每个学号在上面的起始位置, array('Q'), 共n+1个
+- 每条记录的值在快照中的[起始, 结束)偏移, array('Q'), 共2n个
+- 按学号排序后的序号, array('Q'), 共n个
+"""
+import os
+import sys
+import json
+import mmap
+from array import array
+from itertools import accumulate, islice
+from collections.abc import MutableMapping
+
+INDEX_VERSION = 1
+DECODE_BATCH = 1024     # 遍历时每批解码的记录数
+_ITEMSIZE = array('Q').itemsize
+
+
+def write_index(path, generation, size, tables):
+    """写出快照的偏移索引, tables为 {表名: (UTF-8编码的学号列表, array('Q')偏移)}"""
+    header = {'version': INDEX_VERSION, 'generation': generation, 'size': size,
+              'byteorder': sys.byteorder, 'tables': {}}
+    parts = []
+    for name, (encoded, spans) in tables.items():
+        key_offsets = array('Q', accumulate(map(len, encoded), initial=0))
+        order = array('Q', sorted(range(len(encoded)), key=encoded.__getitem__))
+        header['tables'][name] = [len(encoded), key_offsets[-1]]
+        parts.append((encoded, key_offsets, spans, order))
+
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(json.dumps(header).encode('utf-8') + b'\n')
+        for encoded, *arrays in parts:
+            f.writelines(encoded)
+            for values in arrays:
+                values.tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+
+def _map(path):
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class _TableIndex:
+    """一张表的偏移索引"""
+
+    def __init__(self, data, index, start, count, blob_size, byteswap):
+        self._data = data
+        self._index = index
+        self._blob_start = start
+        self._count = count
+        pos = start + blob_size
+        arrays = []
+        for length in (count + 1, 2 * count, count):
+            values = array('Q')
+            values.frombytes(index[pos:pos + length * _ITEMSIZE])
+            if byteswap:
+                values.byteswap()
+            arrays.append(values)
+            pos += length * _ITEMSIZE
+        self._key_offsets, self._spans, self._order = arrays
+
+    def __len__(self):
+        return self._count
+
+    def _key(self, i):
+        start = self._blob_start
+        return self._index[start + self._key_offsets[i]:start + self._key_offsets[i + 1]]
+
+    def find(self, key):
+        """学号对应的序号, 不存在时返回None"""
+        target = key.encode('utf-8')
+        order = self._order
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(order[mid]) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count and self._key(order[lo]) == target:
+            return order[lo]
+        return None
+
+    def keys(self):
+        """按快照中的顺序遍历学号"""
+        offsets = self._key_offsets
+        blob = self._index[self._blob_start:self._blob_start + offsets[-1]]
+        for i in range(self._count):
+            yield blob[offsets[i]:offsets[i + 1]].decode('utf-8')
+
+    def raw(self, i):
+        """第i条记录的值的JSON原文"""
+        return self._data[self._spans[2 * i]:self._spans[2 * i + 1]]
+
+    def decode_many(self, indexes):
+        """一次解码多条记录: 拼成一个JSON数组解析, 比逐条json.loads快一倍以上"""
+        return json.loads(b'[' + b','.join(map(self.raw, indexes)) + b']')
+
+
+class SnapshotReader:
+    """通过偏移索引读取快照中的记录"""
+
+    def __init__(self, data, index, header, body_start):
+        self._data = data
+        self._index = index
+        self.generation = header['generation']
+        self._byteswap = header['byteorder'] != sys.byteorder
+        self._tables = {}       # 表名: (条数, 学号起始, 学号字节数)
+        pos = body_start
+        for name, (count, blob_size) in header['tables'].items():
+            self._tables[name] = (count, pos, blob_size)
+            pos += blob_size + (4 * count + 1) * _ITEMSIZE
+
+    @classmethod
+    def open(cls, data_file, index_file, generation):
+        """打开快照和索引, 索引不存在或与快照(代数和大小)不匹配时返回None"""
+        try:
+            with open(index_file, 'rb') as f:
+                header = json.loads(f.readline())
+                body_start = f.tell()
+            size = os.path.getsize(data_file)
+        except (OSError, ValueError):
+            return None
+        if (not isinstance(header, dict) or header.get('version') != INDEX_VERSION or
+                header.get('generation') != generation or header.get('size') != size or size == 0):
+            return None
+        return cls(_map(data_file), _map(index_file), header, body_start)
+
+    def has_table(self, name):
+        return name in self._tables
+
+    def table(self, name):
+        count, start, blob_size = self._tables[name]
+        return _TableIndex(self._data, self._index, start, count, blob_size, self._byteswap)
+
+    def close(self):
+        self._data.close()
+        self._index.close()
+
+
+class LazyTable(MutableMapping):
+    """快照中的一张表, 对外是字典接口
+
+    未修改的记录留在快照中, 访问时才解码; 修改过、新增和删除的记录保存在内存中。
+    遍历顺序与普通字典相同: 快照中的记录按原顺序, 之后是新增的记录。
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.clear()
+
+    def attach(self, reader):
+        """改为读取新的快照, 丢弃内存中的修改(它们应已包含在快照中)"""
+        self.clear()
+        if reader is not None and reader.has_table(self.name):
+            self._reader = reader
+
+    def clear(self):
+        self._reader = None
+        self._index = None      # 第一次访问时才读取
+        self._changed = {}      # 快照中被修改过的记录
+        self._deleted = set()   # 快照中被删除的学号
+        self._added = {}        # 快照之外新增的记录
+
+    def _base(self):
+        if self._index is None and self._reader is not None:
+            self._index = self._reader.table(self.name)
+        return self._index
+
+    def _find(self, key):
+        """学号在快照中的序号, 不在快照中或已删除时返回None"""
+        base = self._base()
+        if base is None or key in self._deleted:
+            return None
+        return base.find(key)
+
+    def _base_keys(self):
+        base = self._base()
+        return base.keys() if base is not None else iter(())
+
+    def __getitem__(self, key):
+        if key in self._added:
+            return self._added[key]
+        if key in self._changed:
+            return self._changed[key]
+        i = self._find(key)
+        if i is None:
+            raise KeyError(key)
+        return json.loads(self._index.raw(i))
+
+    def __setitem__(self, key, value):
+        if key not in self._added and self._find(key) is not None:
+            self._changed[key] = value
+        else:
+            self._added[key] = value    # 删除后重新添加的记录与字典一样排到最后
+
+    def __delitem__(self, key):
+        if key in self._added:
+            del self._added[key]
+        elif self._find(key) is not None:
+            self._deleted.add(key)
+            self._changed.pop(key, None)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._added or self._find(key) is not None
+
+    def __iter__(self):
+        deleted = self._deleted
+        for key in self._base_keys():
+            if key not in deleted:
+                yield key
+        yield from self._added
+
+    def __len__(self):
+        base = self._base()
+        return (len(base) if base is not None else 0) - len(self._deleted) + len(self._added)
+
+    def items(self):
+        """按顺序遍历全部记录, 快照中的记录按序号每DECODE_BATCH条一起解码, 不需要逐个查找"""
+        changed, deleted = self._changed, self._deleted
+        keys = self._base_keys()
+        start = 0
+        while True:
+            chunk = list(islice(keys, DECODE_BATCH))
+            if not chunk:
+                break
+            decoded = iter(self._index.decode_many(
+                [start + j for j, key in enumerate(chunk) if key not in changed and key not in deleted]
+            ))
+            for key in chunk:
+                if key in changed:
+                    yield key, changed[key]
+                elif key not in deleted:
+                    yield key, next(decoded)
+            start += len(chunk)
+        yield from self._added.items()
+
+    def values(self):
+        for _, value in self.items():
+            yield value
+
+    def raw_items(self):
+        """遍历 (学号, 值的JSON原文), 未修改的记录直接从快照中复制, 供写新快照使用"""
+        changed, deleted = self._changed, self._deleted
+        for i, key in enumerate(self._base_keys()):
+            if key in changed:
+                yield key, json.dumps(changed[key]).encode('ascii')
+            elif key not in deleted:
+                yield key, self._index.raw(i)
+        for key, value in self._added.items():
+            yield key, json.dumps(value).encode('ascii')
@@ -1,15 +1,150 @@
 import os
-import json
-import hashlib
-from time import sleep
+import sys
+import argparse
+import asyncio
+import threading
+import multiprocessing
+from time import sleep, monotonic, strftime, localtime
 import curses
+import unicodedata
 
-class EnhancedStudentGradeSystem:
-    DATA_FILE = 'data.json'
+from service import GradeService, DEFAULT_PASSWORD, WriteError
+from schema import SCHEMA, SchemaError
+from storage import SCORE_FIELDS, ConflictError
+from importer import parse_score
+from stats import class_statistics, STAT_FIELDS
+from ranking import RANK_FIELDS
+from query import RosterQuery, parse_range, format_range
+from exporter import export_students, EXPORT_COLUMNS, FORMATS
+from report import FORMATS as REPORT_FORMATS
+from backup import CODECS as BACKUP_CODECS, parse_time
+from batch import run_batch
+from server import serve
+from render import ScreenPainter
+from autosave import BackgroundSaver
+import metrics
+
+FIELD_LABELS = {field: SCHEMA.label(field) for field in SCORE_FIELDS}
+
+def _width(text):
+    """终端显示宽度, 中文字符占两列"""
+    return sum(2 if unicodedata.east_asian_width(ch) in 'WF' else 1 for ch in str(text))
+
+def _pad(text, width):
+    """按终端显示宽度左对齐"""
+    text = str(text)
+    return text + ' ' * max(0, width - _width(text))
+
+def _clip(text, width):
+    """截断到终端显示宽度以内, 科目较多时表格行可能比终端宽"""
+    if _width(text) <= width:
+        return text
+    used = 0
+    for i, ch in enumerate(text):
+        used += _width(ch)
+        if used > width:
+            return text[:i]
+    return text
+
+# 学生列表中学号、姓名之后的各列: (字段, 宽度, 数字格式), 科目由科目配置决定
+ROSTER_COLUMNS = [(field, max(8, _width(FIELD_LABELS[field]) + 2), fmt) for field, fmt in
+                  [(subject, '.1f') for subject in SCHEMA.keys] +
+                  [('total', '.1f'), ('average', '.2f'), ('gpa', '.2f')]]
+SCORE_HEADER = "".join(_pad(FIELD_LABELS[field], width) for field, width, _ in ROSTER_COLUMNS)
+ROSTER_HEADER = _pad('学号', 10) + _pad('姓名', 10) + SCORE_HEADER
+ROSTER_LABELS = {'id': '学号', 'name': '姓名', **FIELD_LABELS}
+
+def roster_header(sort, descending):
+    """学生列表的表头, 排序列标出升序↑或降序↓"""
+    arrow = '↓' if descending else '↑'
+    cells = [_pad(ROSTER_LABELS[field] + (arrow if field == sort else ''), width)
+             for field, width in [('id', 10), ('name', 10)] + [(field, width) for field, width, _ in ROSTER_COLUMNS]]
+    return "".join(cells)
+
+def describe_query(query):
+    """查询的说明, 例如: 按总分降序, 英语<60"""
+    text = f"按{ROSTER_LABELS[query.sort]}{'降序' if query.descending else '升序'}"
+    for field, low, high in query.filters:
+        text += f", {FIELD_LABELS[field]}{format_range(low, high)}"
+    return text
+
+def _exam_cells(value_of):
+    """按学生列表的列宽和格式排列各字段, value_of(字段)为None时显示-"""
+    cells = []
+    for field, width, fmt in ROSTER_COLUMNS:
+        value = value_of(field)
+        cells.append(_pad('-' if value is None else format(value, fmt), width))
+    return "".join(cells)
+
+def format_shard_statistics(reports):
+    """各分片(班级)的人数、各字段平均分和总分及格率, 返回文本行"""
+    lines = [_pad('班级', 12) + _pad('人数', 8) + SCORE_HEADER + '及格率']
+    for name, stats in reports.items():
+        if not stats:
+            continue
+        lines.append(_pad(name, 12) + _pad(stats['total']['count'], 8) +
+                     _exam_cells(lambda field: stats[field]['mean'] if field in stats else None) +
+                     f"{stats['total']['pass_rate']:.1%}")
+    return lines
+
+def format_exam_averages(exams):
+    """各次考试的人数和各字段平均分, 返回文本行"""
+    if not exams:
+        return ["还没有记录过考试"]
+    lines = [_pad('考试', 16) + _pad('时间', 12) + _pad('人数', 8) + SCORE_HEADER]
+    for exam in exams:
+        lines.append(_pad(exam.name, 16) + _pad(strftime('%Y-%m-%d', localtime(exam.time)), 12) +
+                     _pad(exam.count, 8) + _exam_cells(exam.mean))
+    return lines
+
+def format_trajectory(trajectory):
+    """一名学生在各次考试中的成绩, 返回文本行"""
+    lines = [_pad('考试', 16) + SCORE_HEADER]
+    for exam, scores in trajectory:
+        lines.append(_pad(exam.name, 16) + _exam_cells(scores.get))
+    return lines
+
+def format_improved(system, field, n, start=None, end=None):
+    """两次考试之间进步最多的学生, 返回文本行"""
+    entries = system.exams.most_improved(field, n, start, end)
+    label = FIELD_LABELS.get(field, field)
+    lines = [f"{_pad('名次', 8)}{_pad('学号', 10)}{_pad('姓名', 10)}{_pad('之前', 10)}{_pad('之后', 10)}进步({label})",
+             "-" * 60]
+    for rank, (student_id, before, after, delta) in enumerate(entries, 1):
+        student = system.students.get(student_id)
+        name = student['name'] if student else '(已删除)'
+        lines.append(f"{rank:<8}{_pad(student_id, 10)}{_pad(name, 10)}{before:<10.1f}{after:<10.1f}{delta:+.1f}")
+    return lines
+
+class EnhancedStudentGradeSystem(GradeService):
+    """curses交互界面, 数据和业务逻辑由GradeService提供"""
+    TOAST_SECONDS = 2  # 底部状态栏消息的最短显示时间
+    ROW_CACHE_SIZE = 10000  # 学生列表格式化行缓存的最大条数
+    SAVE_DELAY = 0.5  # 最后一次修改后等待这么久没有新修改时在后台提交
+    SAVE_MAX_DELAY = 2.0  # 第一次未提交的修改最多等待这么久
+    SAVED_SECONDS = 2  # 状态栏显示"已保存"的时间
+    BACKUP_MENU_SIZE = 10  # 备份与恢复菜单中列出的最近备份数
     
     def __init__(self, stdscr):
         self.stdscr = stdscr
-        # 初始化curses
+        self._init_curses()
+        self.painter = ScreenPainter(stdscr)
+        
+        self.current_user = None
+        self._toast = None  # 状态栏消息: (内容, 颜色, 过期时间)
+        self._save_status_shown = ""  # 状态栏右侧当前显示的保存状态
+        self._row_cache = {}       # 学号 -> 格式化后的表格行
+        self._audit_error = None   # 后台提交后写审计日志失败的异常, 由界面线程显示
+        # 界面线程除了等待按键时一直持有lock, 后台线程只在界面等待按键时提交修改
+        self.lock = threading.RLock()
+        self.lock.acquire()
+        self.saver = BackgroundSaver(self._background_commit, self.SAVE_DELAY, self.SAVE_MAX_DELAY)
+        super().__init__()
+        self.storage.defer_compact = True  # 合并快照的耗时与学生数量有关, 推迟到退出时
+        self.saver.start()
+    
+    def _init_curses(self):
+        """初始化curses"""
         curses.curs_set(0)  # 隐藏光标
         curses.noecho()     # 不显示输入字符
         curses.cbreak()     # 立即响应按键
@@ -21,61 +156,175 @@ class EnhancedStudentGradeSystem:
             curses.init_pair(2, curses.COLOR_BLACK, curses.COLOR_CYAN)  # 选中项颜色
             curses.init_pair(3, curses.COLOR_YELLOW, curses.COLOR_BLACK) # 输入框颜色
             curses.init_pair(4, curses.COLOR_RED, curses.COLOR_BLACK)    # 错误信息颜色
-        
-        # 初始化数据
-        self.students = {}
-        self.accounts = {
-            'admin': {'password': self._hash_password('123456'), 'role': 'admin'}
-        }
-        self.current_user = None
-        self._load_data()
     
-    def _hash_password(self, password):
-        """使用MD5加密密码"""
-        return hashlib.md5(password.encode('utf-8')).hexdigest()
+    def _commit_change(self, table, key, value=None):
+        """写入一条修改, 同时让学生列表的缓存失效"""
+        if table == 'students':
+            self._row_cache.pop(key, None)
+        super()._commit_change(table, key, value)
     
-    def _load_data(self):
-        """从文件加载数据"""
-        try:
-            with open(self.DATA_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                self.students = data.get('students', {})
-                self.accounts = data.get('accounts', {
-                    'admin': {'password': self._hash_password('123456'), 'role': 'admin'}
-                })
-        except FileNotFoundError:
-            pass
-        except Exception as e:
-            self._show_message(f"加载数据失败: {e}", 2, curses.color_pair(4))
-    
-    def _save_data(self):
-        """保存数据到文件"""
-        try:
-            data = {
-                'students': self.students,
-                'accounts': self.accounts
-            }
-            with open(self.DATA_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2)
-        except Exception as e:
-            self._show_message(f"保存数据失败: {e}", 2, curses.color_pair(4))
+    def _on_storage_change(self, table, key, old, new):
+        """其他进程的修改被合并时, 同样让学生列表的缓存失效"""
+        if table == 'students':
+            self._row_cache.pop(key, None)
+        super()._on_storage_change(table, key, old, new)
+    
+    def _on_storage_reload(self):
+        self._row_cache.clear()
+        super()._on_storage_reload()
     
     def _show_message(self, message, delay=1, color_pair=None):
-        """显示消息并暂停"""
-        self.stdscr.clear()
-        h, w = self.stdscr.getmaxyx()
+        """在底部状态栏显示消息, 不等待, 至少显示delay秒后自动消失"""
         color = color_pair or curses.color_pair(1)
-        self.stdscr.addstr(h//2, (w - len(message))//2, message, color)
+        metrics.increment('ui.toast')
+        self._toast = (message, color, monotonic() + max(delay, self.TOAST_SECONDS))
+        self._refresh()
+    
+    def _save_status(self):
+        """状态栏右侧的保存状态: 保存中/已保存(显示SAVED_SECONDS秒)/保存失败"""
+        state = self.saver.state
+        if self.saver.busy():
+            return "保存中..."
+        if state == 'failed':
+            return "保存失败"
+        if state == 'saved' and monotonic() - self.saver.state_time < self.SAVED_SECONDS:
+            return "已保存"
+        return ""
+    
+    def _draw_toast(self):
+        """在最后一行绘制状态栏消息和保存状态, 不改变光标位置"""
+        h, w = self.stdscr.getmaxyx()
+        y, x = self.stdscr.getyx()
+        self.stdscr.move(h-1, 0)
+        self.stdscr.clrtoeol()
+        if self._toast:
+            message, color, _ = self._toast
+            # 最后一行不能写到最右一列, 否则curses会报错
+            self.stdscr.addstr(h-1, max(0, (w - len(message))//2), message[:w-1], color)
+        status = self._save_status()
+        if status and w > _width(status) + 2:
+            color = curses.color_pair(4) if self.saver.state == 'failed' else curses.color_pair(1)
+            self.stdscr.addstr(h-1, w - _width(status) - 2, status, color)
+        self._save_status_shown = status
+        self.stdscr.move(y, x)
+    
+    def _refresh(self):
+        """绘制状态栏后刷新屏幕"""
+        self._draw_toast()
         self.stdscr.refresh()
-        sleep(delay)
+    
+    @metrics.timed('ui.key_wait')
+    def _getch(self, wide=False):
+        """读取按键, 等待期间状态栏消息到期时自动清除
+        
+        wide为True时用get_wch读取, 可以输入中文: 可打印字符返回str,
+        控制字符和功能键返回整数键码。
+        等待按键时释放lock让后台线程提交修改, 同时刷新状态栏中的保存状态。
+        """
+        while True:
+            self._report_save_error()
+            if self._toast and self._toast[2] <= monotonic():
+                self._toast = None
+                self._refresh()
+                continue
+            if self._save_status() != self._save_status_shown:
+                self._refresh()
+                continue
+            delays = []
+            if self._toast:
+                delays.append(self._toast[2] - monotonic())
+            if self._save_status_shown and self.saver.state != 'failed':
+                delays.append(0.1)  # 保存状态很快会变化
+            self.stdscr.timeout(max(1, int(min(delays) * 1000)) if delays else -1)
+            
+            self.lock.release()
+            try:
+                if wide:
+                    try:
+                        key = self.stdscr.get_wch()
+                    except curses.error:  # 超时没有输入
+                        continue
+                else:
+                    key = self.stdscr.getch()
+            finally:
+                self.lock.acquire()
+            if isinstance(key, str) and not key.isprintable():
+                key = ord(key)
+            if key != -1:
+                return key
+    
+    def _background_commit(self):
+        """由后台线程调用, 取得lock(界面线程等待按键)后提交
+        
+        提交成功后才把等待提交的操作记入操作历史; 失败时失败的原因记在save_error中,
+        没有保存的修改从历史中放弃(冲突时只放弃冲突的记录), 由界面线程显示错误。
+        """
+        with self.lock:
+            try:
+                self.storage.commit()
+            except ConflictError as e:
+                self.save_error = e
+                self.history.discard(e.changes)
+                self._commit_history()
+                raise
+            except Exception as e:
+                self.save_error = e
+                self.history.discard()  # 可能只提交了一部分, 这批修改不能撤销
+                raise
+            self.save_error = None
+            self._commit_history()
+    
+    def _commit_history(self):
+        """把已经写入的操作记入操作历史, 写审计日志失败的异常留给界面线程显示"""
+        try:
+            self.history.commit()
+        except OSError as e:
+            self._audit_error = e
+    
+    def save(self):
+        """结束这次操作(到时间时开始自动备份)后交给后台线程提交, 不等待写入完成
+        
+        短时间内的多次修改合并为一次写入, 写入成功后才记入操作历史, 提交失败时在状态栏提示。
+        """
+        self.history.stage()
+        self._auto_backup()
+        self.saver.schedule()
+        return True
+    
+    def flush(self):
+        """在当前线程立即提交全部修改, 返回是否成功"""
+        self.history.stage()
+        self._auto_backup()
+        saved = self.saver.flush()
+        self._report_save_error()
+        return saved
+    
+    def _report_save_error(self):
+        """显示后台提交失败和写审计日志失败的原因"""
+        error = self.saver.take_error()
+        if error is not None:
+            self._show_error(f"保存数据失败: {error}")
+        error, self._audit_error = self._audit_error, None
+        if error is not None:
+            self._show_error(f"写入审计日志失败: {error}")
+    
+    def close(self):
+        """提交全部修改并停止后台线程后关闭存储"""
+        self.flush()
+        self.lock.release()
+        self.saver.stop()
+        super().close()
+    
+    def _show_error(self, message):
+        """显示错误信息"""
+        self._show_message(message, 2, curses.color_pair(4))
     
     def _draw_menu(self, title, options, selected_idx):
-        """绘制菜单"""
-        self.stdscr.clear()
-        h, w = self.stdscr.getmaxyx()
+        """绘制菜单, 只重绘变化的选项"""
+        h, w = self.painter.begin('menu')
         
         # 绘制标题
-        self.stdscr.addstr(2, (w - len(title))//2, title, curses.color_pair(1))
+        self.painter.line(2, (w - len(title))//2, title, curses.color_pair(1))
         
         # 绘制选项
         for idx, option in enumerate(options):
@@ -83,21 +332,28 @@ class EnhancedStudentGradeSystem:
             y = h//2 - len(options)//2 + idx + 2  # 增加垂直间距
             
             if idx == selected_idx:
-                self.stdscr.addstr(y, x, option, curses.color_pair(2))
+                self.painter.line(y, x, option, curses.color_pair(2))
             else:
-                self.stdscr.addstr(y, x, option)
+                self.painter.line(y, x, option)
         
         # 绘制底部提示
         help_text = "使用↑↓箭头选择，回车确认 | ESC返回"
-        self.stdscr.addstr(h-2, (w - len(help_text))//2, help_text, curses.color_pair(1))
-        self.stdscr.refresh()
+        self.painter.line(h-2, (w - len(help_text))//2, help_text, curses.color_pair(1))
+        self._finish_frame()
+    
+    def _finish_frame(self):
+        """绘制状态栏并输出差量绘制的一帧"""
+        self._draw_toast()
+        self.painter.finish()
     
     def _get_menu_choice(self, title, options):
         """获取菜单选择"""
         selected_idx = 0
+        self.refresh()  # 回到菜单时合并其他进程的修改
+        self.painter.reset()
         while True:
             self._draw_menu(title, options, selected_idx)
-            key = self.stdscr.getch()
+            key = self._getch()
             
             if key == curses.KEY_UP:
                 selected_idx = max(0, selected_idx - 1)
@@ -111,7 +367,7 @@ class EnhancedStudentGradeSystem:
     def _get_input(self, prompt):
         """获取用户输入（解决重叠问题）"""
         curses.echo()
-        self.stdscr.clear()
+        self.stdscr.erase()
         h, w = self.stdscr.getmaxyx()
         
         # 绘制输入框
@@ -126,12 +382,12 @@ class EnhancedStudentGradeSystem:
             self.stdscr.addch(h//2, input_x + i, ' ', curses.color_pair(3))
         
         self.stdscr.move(h//2, input_x)
-        self.stdscr.refresh()
+        self._refresh()
         
         # 获取输入
         input_str = ""
         while True:
-            ch = self.stdscr.getch()
+            ch = self._getch()
             if ch == 10 or ch == 13:  # 回车键
                 break
             elif ch == 27:  # ESC键
@@ -146,14 +402,14 @@ class EnhancedStudentGradeSystem:
                 input_str += chr(ch)
                 self.stdscr.addch(h//2, input_x + len(input_str) - 1, chr(ch))
             
-            self.stdscr.refresh()
+            self._refresh()
         
         curses.noecho()
         return input_str.strip()
     
     def _get_password_input(self, prompt="请输入密码: "):
         """获取密码输入(无回显)"""
-        self.stdscr.clear()
+        self.stdscr.erase()
         h, w = self.stdscr.getmaxyx()
         
         # 绘制输入框
@@ -168,11 +424,11 @@ class EnhancedStudentGradeSystem:
             self.stdscr.addch(h//2, input_x + i, ' ', curses.color_pair(3))
         
         self.stdscr.move(h//2, input_x)
-        self.stdscr.refresh()
+        self._refresh()
         
         password = []
         while True:
-            ch = self.stdscr.getch()
+            ch = self._getch()
             if ch == 10 or ch == 13:  # 回车键
                 break
             elif ch == 27:  # ESC键
@@ -186,7 +442,7 @@ class EnhancedStudentGradeSystem:
                 password.append(chr(ch))
                 self.stdscr.addch(h//2, input_x + len(password) - 1, '*')
             
-            self.stdscr.refresh()
+            self._refresh()
         
         return ''.join(password)
     
@@ -196,7 +452,7 @@ class EnhancedStudentGradeSystem:
         if password is None:  # ESC键
             return False
         
-        return self.accounts['admin']['password'] == self._hash_password(password)
+        return self.check_password('admin', password)
     
     def login(self):
         """用户登录"""
@@ -209,9 +465,10 @@ class EnhancedStudentGradeSystem:
             if password is None:  # ESC键
                 return False
             
-            if username in self.accounts and \
-               self.accounts[username]['password'] == self._hash_password(password):
-                self.current_user = username
+            if self.check_password(username, password):
+                if username != self.history.user:
+                    self.history.clear()  # 不能撤销其他用户的修改
+                self.current_user = self.history.user = username
                 self._show_message(f"登录成功! 欢迎{username}", 1)
                 return True
             else:
@@ -221,15 +478,15 @@ class EnhancedStudentGradeSystem:
     
     def _show_confirm(self, message):
         """显示确认对话框"""
-        self.stdscr.clear()
+        self.stdscr.erase()
         h, w = self.stdscr.getmaxyx()
         
         self.stdscr.addstr(h//2 - 1, (w - len(message))//2, message, curses.color_pair(1))
         self.stdscr.addstr(h//2 + 1, (w - 10)//2, "[Y] 是  [N] 否", curses.color_pair(1))
-        self.stdscr.refresh()
+        self._refresh()
         
         while True:
-            key = self.stdscr.getch()
+            key = self._getch()
             if key == ord('y') or key == ord('Y'):
                 return True
             elif key == ord('n') or key == ord('N') or key == 27:  # ESC键
@@ -261,9 +518,13 @@ class EnhancedStudentGradeSystem:
                 if new_password is None:  # ESC键
                     continue
                 
-                self.accounts[username]['password'] = self._hash_password(new_password)
-                self._save_data()
-                self._show_message(f"用户{username}的密码已重置", 1)
+                try:
+                    self.set_password(username, new_password)
+                except ValueError as e:
+                    self._show_message(str(e), 2, curses.color_pair(4))
+                    return
+                if self.save():
+                    self._show_message(f"用户{username}的密码已重置", 1)
                 return
             else:
                 # 学生修改自己的密码
@@ -271,7 +532,7 @@ class EnhancedStudentGradeSystem:
                 if old_password is None:  # ESC键
                     return
                 
-                if self.accounts[self.current_user]['password'] != self._hash_password(old_password):
+                if not self.check_password(self.current_user, old_password):
                     self._show_message("原密码错误!", 1)
                     continue
                 
@@ -284,23 +545,22 @@ class EnhancedStudentGradeSystem:
                     continue
                 
                 if new_password == confirm_password:
-                    self.accounts[self.current_user]['password'] = self._hash_password(new_password)
-                    self._save_data()
-                    self._show_message("密码修改成功!", 1)
+                    try:
+                        self.set_password(self.current_user, new_password)
+                    except ValueError as e:
+                        self._show_message(str(e), 2, curses.color_pair(4))
+                        return
+                    if self.save():
+                        self._show_message("密码修改成功!", 1)
                     return
                 else:
                     self._show_message("两次输入的新密码不一致!", 1)
     
-    def add_student_account(self, student_id, name):
-        """添加学生账户"""
-        if student_id not in self.accounts:
-            self.accounts[student_id] = {
-                'password': self._hash_password('s123456'),
-                'role': 'student'
-            }
-    
-    def add_student(self):
-        """添加学生信息(仅管理员)"""
+    def add_student(self, continuous=False):
+        """添加学生信息(仅管理员)
+        
+        continuous为True时为快速录入模式: 添加成功后直接开始录入下一名学生, 按ESC结束
+        """
         if not self._check_admin():
             return
         
@@ -317,43 +577,30 @@ class EnhancedStudentGradeSystem:
             if name is None:  # ESC键
                 return
             
-            chinese = self._get_input("请输入语文成绩(ESC返回): ")
-            if chinese is None:  # ESC键
-                return
-            
-            math = self._get_input("请输入数学成绩(ESC返回): ")
-            if math is None:  # ESC键
-                return
-            
-            english = self._get_input("请输入英语成绩(ESC返回): ")
-            if english is None:  # ESC键
-                return
+            # 按科目配置依次录入各科成绩
+            texts = {}
+            for subject in SCHEMA.subjects:
+                text = self._get_input(f"请输入{subject.label}成绩(ESC返回): ")
+                if text is None:  # ESC键
+                    return
+                texts[subject.key] = text
             
             try:
-                chinese = float(chinese)
-                math = float(math)
-                english = float(english)
-            except ValueError:
-                self._show_message("请输入有效的数字成绩!", 1)
+                scores = {key: parse_score(text, key) for key, text in texts.items()}
+            except ValueError as e:
+                self._show_message(str(e), 1)
                 continue
             
-            total = chinese + math + english
-            average = total / 3
-            
-            self.students[student_id] = {
-                'name': name,
-                'chinese': chinese,
-                'math': math,
-                'english': english,
-                'total': total,
-                'average': average
-            }
-            
-            # 自动创建学生账户
-            self.add_student_account(student_id, name)
-            self._save_data()
-            self._show_message(f"学生{name}添加成功! 初始密码为s123456", 2)
-            return
+            # 同时自动创建学生账户
+            try:
+                self.register_student(student_id, name, scores)
+            except ValueError as e:
+                self._show_message(str(e), 1)
+                continue
+            if self.save():
+                self._show_message(f"学生{name}添加成功! 初始密码为{DEFAULT_PASSWORD}", 2)
+            if not continuous:
+                return
     
     def delete_student(self):
         """删除学生信息(仅管理员)"""
@@ -366,15 +613,14 @@ class EnhancedStudentGradeSystem:
                 return
             
             if student_id in self.students:
-                name = self.students[student_id]['name']
-                del self.students[student_id]
-                
                 # 同时删除账户
-                if student_id in self.accounts:
-                    del self.accounts[student_id]
-                
-                self._save_data()
-                self._show_message(f"学生{name}(学号:{student_id})已删除", 1)
+                try:
+                    name = self.remove_student(student_id)['name']
+                except ValueError as e:
+                    self._show_message(str(e), 2, curses.color_pair(4))
+                    return
+                if self.save():
+                    self._show_message(f"学生{name}(学号:{student_id})已删除, 可在操作历史中撤销", 2)
                 return
             else:
                 self._show_message("未找到该学号的学生!", 1)
@@ -397,31 +643,94 @@ class EnhancedStudentGradeSystem:
             
             student = self.students.get(student_id)
             if student:
-                self.stdscr.clear()
-                h, w = self.stdscr.getmaxyx()
-                
-                info = [
-                    f"学号: {student_id}",
-                    f"姓名: {student['name']}",
-                    f"语文: {student['chinese']}",
-                    f"数学: {student['math']}",
-                    f"英语: {student['english']}",
-                    f"总分: {student['total']}",
-                    f"平均分: {student['average']:.2f}"
-                ]
-                
-                for i, line in enumerate(info):
-                    self.stdscr.addstr(h//2 - len(info)//2 + i, (w - len(line))//2, line)
-                
-                self.stdscr.addstr(h-2, (w - 20)//2, "按任意键继续...", curses.color_pair(1))
-                self.stdscr.refresh()
-                self.stdscr.getch()
+                self._show_student(student_id, student)
                 return
             else:
                 retry = self._show_confirm("未找到该学号的学生! 是否重试? (Y/N)")
                 if not retry:
                     return
     
+    def _show_student(self, student_id, student):
+        """显示一名学生的详细信息, 按任意键返回"""
+        self.stdscr.erase()
+        h, w = self.stdscr.getmaxyx()
+        
+        info = [
+            f"学号: {student_id}",
+            f"姓名: {student['name']}",
+            *(f"{subject.label}: {student[subject.key]}" for subject in SCHEMA.subjects),
+            f"总分: {student['total']}",
+            f"平均分: {student['average']:.2f}",
+            f"绩点: {student['gpa']:.2f}",
+            "总分排名: 第{}名 / 共{}人".format(*self.ranking.rank('total', student['total']))
+        ]
+        
+        for i, line in enumerate(info):
+            self.stdscr.addstr(h//2 - len(info)//2 + i, (w - len(line))//2, line)
+        
+        self.stdscr.addstr(h-2, (w - 20)//2, "按任意键继续...", curses.color_pair(1))
+        self._refresh()
+        self._getch()
+    
+    def search_students(self):
+        """按学号、姓名或拼音首字母搜索学生, 输入时实时刷新结果(仅管理员)"""
+        if not self._check_admin():
+            return
+        
+        title = "搜索学生"
+        separator = "-" * _width(ROSTER_HEADER)
+        query = ""
+        results = []
+        last_query = None
+        selected = 0
+        if not self.search_index.built:
+            if len(self.students) > 100000:
+                self._show_message("正在建立搜索索引, 请稍候...", 1)
+            self.search_index.build()
+        self.painter.reset()
+        
+        while True:
+            h, w = self.painter.begin('search')
+            max_lines = max(1, h - 9)
+            if query != last_query:
+                # 只在输入变化时重新搜索, 结果数不超过一屏
+                results = self.search_index.search(query, max_lines)
+                last_query = query
+                selected = 0
+            selected = max(0, min(selected, len(results) - 1))
+            x = max(0, (w - _width(ROSTER_HEADER))//2)
+            
+            self.painter.line(2, (w - len(title))//2, title, curses.color_pair(1))
+            self.painter.line(4, x, f"搜索: {query}", curses.color_pair(3))
+            self.painter.line(5, x, _clip(ROSTER_HEADER, w - x - 1))
+            self.painter.line(6, x, _clip(separator, w - x - 1))
+            for row, student_id in enumerate(results[:max_lines]):
+                attr = curses.color_pair(2) if row == selected else 0
+                self.painter.line(7 + row, x, _clip(self._format_row(student_id), w - x - 1), attr)
+            if query and not results:
+                self.painter.line(7, x, "没有匹配的学生")
+            
+            help_text = "输入学号/姓名/拼音首字母 | ↑↓选择 | 回车查看 | ESC返回"
+            self.painter.line(h-2, (w - len(help_text))//2, help_text, curses.color_pair(1))
+            self._finish_frame()
+            
+            key = self._getch(wide=True)
+            if key == curses.KEY_UP:
+                selected -= 1
+            elif key == curses.KEY_DOWN:
+                selected += 1
+            elif key in (10, 13):  # 回车键
+                if results:
+                    student_id = results[selected]
+                    self._show_student(student_id, self.students[student_id])
+                    self.painter.reset()
+            elif key == 27:  # ESC键
+                return
+            elif key in (curses.KEY_BACKSPACE, 127, 8):
+                query = query[:-1]
+            elif isinstance(key, str) and len(query) < 20:
+                query += key
+    
     def update_student(self):
         """修改学生成绩(仅管理员)"""
         if not self._check_admin():
@@ -438,16 +747,14 @@ class EnhancedStudentGradeSystem:
             
             # 显示当前信息
             student = self.students[student_id]
-            self.stdscr.clear()
+            self.stdscr.erase()
             h, w = self.stdscr.getmaxyx()
             
             info = [
                 "当前学生信息:",
                 f"学号: {student_id}",
                 f"姓名: {student['name']}",
-                f"语文: {student['chinese']}",
-                f"数学: {student['math']}",
-                f"英语: {student['english']}",
+                *(f"{subject.label}: {student[subject.key]}" for subject in SCHEMA.subjects),
                 "",
                 "请输入新的成绩(留空则保持不变, ESC返回):"
             ]
@@ -455,41 +762,68 @@ class EnhancedStudentGradeSystem:
             for i, line in enumerate(info):
                 self.stdscr.addstr(h//2 - len(info)//2 + i, (w - len(line))//2, line)
             
-            self.stdscr.refresh()
+            self._refresh()
             
             # 获取新成绩
-            chinese = self._get_input("语文成绩: ")
-            if chinese is None:  # ESC键
-                return
-            
-            math = self._get_input("数学成绩: ")
-            if math is None:  # ESC键
-                return
-            
-            english = self._get_input("英语成绩: ")
-            if english is None:  # ESC键
-                return
+            texts = {}
+            for subject in SCHEMA.subjects:
+                text = self._get_input(f"{subject.label}成绩: ")
+                if text is None:  # ESC键
+                    return
+                if text:
+                    texts[subject.key] = text
             
             try:
-                if chinese:
-                    student['chinese'] = float(chinese)
-                if math:
-                    student['math'] = float(math)
-                if english:
-                    student['english'] = float(english)
-                
-                # 重新计算总分和平均分
-                student['total'] = student['chinese'] + student['math'] + student['english']
-                student['average'] = student['total'] / 3
-                
-                self._save_data()
-                self._show_message("学生信息更新成功!", 1)
+                scores = {key: parse_score(text, key) for key, text in texts.items()}
+                self.update_scores(student_id, scores)
+                if self.save():
+                    self._show_message("学生信息更新成功!", 1)
                 return
-            except ValueError:
-                self._show_message("请输入有效的数字成绩!", 1)
+            except ValueError as e:
+                self._show_message(str(e), 1)
+    
+    def _format_row(self, student_id):
+        """格式化一名学生的表格行, 结果按学号缓存"""
+        line = self._row_cache.get(student_id)
+        if line is None:
+            if len(self._row_cache) >= self.ROW_CACHE_SIZE:
+                self._row_cache.clear()
+            info = self.students[student_id]
+            line = _pad(student_id, 10) + _pad(info['name'], 10) + "".join(
+                f"{info[field]:<{width}{fmt}}" for field, width, fmt in ROSTER_COLUMNS)
+            self._row_cache[student_id] = line
+        return line
+    
+    def _roster_page(self, query, anchor, limit):
+        """从anchor之后取一屏学生, 不足一屏时改为显示最后一屏, 返回(anchor, Page)"""
+        page = self.query_index.page(query, anchor, limit)
+        if len(page.ids) < limit and anchor is not None:
+            page = self.query_index.page(query, None, limit, backward=True)
+            anchor = None
+            if page.has_more:
+                anchor = self.query_index.page(query, page.first, 1, backward=True).first
+        return anchor, page
+    
+    def _ask_roster_filter(self, query):
+        """选择科目并输入成绩范围, 返回新的查询, 取消时返回原查询"""
+        fields = [field for field, _, _ in ROSTER_COLUMNS]
+        field_idx = self._get_menu_choice("按成绩筛选", [FIELD_LABELS[field] for field in fields])
+        if field_idx == -1:
+            return query
+        field = fields[field_idx]
+        text = self._get_input(f"{FIELD_LABELS[field]}范围(如60-90、>=90、<60, 留空取消): ")
+        if text is None:
+            return query
+        if not text.strip():
+            return query.filtered(field, None, None)
+        try:
+            return query.filtered(field, *parse_range(text))
+        except ValueError as e:
+            self._show_message(str(e), 1)
+            return query
     
     def show_all_students(self):
-        """显示所有学生信息(仅管理员)"""
+        """显示所有学生信息(仅管理员), 可按任意一列排序并按成绩范围筛选"""
         if not self._check_admin():
             return
         
@@ -497,50 +831,475 @@ class EnhancedStudentGradeSystem:
             self._show_message("当前没有学生信息!", 1)
             return
         
-        self.stdscr.clear()
-        h, w = self.stdscr.getmaxyx()
+        sort_fields = ['id', 'name'] + [field for field, _, _ in ROSTER_COLUMNS]
+        query = RosterQuery('id')
+        anchor = None  # 屏幕第一行之前那一行的排序条目, None表示从头开始
+        separator = "-" * _width(ROSTER_HEADER)
+        self.painter.reset()
+        
+        while True:
+            h, w = self.painter.begin('roster')
+            max_lines = max(1, h - 8)  # 保留空间给标题、表头、底部提示和状态栏
+            anchor, page = self._roster_page(query, anchor, max_lines)
+            total = self.query_index.count(query)
+            header = roster_header(query.sort, query.descending)
+            x = max(0, (w - _width(header))//2)
+            
+            # 绘制标题和表头
+            title = f"所有学生信息: {describe_query(query)}"
+            if page.start is not None and total > max_lines:
+                title += f" ({page.start + 1}-{page.start + len(page.ids)}/{total})"
+            else:
+                title += f" (共{total}人)"
+            self.painter.line(2, max(0, (w - _width(title))//2), _clip(title, w - 1), curses.color_pair(1))
+            self.painter.line(4, x, _clip(header, w - x - 1))
+            self.painter.line(5, x, _clip(separator, w - x - 1))
+            
+            # 只格式化和绘制这一屏的行
+            for row, student_id in enumerate(page.ids):
+                self.painter.line(6 + row, x, _clip(self._format_row(student_id), w - x - 1))
+            if not page.ids:
+                self.painter.line(6, x, "没有符合条件的学生")
+            
+            # 绘制底部提示
+            help_text = "↑↓浏览 | PgUp/PgDn翻页 | Home/End | ←→排序列 | R升降序 | F筛选 | C清除筛选 | ESC返回"
+            self.painter.line(h-2, max(0, (w - _width(help_text))//2), _clip(help_text, w - 1), curses.color_pair(1))
+            self._finish_frame()
+            
+            # 处理按键, 翻页都从当前屏幕的首行或末行的排序条目出发
+            key = self._getch()
+            if key == curses.KEY_UP:
+                if anchor is not None:
+                    anchor = self.query_index.page(query, anchor, 1, backward=True).first
+            elif key == curses.KEY_DOWN:
+                if page.ids:
+                    anchor = page.first
+            elif key == curses.KEY_PPAGE:
+                if anchor is not None:
+                    above = self.query_index.page(query, anchor, max_lines, backward=True)
+                    anchor = None
+                    if above.has_more:
+                        anchor = self.query_index.page(query, above.first, 1, backward=True).first
+            elif key == curses.KEY_NPAGE:
+                if page.ids:
+                    anchor = page.last
+            elif key == curses.KEY_HOME:
+                anchor = None
+            elif key == curses.KEY_END:
+                below = self.query_index.page(query, None, max_lines, backward=True)
+                anchor = None
+                if below.has_more:
+                    anchor = self.query_index.page(query, below.first, 1, backward=True).first
+            elif key in (curses.KEY_LEFT, curses.KEY_RIGHT):
+                step = 1 if key == curses.KEY_RIGHT else -1
+                sort = sort_fields[(sort_fields.index(query.sort) + step) % len(sort_fields)]
+                query = query.sorted_by(sort, descending=sort in SCORE_FIELDS)  # 成绩默认从高到低
+                anchor = None
+            elif key in (ord('r'), ord('R')):
+                query = query.sorted_by(query.sort, not query.descending)
+                anchor = None
+            elif key in (ord('f'), ord('F')):
+                query = self._ask_roster_filter(query)
+                anchor = None
+                self.painter.reset()
+            elif key in (ord('c'), ord('C')):
+                query = query.unfiltered()
+                anchor = None
+            elif key == 27:  # ESC键
+                return
+    
+    def show_statistics(self):
+        """显示全体学生的成绩统计(仅管理员)"""
+        if not self._check_admin():
+            return
         
-        title = "所有学生信息:"
-        header = f"{'学号':<10}{'姓名':<10}{'语文':<8}{'数学':<8}{'英语':<8}{'总分':<8}{'平均分':<8}"
-        separator = "-" * 60
+        stats = class_statistics(self.students)
+        if not stats:
+            self._show_message("当前没有学生信息!", 1)
+            return
         
-        # 计算显示范围
-        start_idx = 0
-        max_lines = h - 6  # 保留空间给标题和底部提示
+        fields = [field for field in STAT_FIELDS if field in stats]
+        field_idx = 0
         
         while True:
-            self.stdscr.clear()
+            self.stdscr.erase()
+            h, w = self.stdscr.getmaxyx()
             
-            # 绘制标题
-            self.stdscr.addstr(2, (w - len(title))//2, title, curses.color_pair(1))
+            title = f"成绩统计分析 (共{stats[fields[0]]['count']}人)"
+            lines = [
+                "".join(_pad(text, 10) for text in ('科目', '平均分', '中位数', '标准差', '最低', '最高', '及格率')),
+                "-" * 66
+            ]
+            for field in fields:
+                s = stats[field]
+                lines.append(f"{_pad(FIELD_LABELS[field], 10)}{s['mean']:<10.2f}{s['median']:<10.2f}"
+                             f"{s['std']:<10.2f}{s['min']:<10.1f}{s['max']:<10.1f}{s['pass_rate']:<8.1%}")
             
-            # 绘制表头
-            self.stdscr.addstr(4, (w - len(header))//2, header)
-            self.stdscr.addstr(5, (w - len(separator))//2, separator)
+            percentiles = list(stats[fields[0]]['percentiles'])
+            lines.append("")
+            lines.append(_pad('科目', 10) + "".join(_pad(f"P{p}", 10) for p in percentiles))
+            for field in fields:
+                values = stats[field]['percentiles']
+                lines.append(_pad(FIELD_LABELS[field], 10) + "".join(f"{values[p]:<10.1f}" for p in percentiles))
             
-            # 绘制学生信息
-            student_ids = list(self.students.keys())
-            for i in range(start_idx, min(start_idx + max_lines, len(student_ids))):
-                student_id = student_ids[i]
-                info = self.students[student_id]
-                line = f"{student_id:<10}{info['name']:<10}{info['chinese']:<8.1f}{info['math']:<8.1f}" \
-                       f"{info['english']:<8.1f}{info['total']:<8.1f}{info['average']:<8.2f}"
-                self.stdscr.addstr(6 + i - start_idx, (w - len(line))//2, line)
+            # 当前科目的分数段分布
+            field = fields[field_idx]
+            histogram = stats[field]['histogram']
+            peak = max(count for _, _, count in histogram) or 1
+            lines.append("")
+            lines.append(f"分数段分布: {FIELD_LABELS[field]}")
+            for low, high, count in histogram:
+                bar = '#' * round(30 * count / peak)
+                lines.append(f"{low:>5g}-{high:<5g} {bar:<30} {count}")
+            
+            self.stdscr.addstr(1, (w - len(title))//2, title, curses.color_pair(1))
+            x = max(0, (w - 66)//2)
+            for i, line in enumerate(lines):
+                if 3 + i >= h - 2:
+                    break
+                self.stdscr.addstr(3 + i, x, line[:w - x - 1])
+            
+            help_text = "←→切换分数段科目 | C按班级统计 | ESC返回"
+            self.stdscr.addstr(h-2, (w - _width(help_text))//2, help_text, curses.color_pair(1))
+            self._refresh()
+            
+            key = self._getch()
+            if key == curses.KEY_LEFT:
+                field_idx = (field_idx - 1) % len(fields)
+            elif key == curses.KEY_RIGHT:
+                field_idx = (field_idx + 1) % len(fields)
+            elif key in (ord('c'), ord('C')):
+                self._show_lines("按班级统计(平均分)", format_shard_statistics(self.shard_statistics()))
+            elif key == 27:  # ESC键
+                return
+    
+    def import_students(self):
+        """从CSV文件批量导入学生(仅管理员)"""
+        if not self._check_admin():
+            return
+        
+        path = self._get_input("请输入CSV文件路径(ESC返回): ")
+        if path is None:  # ESC键
+            return
+        
+        try:
+            result = self.bulk_import(path)
+        except (OSError, ValueError) as e:
+            self._show_message(f"导入失败: {e}", 2, curses.color_pair(4))
+            return
+        
+        lines = [f"成功导入{len(result.imported)}名学生, 初始密码为s123456",
+                 f"出错{len(result.errors)}行"]
+        if result.errors:
+            lines.append("")
+            lines.extend(f"第{line_no}行: {message}" for line_no, message in result.errors)
+        self._show_lines("批量导入结果", lines)
+    
+    def show_rankings(self):
+        """成绩排名查询(仅管理员)"""
+        if not self._check_admin():
+            return
+        
+        while True:
+            choice = self._get_menu_choice("成绩排名查询", [
+                "1. 查询学生排名",
+                "2. 查看前N名",
+                "3. 查看后N名"
+            ])
+            if choice == -1:  # ESC键
+                return
+            
+            if choice == 0:
+                student_id = self._get_input("请输入要查询的学生学号(ESC返回): ")
+                if student_id is None:  # ESC键
+                    continue
+                student = self.students.get(student_id)
+                if not student:
+                    self._show_message("未找到该学号的学生!", 1)
+                    continue
+                lines = []
+                for field in RANK_FIELDS:
+                    rank, count = self.ranking.rank(field, student[field])
+                    lines.append(f"{_pad(FIELD_LABELS[field], 8)}{student[field]:<8.1f}第{rank}名 / 共{count}人")
+                self._show_lines(f"{student['name']}(学号:{student_id})的排名", lines)
+            else:
+                field_idx = self._get_menu_choice("选择排名科目", [FIELD_LABELS[f] for f in RANK_FIELDS])
+                if field_idx == -1:  # ESC键
+                    continue
+                field = RANK_FIELDS[field_idx]
+                
+                n = self._get_input("请输入人数N(ESC返回): ")
+                if n is None:  # ESC键
+                    continue
+                try:
+                    n = int(n)
+                except ValueError:
+                    self._show_message("请输入有效的人数!", 1)
+                    continue
+                
+                if choice == 1:
+                    title = f"{FIELD_LABELS[field]}前{n}名"
+                    entries = self.ranking.top(field, n)
+                else:
+                    title = f"{FIELD_LABELS[field]}后{n}名"
+                    entries = self.ranking.bottom(field, n)
+                
+                lines = [
+                    f"{_pad('名次', 8)}{_pad('学号', 10)}{_pad('姓名', 10)}{FIELD_LABELS[field]}",
+                    "-" * 40
+                ]
+                for rank, student_id, score in entries:
+                    name = self.students[student_id]['name']
+                    lines.append(f"{rank:<8}{_pad(student_id, 10)}{_pad(name, 10)}{score:.1f}")
+                self._show_lines(title, lines)
+    
+    def _show_lines(self, title, lines):
+        """显示可上下滚动的多行文本, ESC返回"""
+        start_idx = 0
+        while True:
+            self.stdscr.erase()
+            h, w = self.stdscr.getmaxyx()
+            max_lines = h - 6
+            
+            self.stdscr.addstr(2, (w - len(title))//2, title, curses.color_pair(1))
+            x = max(0, (w - max(len(line) for line in lines))//2) if lines else 0
+            for i, line in enumerate(lines[start_idx:start_idx + max_lines]):
+                self.stdscr.addstr(4 + i, x, line[:w - x - 1])
             
-            # 绘制底部提示
             help_text = "↑↓浏览 | ESC返回"
-            if len(self.students) > max_lines:
-                help_text += f" ({start_idx+1}-{min(start_idx + max_lines, len(self.students))}/{len(self.students)})"
             self.stdscr.addstr(h-2, (w - len(help_text))//2, help_text, curses.color_pair(1))
+            self._refresh()
+            
+            key = self._getch()
+            if key == curses.KEY_UP and start_idx > 0:
+                start_idx -= 1
+            elif key == curses.KEY_DOWN and start_idx + max_lines < len(lines):
+                start_idx += 1
+            elif key == 27:  # ESC键
+                return
+    
+    def show_history(self):
+        """操作历史: 多级撤销和重做(仅管理员)"""
+        if not self._check_admin():
+            return
+        
+        while True:
+            self.stdscr.erase()
+            h, w = self.stdscr.getmaxyx()
+            max_lines = max(1, h - 8)
+            
+            undo_entries, redo_entries = self.history.entries()
+            lines = [f"[可重做] {strftime('%H:%M:%S', localtime(entry.time))} {entry.describe()}"
+                     for entry in reversed(redo_entries)]
+            lines.append("---------- 当前状态 ----------")
+            lines.extend(f"{strftime('%H:%M:%S', localtime(entry.time))} {entry.describe()}"
+                         for entry in undo_entries)
+            if not undo_entries and not redo_entries:
+                lines.append("本次登录后还没有修改")
+            # 当前状态附近的几条最重要, 过长时两端截断
+            start = max(0, min(len(redo_entries) - max_lines // 2, len(lines) - max_lines))
+            
+            title = "操作历史"
+            self.stdscr.addstr(2, (w - len(title))//2, title, curses.color_pair(1))
+            x = max(0, (w - 70)//2)
+            for i, line in enumerate(lines[start:start + max_lines]):
+                self.stdscr.addstr(4 + i, x, _clip(line, w - x - 1))
+            
+            help_text = "U撤销 | R重做 | ESC返回"
+            self.stdscr.addstr(h-2, (w - len(help_text))//2, help_text, curses.color_pair(1))
+            self._refresh()
             
-            self.stdscr.refresh()
+            key = self._getch()
+            if key in (ord('u'), ord('U'), ord('r'), ord('R')):
+                undo = key in (ord('u'), ord('U'))
+                try:
+                    description = self.undo() if undo else self.redo()
+                except ValueError as e:
+                    self._show_message(str(e), 2, curses.color_pair(4))
+                else:
+                    self._show_message(f"{'已撤销' if undo else '已重做'}: {description}", 2)
+            elif key == 27:  # ESC键
+                return
+    
+    def show_exams(self):
+        """多次考试的成绩历史: 记录、导入、平均分、学生成绩变化和进步排名(仅管理员)"""
+        if not self._check_admin():
+            return
+        
+        while True:
+            choice = self._get_menu_choice("考试成绩历史", [
+                "1. 记录当前成绩为一次考试",
+                "2. 导入以前的数据文件",
+                "3. 各次考试平均分",
+                "4. 学生成绩变化",
+                "5. 进步最多的学生"
+            ])
+            if choice == -1:  # ESC键
+                return
             
-            # 处理按键
-            key = self.stdscr.getch()
+            try:
+                if choice in (0, 1):
+                    name = self._get_input("请输入考试名称(ESC返回): ")
+                    if name is None:  # ESC键
+                        continue
+                    if choice == 0:
+                        exam = self.record_exam(name)
+                    else:
+                        path = self._get_input("请输入data.json副本的路径(ESC返回): ")
+                        if path is None:  # ESC键
+                            continue
+                        exam = self.import_exam(name, path)
+                    self._show_message(f"已记录考试{exam.name}: {exam.count}名学生", 2)
+                elif choice == 2:
+                    self.exams.refresh()
+                    self._show_lines("各次考试平均分", format_exam_averages(self.exams.exams()))
+                elif choice == 3:
+                    student_id = self._get_input("请输入要查询的学生学号(ESC返回): ")
+                    if student_id is None:  # ESC键
+                        continue
+                    self.exams.refresh()
+                    trajectory = self.exams.trajectory(student_id)
+                    if not trajectory:
+                        self._show_message("没有该学号的考试成绩!", 1)
+                        continue
+                    student = self.students.get(student_id)
+                    name = student['name'] if student else student_id
+                    self._show_lines(f"{name}(学号:{student_id})的成绩变化", format_trajectory(trajectory))
+                else:
+                    field_idx = self._get_menu_choice("选择比较的科目", [FIELD_LABELS[f] for f in SCORE_FIELDS])
+                    if field_idx == -1:  # ESC键
+                        continue
+                    field = SCORE_FIELDS[field_idx]
+                    n = self._get_input("请输入人数N(ESC返回): ")
+                    if n is None:  # ESC键
+                        continue
+                    try:
+                        n = int(n)
+                    except ValueError:
+                        self._show_message("请输入有效的人数!", 1)
+                        continue
+                    self.exams.refresh()
+                    exams = self.exams.exams()
+                    lines = format_improved(self, field, n)
+                    self._show_lines(f"{exams[-2].name} → {exams[-1].name} {FIELD_LABELS[field]}进步前{n}名", lines)
+            except (OSError, ValueError) as e:
+                self._show_message(str(e), 2, curses.color_pair(4))
+    
+    def generate_report_cards(self):
+        """生成成绩单和班级报告到指定目录(仅管理员)"""
+        if not self._check_admin():
+            return
+        
+        out_dir = self._get_input("请输入输出目录(ESC返回): ")
+        if out_dir is None or not out_dir.strip():  # ESC键
+            return
+        fmt_idx = self._get_menu_choice("选择报告格式", ["HTML", "Markdown", "纯文本"])
+        if fmt_idx == -1:  # ESC键
+            return
+        fmt = ('html', 'md', 'txt')[fmt_idx]
+        
+        self._show_message("正在生成报告...", 1)
+        try:
+            stats = self.generate_reports(out_dir.strip(), fmt)
+        except (OSError, ValueError) as e:
+            self._show_message(f"生成报告失败: {e}", 2, curses.color_pair(4))
+            return
+        self._show_lines("生成成绩单", [
+            f"输出目录: {os.path.abspath(out_dir.strip())}",
+            f"生成{stats.rendered}份, 跳过{stats.skipped}份(内容未变化), 删除{stats.removed}份",
+            f"用时{stats.seconds:.2f}秒",
+        ])
+    
+    def show_backups(self):
+        """立即备份, 或恢复到最近的某个备份(仅管理员)"""
+        if not self._check_admin():
+            return
+        
+        while True:
+            backups = self.backups.list()[::-1][:self.BACKUP_MENU_SIZE]
+            options = ["1. 立即备份"] + [f"{i}. 恢复到 {backup.describe()}" for i, backup in enumerate(backups, 2)]
+            choice = self._get_menu_choice(f"备份与恢复(共{len(self.backups.list())}个备份)", options)
+            if choice == -1:  # ESC键
+                return
+            
+            try:
+                if choice == 0:
+                    self._show_message("正在备份...", 1)
+                    backup = self.backup()
+                    self._show_message(f"已备份 {backup.describe()}", 2)
+                    continue
+                backup = backups[choice - 1]
+                if not self._show_confirm(f"确定要恢复到{strftime('%Y-%m-%d %H:%M:%S', localtime(backup.time))}的备份吗? (Y/N)"):
+                    continue
+                if not self._verify_admin_password():
+                    self._show_message("管理员密码验证失败!", 1, curses.color_pair(4))
+                    continue
+                self._show_message("正在恢复...", 1)
+                changed = self.restore_backup(backup.path)
+                self._show_message(f"恢复完成, {changed}条记录有变化, 恢复前的数据已另行备份", 2)
+            except (OSError, ValueError) as e:
+                self._show_message(str(e), 2, curses.color_pair(4))
+    
+    def show_diagnostics(self):
+        """系统诊断: 数据规模和各关键路径的耗时统计(仅管理员)
+        
+        E开启/关闭性能计数, R清空计数, D把计数写入metrics文件。
+        """
+        if not self._check_admin():
+            return
+        
+        start_idx = 0
+        while True:
+            self.stdscr.erase()
+            h, w = self.stdscr.getmaxyx()
+            max_lines = h - 6
+            
+            data = metrics.snapshot()
+            lines = [
+                f"性能计数: {'已开启' if metrics.ENABLED else '未开启'}  结果文件: {metrics.METRICS_FILE}",
+                f"存储后端: {self.STORAGE_BACKEND}  学生数: {len(self.students)}  账户数: {len(self.accounts)}",
+                ""
+            ]
+            if hasattr(self.storage, 'shard_names'):
+                lines.insert(2, f"分片: {len(self.storage.shard_names())}个, 已加载"
+                                f"{len(self.storage.loaded_shards())}个, 学号前{self.storage.prefix_length}位为分片名")
+            if data['histograms']:
+                lines.append(_pad('名称', 24) + "".join(
+                    _pad(text, 10) for text in ('次数', '总计(ms)', '平均', 'p50', 'p99', '最大')))
+                lines.append("-" * 84)
+                for name, stat in sorted(data['histograms'].items(), key=lambda item: -item[1]['total_ms']):
+                    lines.append(f"{_pad(name, 24)}{stat['count']:<10}{stat['total_ms']:<10.1f}{stat['mean_ms']:<10.3f}"
+                                 f"{stat['p50_ms']:<10.3f}{stat['p99_ms']:<10.3f}{stat['max_ms']:<10.3f}")
+            elif not metrics.ENABLED:
+                lines.append("按E开启, 或设置环境变量STUDENT_MANAGER_METRICS=1、使用--metrics参数启动")
+            if data['counters']:
+                lines.append("")
+                lines.extend(f"{_pad(name, 24)}{count}" for name, count in data['counters'].items())
+            
+            title = "系统诊断"
+            self.stdscr.addstr(1, (w - len(title))//2, title, curses.color_pair(1))
+            x = max(0, (w - 84)//2)
+            for i, line in enumerate(lines[start_idx:start_idx + max_lines]):
+                self.stdscr.addstr(3 + i, x, _clip(line, w - x - 1))
+            
+            help_text = "↑↓浏览 | E开启/关闭 | R清空 | D写入文件 | ESC返回"
+            self.stdscr.addstr(h-2, (w - _width(help_text))//2, help_text, curses.color_pair(1))
+            self._refresh()
+            
+            key = self._getch()
             if key == curses.KEY_UP and start_idx > 0:
                 start_idx -= 1
-            elif key == curses.KEY_DOWN and start_idx + max_lines < len(self.students):
+            elif key == curses.KEY_DOWN and start_idx + max_lines < len(lines):
                 start_idx += 1
+            elif key in (ord('e'), ord('E')):
+                metrics.enable(not metrics.ENABLED)
+            elif key in (ord('r'), ord('R')):
+                metrics.reset()
+            elif key in (ord('d'), ord('D')):
+                try:
+                    self._show_message(f"已写入{metrics.dump()}", 1)
+                except OSError as e:
+                    self._show_message(f"写入失败: {e}", 2, curses.color_pair(4))
             elif key == 27:  # ESC键
                 return
     
@@ -561,13 +1320,23 @@ class EnhancedStudentGradeSystem:
                 title = "管理员菜单"
                 options = [
                     "1. 添加学生信息",
-                    "2. 删除学生信息",
-                    "3. 查询学生信息",
-                    "4. 修改学生成绩",
-                    "5. 显示所有学生信息",
-                    "6. 重置学生密码",
-                    "7. 修改密码",
-                    "8. 退出登录",
+                    "2. 连续录入学生(快速模式)",
+                    "3. 删除学生信息",
+                    "4. 查询学生信息",
+                    "5. 搜索学生(学号/姓名/拼音)",
+                    "6. 修改学生成绩",
+                    "7. 显示所有学生信息",
+                    "8. 成绩统计分析",
+                    "9. 成绩排名查询",
+                    "10. 批量导入学生(CSV)",
+                    "11. 重置学生密码",
+                    "12. 修改密码",
+                    "13. 操作历史(撤销/重做)",
+                    "14. 考试成绩历史",
+                    "15. 生成成绩单",
+                    "16. 备份与恢复",
+                    "17. 系统诊断",
+                    "18. 退出登录",
                     "0. 退出系统"
                 ]
             else:
@@ -589,24 +1358,44 @@ class EnhancedStudentGradeSystem:
                 if choice == 0:
                     self.add_student()
                 elif choice == 1:
-                    self.delete_student()
+                    self.add_student(continuous=True)
                 elif choice == 2:
-                    self.query_student()
+                    self.delete_student()
                 elif choice == 3:
-                    self.update_student()
+                    self.query_student()
                 elif choice == 4:
-                    self.show_all_students()
+                    self.search_students()
                 elif choice == 5:
-                    self.change_password()  # 管理员重置密码
+                    self.update_student()
                 elif choice == 6:
-                    self.change_password()  # 修改自己的密码
+                    self.show_all_students()
                 elif choice == 7:
+                    self.show_statistics()
+                elif choice == 8:
+                    self.show_rankings()
+                elif choice == 9:
+                    self.import_students()
+                elif choice == 10:
+                    self.change_password()  # 管理员重置密码
+                elif choice == 11:
+                    self.change_password()  # 修改自己的密码
+                elif choice == 12:
+                    self.show_history()
+                elif choice == 13:
+                    self.show_exams()
+                elif choice == 14:
+                    self.generate_report_cards()
+                elif choice == 15:
+                    self.show_backups()
+                elif choice == 16:
+                    self.show_diagnostics()
+                elif choice == 17:
                     self.logout()
                     return
-                elif choice == 8:
+                elif choice == 18:
                     if self._show_confirm("确定要退出系统吗? (Y/N)"):
                         if self._verify_admin_password():
-                            self._save_data()
+                            self.save()
                             return True  # 退出系统
                         else:
                             self._show_message("管理员密码验证失败!", 1, curses.color_pair(4))
@@ -620,27 +1409,32 @@ class EnhancedStudentGradeSystem:
                     return
                 elif choice == 3:
                     if self._show_confirm("确定要退出系统吗? (Y/N)"):
-                        self._save_data()
+                        self.save()
                         return True  # 退出系统
 
 def main(stdscr):
     system = EnhancedStudentGradeSystem(stdscr)
     
-    # 登录循环
-    while True:
-        if system.login():
-            # 主菜单循环
-            should_exit = system.main_menu()
-            if should_exit:
-                break
-        else:
-            # 登录失败后的选项
-            options = ["1. 重试", "0. 退出"]
-            choice = system._get_menu_choice("登录失败", options)
-            if choice == 0:  # 重试
-                continue
-            elif choice == 1:  # 退出
-                break
+    # 出现异常或按Ctrl+C时也要提交尚未写入的修改并停止后台线程
+    try:
+        # 登录循环
+        while True:
+            if system.login():
+                # 主菜单循环
+                should_exit = system.main_menu()
+                system.flush()  # 离开主菜单时确保修改都已写入
+                if should_exit:
+                    break
+            else:
+                # 登录失败后的选项
+                options = ["1. 重试", "0. 退出"]
+                choice = system._get_menu_choice("登录失败", options)
+                if choice == 0:  # 重试
+                    continue
+                elif choice == 1:  # 退出
+                    break
+    finally:
+        system.close()
     
     # 退出前清屏
     stdscr.clear()
@@ -648,5 +1442,223 @@ def main(stdscr):
     stdscr.refresh()
     sleep(1)
 
+def cli(argv=None):
+    """命令行入口, 不带子命令时进入交互界面"""
+    parser = argparse.ArgumentParser(description="学生成绩管理系统")
+    parser.add_argument('--metrics', action='store_true',
+                        help="开启性能计数, 退出时写入metrics文件(也可设置STUDENT_MANAGER_METRICS=1)")
+    parser.add_argument('--metrics-file', help=f"性能计数的输出文件, 默认{metrics.METRICS_FILE}")
+    parser.add_argument('--profile', metavar='FILE', default=os.environ.get('STUDENT_MANAGER_PROFILE'),
+                        help="用cProfile记录整个会话并写入FILE, 用python -m pstats FILE查看")
+    subparsers = parser.add_subparsers(dest='command')
+    
+    import_parser = subparsers.add_parser('import', help="从CSV文件批量导入学生")
+    import_parser.add_argument('file', help="CSV文件路径, 第一行为表头")
+    import_parser.add_argument('--encoding', default='utf-8-sig', help="文件编码, 默认utf-8-sig")
+    
+    export_parser = subparsers.add_parser('export', help="流式导出学生成绩")
+    export_parser.add_argument('file', help="输出文件路径")
+    export_parser.add_argument('--format', choices=FORMATS,
+                               help="导出格式, 默认按扩展名推断(.csv/.jsonl, 其他为列式二进制)")
+    export_parser.add_argument('--columns', default=','.join(EXPORT_COLUMNS),
+                               help="导出的列, 逗号分隔, 默认全部")
+    export_parser.add_argument('--field', default='total', help="按该字段筛选成绩范围, 默认total")
+    export_parser.add_argument('--min', type=float, help="成绩下限(含)")
+    export_parser.add_argument('--max', type=float, help="成绩上限(含)")
+    
+    batch_parser = subparsers.add_parser('batch', help="批量执行JSON行格式的操作(增删改查、改密码)")
+    batch_parser.add_argument('file', nargs='?', default='-', help="操作文件路径, 省略或为-时读取标准输入")
+    batch_parser.add_argument('--encoding', default='utf-8', help="文件编码, 默认utf-8")
+    
+    serve_parser = subparsers.add_parser('serve', help="启动HTTP/JSON接口服务, 支持多人同时录入")
+    serve_parser.add_argument('--host', default='127.0.0.1', help="监听地址, 默认127.0.0.1")
+    serve_parser.add_argument('--port', type=int, default=8000, help="监听端口, 默认8000")
+    
+    subparsers.add_parser('migrate', help="按当前科目配置(schema.json)检查并重新计算全部学生的派生成绩")
+    
+    exam_parser = subparsers.add_parser('exam', help="多次考试的成绩历史: 记录、导入和查询")
+    exam_commands = exam_parser.add_subparsers(dest='exam_command', required=True)
+    record_parser = exam_commands.add_parser('record', help="把全体学生的当前成绩记为一次考试")
+    record_parser.add_argument('name', help="考试名称, 如2024春期中")
+    record_parser.add_argument('--from', dest='source', metavar='FILE',
+                               help="改为导入以前保存的data.json副本中的成绩, 请按时间顺序导入")
+    exam_commands.add_parser('list', help="列出各次考试的人数和各科平均分")
+    trend_parser = exam_commands.add_parser('trend', help="学生在各次考试中的成绩")
+    trend_parser.add_argument('id', help="学号")
+    improved_parser = exam_commands.add_parser('improved', help="两次考试之间进步最多的学生")
+    improved_parser.add_argument('--field', default='total', help="比较的字段, 默认total")
+    improved_parser.add_argument('-n', type=int, default=10, help="人数, 默认10")
+    improved_parser.add_argument('--start', help="之前的考试, 默认倒数第二次")
+    improved_parser.add_argument('--end', help="之后的考试, 默认最近一次")
+    
+    report_parser = subparsers.add_parser('report', help="生成每名学生的成绩单和各班级报告")
+    report_parser.add_argument('dir', help="输出目录")
+    report_parser.add_argument('--format', choices=REPORT_FORMATS, default='html', help="报告格式, 默认html")
+    report_parser.add_argument('--templates', metavar='DIR',
+                               help="模板目录, 其中的student.<格式>和class.<格式>替换内置模板")
+    report_parser.add_argument('--workers', type=int, help="并行生成的进程数, 默认为CPU数")
+    report_parser.add_argument('--force', action='store_true', help="全部重新生成, 不跳过内容未变化的报告")
+    
+    backup_parser = subparsers.add_parser('backup', help="立即备份全部数据(压缩的二进制快照), 并轮换旧备份")
+    backup_parser.add_argument('--codec', choices=BACKUP_CODECS, default='zlib', help="压缩方式, 默认zlib")
+    
+    restore_parser = subparsers.add_parser('restore', help="从备份恢复数据, 默认恢复最新的备份")
+    restore_parser.add_argument('file', nargs='?', help="备份文件路径, 省略时从备份目录中选择")
+    restore_parser.add_argument('--at', metavar='TIME', help="恢复到该时间(如\"2024-06-01 12:00\")或之前的最后一个备份")
+    restore_parser.add_argument('--list', action='store_true', help="只列出已有的备份")
+    
+    args = parser.parse_args(argv)
+    if args.metrics:
+        metrics.enable()
+    if args.metrics_file:
+        metrics.METRICS_FILE = args.metrics_file
+    try:
+        with metrics.profile(args.profile):
+            return run_command(args)
+    finally:
+        if metrics.ENABLED:
+            try:
+                metrics.dump()
+            except OSError as e:
+                print(f"写入性能计数失败: {e}", file=sys.stderr)
+
+def run_exam_command(system, args):
+    """执行exam子命令, 生成要输出的各行"""
+    if args.exam_command == 'record':
+        if args.source:
+            exam = system.import_exam(args.name, args.source)
+        else:
+            exam = system.record_exam(args.name)
+        yield f"已记录考试{exam.name}: {exam.count}名学生"
+    elif args.exam_command == 'list':
+        yield from format_exam_averages(system.exams.exams())
+    elif args.exam_command == 'trend':
+        trajectory = system.exams.trajectory(args.id)
+        if not trajectory:
+            raise ValueError(f"没有该学号的考试成绩: {args.id}")
+        yield from format_trajectory(trajectory)
+    elif args.exam_command == 'improved':
+        yield from format_improved(system, args.field, args.n, args.start, args.end)
+
+def run_restore_command(system, args):
+    """执行restore子命令, 生成要输出的各行"""
+    if args.list:
+        backups = system.backups.list()
+        if not backups:
+            yield "还没有备份"
+        for backup in backups:
+            yield f"{backup.describe()}  {backup.path}"
+        return
+    if args.file:
+        path = args.file
+    else:
+        path = system.backups.find(parse_time(args.at) if args.at else None).path
+    changed = system.restore_backup(path)
+    yield f"已从{path}恢复, {changed}条记录有变化"
+
+def run_command(args):
+    """执行解析后的命令行, 返回退出码"""
+    try:
+        if args.command is None:
+            curses.wrapper(main)
+            return 0
+        system = GradeService()
+    except (SchemaError, WriteError) as e:  # 已有数据不能按当前科目配置迁移, 不能继续运行
+        print(f"启动失败: {e}", file=sys.stderr)
+        return 1
+    try:
+        if args.command == 'import':
+            try:
+                result = system.bulk_import(args.file, args.encoding)
+            except (OSError, ValueError) as e:
+                print(f"导入失败: {e}", file=sys.stderr)
+                return 1
+            for line_no, message in result.errors:
+                print(f"第{line_no}行: {message}", file=sys.stderr)
+            print(f"成功导入{len(result.imported)}名学生, 出错{len(result.errors)}行")
+            return 1 if result.errors else 0
+        elif args.command == 'export':
+            columns = [column.strip() for column in args.columns.split(',') if column.strip()]
+            field = args.field if args.min is not None or args.max is not None else None
+            try:
+                stats = export_students(system.students, args.file, args.format, columns,
+                                        field, args.min, args.max)
+            except (OSError, ValueError) as e:
+                print(f"导出失败: {e}", file=sys.stderr)
+                return 1
+            print(f"导出{stats.rows}行, 用时{stats.seconds:.2f}秒, {stats.rows_per_second:,.0f}行/秒")
+            return 0
+        elif args.command == 'batch':
+            try:
+                if args.file == '-':
+                    result = run_batch(system, sys.stdin, sys.stdout)
+                else:
+                    with open(args.file, 'r', encoding=args.encoding) as f:
+                        result = run_batch(system, f, sys.stdout)
+            except OSError as e:
+                print(f"读取操作文件失败: {e}", file=sys.stderr)
+                return 1
+            except WriteError as e:
+                print(f"执行失败: {e}", file=sys.stderr)
+                return 1
+            if not system.save():   # 失败原因已由save()输出
+                return 1
+            for line_no, message in result.errors:
+                print(f"第{line_no}行: {message}", file=sys.stderr)
+            print(f"执行{result.applied}条操作, 出错{len(result.errors)}行", file=sys.stderr)
+            return 1 if result.errors else 0
+        elif args.command == 'serve':
+            print(f"服务已启动: http://{args.host}:{args.port}/ (Ctrl+C停止)", file=sys.stderr)
+            try:
+                asyncio.run(serve(system, args.host, args.port))
+            except KeyboardInterrupt:
+                pass
+            return 0
+        elif args.command == 'migrate':
+            # 启动时已自动迁移过一次, 这里再检查是否还有派生成绩与配置不一致的记录
+            try:
+                count = system.migrated + system.migrate_schema()
+            except ValueError as e:
+                print(f"迁移失败: {e}", file=sys.stderr)
+                return 1
+            print(f"按当前科目配置更新了{count}名学生的成绩")
+            return 0
+        elif args.command == 'report':
+            try:
+                stats = system.generate_reports(args.dir, args.format, args.templates, args.workers, args.force)
+            except (OSError, ValueError) as e:
+                print(f"生成报告失败: {e}", file=sys.stderr)
+                return 1
+            print(f"生成{stats.rendered}份报告, 跳过{stats.skipped}份(内容未变化), "
+                  f"删除{stats.removed}份, 用时{stats.seconds:.2f}秒")
+            return 0
+        elif args.command == 'backup':
+            try:
+                backup = system.backup(args.codec)
+            except OSError as e:
+                print(f"备份失败: {e}", file=sys.stderr)
+                return 1
+            print(f"已备份到{backup.path} ({backup.size / 2**20:.1f}MB)")
+            return 0
+        elif args.command == 'restore':
+            try:
+                for line in run_restore_command(system, args):
+                    print(line)
+            except (OSError, ValueError) as e:
+                print(f"恢复失败: {e}", file=sys.stderr)
+                return 1
+            return 0
+        elif args.command == 'exam':
+            try:
+                for line in run_exam_command(system, args):
+                    print(line)
+            except (OSError, ValueError) as e:
+                print(f"操作失败: {e}", file=sys.stderr)
+                return 1
+            return 0
+    finally:
+        system.close()
+
 if __name__ == "__main__":
-    curses.wrapper(main)
+    multiprocessing.freeze_support()  # 打包为二进制时进程池需要
+    sys.exit(cli())
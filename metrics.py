@@ -0,0 +1,178 @@
+"""运行时性能计数
+
+持久化、密码哈希、索引和界面绘制等关键路径用timed装饰器或timer()记录耗时, 每个名称
+对应一个Histogram: 次数、总耗时、最小/最大值和按2的幂(微秒)分桶的分布, 用于估计p50/p99。
+increment()只计数, 如冲突次数、凭据缓存命中次数。
+
+默认关闭, 设置环境变量STUDENT_MANAGER_METRICS=1或使用命令行参数--metrics开启。
+关闭时timed只多一次布尔判断, timer()返回共享的空上下文, 都不读取时钟。
+开启后退出时把结果写入METRICS_FILE, 管理员菜单中的"系统诊断"可以随时查看。
+profile()用cProfile记录整个会话, 结果可以用 python -m pstats 文件名 查看。
+"""
+import os
+import json
+import cProfile
+import functools
+import threading
+from time import perf_counter, strftime
+from contextlib import contextmanager
+
+ENABLED = os.environ.get('STUDENT_MANAGER_METRICS', '0') not in ('', '0')
+METRICS_FILE = os.environ.get('STUDENT_MANAGER_METRICS_FILE', 'metrics.json')
+BUCKETS = 32    # 第i个桶为[2^i, 2^(i+1))微秒, 最后一个桶包含更大的值
+
+_histograms = {}
+_counters = {}
+_lock = threading.Lock()    # 密码哈希等在线程池中执行, 记录时加锁
+
+
+class Histogram:
+    """一个名称的耗时分布(秒)"""
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.buckets[min(BUCKETS - 1, int(seconds * 1e6).bit_length())] += 1
+
+    def percentile(self, p):
+        """按分桶估计的百分位数: 所在桶的上界, 不超过最大值"""
+        if not self.count:
+            return 0.0
+        rank = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(self.max, (1 << i) / 1e6)
+        return self.max
+
+    def to_dict(self):
+        ms = 1000.0
+        return {
+            'count': self.count,
+            'total_ms': round(self.total * ms, 3),
+            'mean_ms': round(self.total / self.count * ms, 3) if self.count else 0.0,
+            'min_ms': round(self.min * ms, 3) if self.count else 0.0,
+            'p50_ms': round(self.percentile(50) * ms, 3),
+            'p99_ms': round(self.percentile(99) * ms, 3),
+            'max_ms': round(self.max * ms, 3),
+        }
+
+
+def enable(flag=True):
+    global ENABLED
+    ENABLED = flag
+
+
+def record(name, seconds):
+    """记录一次耗时"""
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.add(seconds)
+
+
+def increment(name, n=1):
+    """计数加n, 关闭时不记录"""
+    if ENABLED:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + n
+
+
+def timed(name):
+    """记录函数每次调用耗时的装饰器"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name):
+    """记录with语句块耗时的上下文管理器"""
+    return _Timer(name) if ENABLED else _NULL_TIMER
+
+
+def snapshot():
+    """当前全部计数: {'histograms': {名称: 统计}, 'counters': {名称: 次数}}"""
+    with _lock:
+        return {
+            'histograms': {name: h.to_dict() for name, h in sorted(_histograms.items())},
+            'counters': dict(sorted(_counters.items())),
+        }
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def dump(path=None):
+    """把当前计数写入JSON文件, 返回文件路径"""
+    path = path or METRICS_FILE
+    data = dict(snapshot(), time=strftime('%Y-%m-%dT%H:%M:%S'), pid=os.getpid())
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, path)
+    return path
+
+
+@contextmanager
+def profile(path):
+    """path不为空时用cProfile记录with语句块并把结果写入path"""
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
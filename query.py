@@ -0,0 +1,291 @@
+"""学生列表的排序、筛选和键集分页
+
+RosterQuery描述一次查询: 排序字段、升序或降序以及若干成绩范围筛选。
+QueryIndex在有序序列上执行查询, 取一页的开销只与页大小有关, 不需要对全体学生重新排序:
+- 成绩字段直接使用RankingIndex维护的 (-成绩, 学号) 序列; 学号和姓名的序列在第一次
+  按它们排序时建立, 之后随增删改同步更新
+- 分页使用键集(keyset)而不是偏移: 游标是上一页最后一行在序列中的条目, 下一页从游标
+  之后二分定位, 翻到任何位置都是O(log n + 页大小), 翻页期间有记录被修改也不会重复或遗漏
+- 排序字段本身的范围筛选直接二分得到序列中的一段
+- 其他字段的筛选先由该字段的序列二分得到符合条件的人数, 不超过全体的SELECTIVE时取出
+  这些学生按排序字段排好并缓存, 数据变化前翻页直接使用; 否则沿排序序列逐条检查,
+  平均每页检查的记录不超过页大小的1/SELECTIVE倍
+"""
+import math
+import json
+
+import metrics
+from ranking import RankingIndex, SortedList
+from storage import QUERY_FIELDS, SCORE_FIELDS
+
+DEFAULT_PAGE_SIZE = 50
+
+
+def parse_range(text):
+    """解析成绩范围, 返回(下限, 上限), 都包含在范围内, None表示不限
+
+    支持 "60-90"、">=90"、">90"、"<=60"、"<60" 和单个分数, 格式错误时抛出ValueError。
+    """
+    text = text.strip().replace(' ', '')
+    try:
+        for prefix in ('>=', '<=', '>', '<'):
+            if text.startswith(prefix):
+                value = float(text[len(prefix):])
+                if prefix == '>=':
+                    return value, None
+                if prefix == '<=':
+                    return None, value
+                if prefix == '>':
+                    return math.nextafter(value, math.inf), None
+                return None, math.nextafter(value, -math.inf)
+        low, sep, high = text.partition('-')
+        if not sep:
+            return float(text), float(text)
+        low, high = float(low), float(high)
+    except ValueError:
+        raise ValueError(f"成绩范围格式错误: {text}, 应为 60-90、>=90 或 <60") from None
+    if low > high:
+        raise ValueError(f"成绩范围下限大于上限: {text}")
+    return low, high
+
+
+def format_range(low, high):
+    """parse_range的逆运算, 用于显示"""
+    if low is None:
+        return f"<{math.nextafter(high, math.inf):g}" if high != round(high, 6) else f"<={high:g}"
+    if high is None:
+        return f">{math.nextafter(low, -math.inf):g}" if low != round(low, 6) else f">={low:g}"
+    return f"{low:g}" if low == high else f"{low:g}-{high:g}"
+
+
+class RosterQuery:
+    """一次列表查询, 创建后不再修改, key可以作为缓存的键
+
+    filters为[(字段, 下限, 上限)], 同一字段只保留最后一个。
+    """
+    __slots__ = ('sort', 'descending', 'filters')
+
+    def __init__(self, sort='id', descending=False, filters=()):
+        if sort not in QUERY_FIELDS:
+            raise ValueError(f"不支持的排序字段: {sort}")
+        merged = {}
+        for field, low, high in filters:
+            if field not in SCORE_FIELDS:
+                raise ValueError(f"不支持的筛选字段: {field}")
+            merged[field] = (low, high)
+        self.sort = sort
+        self.descending = bool(descending)
+        self.filters = tuple(sorted((field, low, high) for field, (low, high) in merged.items()))
+
+    @property
+    def key(self):
+        return self.sort, self.descending, self.filters
+
+    def __eq__(self, other):
+        return isinstance(other, RosterQuery) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def sorted_by(self, sort, descending=None):
+        """按另一字段排序的查询, 筛选不变"""
+        if descending is None:
+            descending = self.descending
+        return RosterQuery(sort, descending, self.filters)
+
+    def filtered(self, field, low, high):
+        """增加(或替换)一个字段的筛选, low和high都为None时取消该字段的筛选"""
+        filters = [item for item in self.filters if item[0] != field]
+        if low is not None or high is not None:
+            filters.append((field, low, high))
+        return RosterQuery(self.sort, self.descending, filters)
+
+    def unfiltered(self):
+        return RosterQuery(self.sort, self.descending)
+
+    def matches(self, record):
+        for field, low, high in self.filters:
+            score = record[field]
+            if (low is not None and score < low) or (high is not None and score > high):
+                return False
+        return True
+
+
+def entry_of(field, key, record):
+    """学生在字段有序序列中的条目, 成绩字段与RankingIndex一致"""
+    if field == 'id':
+        return (key,)
+    if field == 'name':
+        return (record['name'], key)
+    return (-record[field], key)
+
+
+def encode_cursor(entry):
+    """游标编码为字符串, 供HTTP接口返回给客户端"""
+    return json.dumps(list(entry), ensure_ascii=False, separators=(',', ':'))
+
+
+def decode_cursor(text):
+    """encode_cursor的逆运算, 格式错误时抛出ValueError"""
+    try:
+        entry = json.loads(text)
+    except ValueError:
+        entry = None
+    if not isinstance(entry, list) or not entry or not isinstance(entry[-1], str):
+        raise ValueError(f"无效的分页游标: {text}")
+    return tuple(entry)
+
+
+class Page:
+    """一页查询结果
+
+    ids按显示顺序排列; first/last是首行和末行的条目, 作为向前和向后翻页的游标;
+    has_more表示翻页方向上是否还有记录; start是首行在全部结果中的序号(从0开始),
+    逐条检查筛选条件时无法直接得到, 此时为None。
+    """
+    __slots__ = ('ids', 'first', 'last', 'has_more', 'start')
+
+    def __init__(self, entries, has_more, start):
+        self.ids = [entry[-1] for entry in entries]
+        self.first = entries[0] if entries else None
+        self.last = entries[-1] if entries else None
+        self.has_more = has_more
+        self.start = start
+
+
+class QueryIndex:
+    """在有序序列上执行RosterQuery"""
+    SELECTIVE = 0.25    # 其他字段的筛选结果不超过全体的这一比例时取出并缓存
+    CACHE_SIZE = 8      # 缓存的筛选结果数
+
+    def __init__(self, students, ranking=None):
+        self._students = students
+        self._ranking = ranking if ranking is not None else RankingIndex(students)
+        self._lists = {}    # 'id'/'name' -> SortedList
+        self._cache = {}    # query.key -> 筛选并排好序的SortedList
+        self._counts = {}   # query.key -> 逐条检查时的结果数
+
+    def update(self, key, old, new):
+        """学生记录由old变为new, 需在RankingIndex.update之后调用"""
+        self._cache.clear()
+        self._counts.clear()
+        for field, sorted_list in self._lists.items():
+            if old is not None and new is not None and entry_of(field, key, old) == entry_of(field, key, new):
+                continue
+            if old is not None:
+                sorted_list.remove(entry_of(field, key, old))
+            if new is not None:
+                sorted_list.add(entry_of(field, key, new))
+
+    def order(self, field):
+        """字段的有序序列"""
+        if field in self._ranking.fields:
+            return self._ranking.order(field)
+        sorted_list = self._lists.get(field)
+        if sorted_list is None:
+            with metrics.timer('index.sort_build'):
+                if field == 'id':
+                    sorted_list = SortedList((key,) for key in self._students)
+                else:
+                    sorted_list = SortedList(entry_of(field, key, record)
+                                             for key, record in self._students.items())
+            self._lists[field] = sorted_list
+        return sorted_list
+
+    @staticmethod
+    def _bounds(sorted_list, low, high):
+        """成绩序列中low <= 成绩 <= high的一段[lo, hi)"""
+        lo = 0 if high is None else sorted_list.bisect_left((-high,))
+        hi = len(sorted_list) if low is None else sorted_list.bisect_left((math.nextafter(-low, math.inf),))
+        return lo, hi
+
+    def _plan(self, query):
+        """返回(序列, lo, hi, check): 结果是序列[lo, hi)中满足check的条目, check为None表示全部"""
+        sort_range = [(low, high) for field, low, high in query.filters if field == query.sort]
+        others = [item for item in query.filters if item[0] != query.sort]
+        if not others:
+            sorted_list = self.order(query.sort)
+            if sort_range:
+                return (sorted_list,) + self._bounds(sorted_list, *sort_range[0]) + (None,)
+            return sorted_list, 0, len(sorted_list), None
+
+        cached = self._cache.get(query.key)
+        if cached is not None:
+            return cached, 0, len(cached), None
+        # 用符合条件人数最少的一个筛选确定候选学生
+        candidates = []
+        for field, low, high in others:
+            sorted_list = self.order(field)
+            lo, hi = self._bounds(sorted_list, low, high)
+            candidates.append((hi - lo, sorted_list, lo, hi))
+        count, sorted_list, lo, hi = min(candidates, key=lambda item: item[0])
+        if count > len(self._students) * self.SELECTIVE:
+            sorted_list = self.order(query.sort)
+            lo, hi = (self._bounds(sorted_list, *sort_range[0]) if sort_range
+                      else (0, len(sorted_list)))
+            return sorted_list, lo, hi, query.matches
+
+        with metrics.timer('query.materialize'):
+            entries = []
+            for _, key in sorted_list.islice(lo, hi):
+                record = self._students[key]
+                if query.matches(record):
+                    entries.append(entry_of(query.sort, key, record))
+            result = SortedList(entries)
+        if len(self._cache) >= self.CACHE_SIZE:
+            self._cache.pop(next(iter(self._cache)))
+        self._cache[query.key] = result
+        return result, 0, len(result), None
+
+    @metrics.timed('query.page')
+    def page(self, query, cursor=None, limit=DEFAULT_PAGE_SIZE, backward=False):
+        """按query的顺序取cursor之后(backward时为之前)的至多limit条, 返回Page
+
+        cursor为None时从开头(backward时从末尾)开始; 返回的行总是按query的顺序排列。
+        """
+        sorted_list, lo, hi, check = self._plan(query)
+        # 成绩序列按成绩从高到低排列, 学号和姓名序列从小到大
+        natural = query.descending == (query.sort in SCORE_FIELDS)
+        forward = natural != backward
+        size = len(sorted_list)
+        if forward:
+            start = lo
+            if cursor is not None:
+                start = sorted_list.bisect_left(cursor)
+                if start < size and sorted_list[start] == cursor:
+                    start += 1
+                start = max(start, lo)
+            entries = sorted_list.islice(start, hi)
+        else:
+            end = hi if cursor is None else min(hi, sorted_list.bisect_left(cursor))
+            entries = sorted_list.islice_reversed(size - end, size - lo)
+
+        rows = []
+        has_more = False
+        for entry in entries:
+            if check is not None and not check(self._students[entry[-1]]):
+                continue
+            if len(rows) == limit:
+                has_more = True
+                break
+            rows.append(entry)
+        if backward:
+            rows.reverse()
+
+        start = None
+        if check is None and rows:
+            position = sorted_list.bisect_left(rows[0])
+            start = position - lo if natural else hi - 1 - position
+        return Page(rows, has_more, start)
+
+    def count(self, query):
+        """查询结果的总人数, 逐条检查筛选时结果在数据变化前缓存"""
+        sorted_list, lo, hi, check = self._plan(query)
+        if check is None:
+            return hi - lo
+        count = self._counts.get(query.key)
+        if count is None:
+            with metrics.timer('query.count'):
+                count = sum(1 for entry in sorted_list.islice(lo, hi) if check(self._students[entry[-1]]))
+            self._counts[query.key] = count
+        return count
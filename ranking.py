@@ -0,0 +1,208 @@
+"""成绩排名索引
+
+为总分和各科成绩分别维护一个有序序列, 增删改学生时增量更新,
+查询名次和前N名/后N名时不需要对全体学生重新排序。
+"""
+from bisect import bisect_left, insort
+
+import metrics
+from storage import SUBJECTS
+
+RANK_FIELDS = ('total', 'average', 'gpa') + SUBJECTS
+
+
+class SortedList:
+    """分块有序列表
+
+    数据分成若干长度约为LOAD的有序块, 另用树状数组记录各块长度的前缀和,
+    插入、删除、按值求位置、按位置取值均为O(log n)(块内移动元素的开销很小)。
+    """
+    LOAD = 512
+
+    def __init__(self, iterable=()):
+        values = sorted(iterable)
+        self._lists = [values[i:i + self.LOAD] for i in range(0, len(values), self.LOAD)]
+        self._maxes = [sub[-1] for sub in self._lists]
+        self._len = len(values)
+        self._rebuild_tree()
+
+    def _rebuild_tree(self):
+        """按各块长度重建树状数组"""
+        tree = [0] + [len(sub) for sub in self._lists]
+        for i in range(1, len(tree)):
+            j = i + (i & -i)
+            if j < len(tree):
+                tree[j] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, pos, delta):
+        pos += 1
+        while pos < len(self._tree):
+            self._tree[pos] += delta
+            pos += pos & -pos
+
+    def _tree_prefix(self, pos):
+        """前pos个块的元素总数"""
+        total = 0
+        while pos > 0:
+            total += self._tree[pos]
+            pos -= pos & -pos
+        return total
+
+    def _tree_locate(self, idx):
+        """找到第idx个元素所在的块, 返回(块号, 块内下标)"""
+        pos = 0
+        step = 1 << (len(self._tree).bit_length())
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and self._tree[nxt] <= idx:
+                idx -= self._tree[nxt]
+                pos = nxt
+            step >>= 1
+        return pos, idx
+
+    def __len__(self):
+        return self._len
+
+    def add(self, value):
+        if not self._lists:
+            self._lists.append([value])
+            self._maxes.append(value)
+            self._len = 1
+            self._rebuild_tree()
+            return
+        k = bisect_left(self._maxes, value)
+        if k == len(self._maxes):
+            k -= 1
+        sub = self._lists[k]
+        insort(sub, value)
+        self._maxes[k] = sub[-1]
+        self._len += 1
+        if len(sub) > 2 * self.LOAD:
+            # 块过大时一分为二, 块数变化后重建树状数组
+            self._lists[k:k + 1] = [sub[:self.LOAD], sub[self.LOAD:]]
+            self._maxes[k:k + 1] = [sub[self.LOAD - 1], sub[-1]]
+            self._rebuild_tree()
+        else:
+            self._tree_add(k, 1)
+
+    def remove(self, value):
+        k = bisect_left(self._maxes, value)
+        if k == len(self._maxes):
+            raise ValueError(f"{value!r} 不在列表中")
+        sub = self._lists[k]
+        i = bisect_left(sub, value)
+        if i == len(sub) or sub[i] != value:
+            raise ValueError(f"{value!r} 不在列表中")
+        del sub[i]
+        self._len -= 1
+        if sub:
+            self._maxes[k] = sub[-1]
+            self._tree_add(k, -1)
+        else:
+            del self._lists[k]
+            del self._maxes[k]
+            self._rebuild_tree()
+
+    def bisect_left(self, value):
+        """返回value应插入的全局位置(即小于value的元素个数)"""
+        k = bisect_left(self._maxes, value)
+        if k == len(self._maxes):
+            return self._len
+        return self._tree_prefix(k) + bisect_left(self._lists[k], value)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self._len
+        if not 0 <= idx < self._len:
+            raise IndexError('SortedList下标越界')
+        k, i = self._tree_locate(idx)
+        return self._lists[k][i]
+
+    def islice(self, start=0, stop=None):
+        """按位置顺序遍历[start, stop)"""
+        stop = self._len if stop is None else min(stop, self._len)
+        if start >= stop:
+            return
+        k, i = self._tree_locate(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = self._lists[k][i:i + remaining]
+            yield from chunk
+            remaining -= len(chunk)
+            k, i = k + 1, 0
+
+    def islice_reversed(self, start=0, stop=None):
+        """从末尾开始倒序遍历, start/stop为倒数的位置"""
+        stop = self._len if stop is None else min(stop, self._len)
+        if start >= stop:
+            return
+        k, i = self._tree_locate(self._len - 1 - start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = self._lists[k][max(0, i + 1 - remaining):i + 1]
+            yield from reversed(chunk)
+            remaining -= len(chunk)
+            k -= 1
+            i = len(self._lists[k]) - 1 if k >= 0 else 0
+
+
+class RankingIndex:
+    """按字段维护 (-成绩, 学号) 的有序序列, 排在前面的成绩更高
+
+    名次采用并列排名: 名次 = 成绩严格更高的人数 + 1。
+    每个字段的序列在第一次查询时才建立, 之后随增删改同步更新。
+    """
+
+    def __init__(self, students, fields=RANK_FIELDS):
+        self._students = students
+        self.fields = fields
+        self._lists = {}
+
+    def _list(self, field):
+        sorted_list = self._lists.get(field)
+        if sorted_list is None:
+            with metrics.timer('index.rank_build'):
+                sorted_list = SortedList((-record[field], key) for key, record in self._students.items())
+            self._lists[field] = sorted_list
+        return sorted_list
+
+    def order(self, field):
+        """字段的有序序列, 元素为(-成绩, 学号), 供查询层(query.py)分页"""
+        return self._list(field)
+
+    def update(self, key, old, new):
+        """学生记录由old变为new, old为None表示新增, new为None表示删除"""
+        for field, sorted_list in self._lists.items():
+            if old is not None and new is not None and old[field] == new[field]:
+                continue
+            if old is not None:
+                sorted_list.remove((-old[field], key))
+            if new is not None:
+                sorted_list.add((-new[field], key))
+
+    def rank(self, field, score):
+        """返回该成绩的名次和参与排名的总人数"""
+        sorted_list = self._list(field)
+        return sorted_list.bisect_left((-score,)) + 1, len(sorted_list)
+
+    def _ranked(self, sorted_list, entries):
+        """为连续的一段条目计算名次, 同分的条目只需查找一次"""
+        result = []
+        last_score = rank = None
+        for neg_score, key in entries:
+            if neg_score != last_score:
+                rank = sorted_list.bisect_left((neg_score,)) + 1
+                last_score = neg_score
+            result.append((rank, key, -neg_score))
+        return result
+
+    def top(self, field, n, offset=0):
+        """成绩最高的n名, 返回[(名次, 学号, 成绩)]"""
+        sorted_list = self._list(field)
+        return self._ranked(sorted_list, sorted_list.islice(offset, offset + n))
+
+    def bottom(self, field, n, offset=0):
+        """成绩最低的n名, 从最低分开始, 返回[(名次, 学号, 成绩)]"""
+        sorted_list = self._list(field)
+        return self._ranked(sorted_list, sorted_list.islice_reversed(offset, offset + n))
@@ -0,0 +1,63 @@
+"""差量屏幕绘制
+
+ScreenPainter记录每一行上次绘制的内容, 一帧中只重绘内容变化的行,
+最后用noutrefresh + doupdate一次性输出, 避免clear()造成的整屏闪烁。
+"""
+import curses
+from time import perf_counter
+
+import metrics
+
+
+class ScreenPainter:
+    """按行缓存的绘制器
+
+    用法: begin() 开始一帧, line() 绘制各行, finish() 清掉本帧未绘制的旧行并输出。
+    其他代码直接改动了屏幕后需要调用reset()。
+    """
+
+    def __init__(self, win):
+        self.win = win
+        self._lines = {}        # 行号 -> (x, 文本, 属性)
+        self._drawn = set()     # 本帧绘制过的行号
+        self._size = None
+        self._frame = None      # 开启性能计数时: (界面名称, 本帧开始时间)
+
+    def reset(self):
+        """清空屏幕和缓存, 下一帧全部重绘"""
+        self.win.erase()
+        self._lines.clear()
+        self._size = self.win.getmaxyx()
+
+    def begin(self, name='frame'):
+        """开始一帧, 终端大小变化时自动重置, 开启性能计数时按name记录每帧耗时"""
+        if metrics.ENABLED:
+            self._frame = (name, perf_counter())
+        if self.win.getmaxyx() != self._size:
+            self.reset()
+        self._drawn = set()
+        return self._size
+
+    def line(self, y, x, text, attr=0):
+        """绘制一行, 与上次内容相同时跳过"""
+        self._drawn.add(y)
+        state = (x, text, attr)
+        if self._lines.get(y) == state:
+            return
+        self.win.move(y, 0)
+        self.win.clrtoeol()
+        self.win.addstr(y, x, text, attr)
+        self._lines[y] = state
+
+    def finish(self):
+        """清除上一帧有而本帧没有的行, 并输出到终端"""
+        for y in [y for y in self._lines if y not in self._drawn]:
+            self.win.move(y, 0)
+            self.win.clrtoeol()
+            del self._lines[y]
+        self.win.noutrefresh()
+        curses.doupdate()
+        if self._frame is not None:
+            name, start = self._frame
+            metrics.record(f'render.{name}', perf_counter() - start)
+            self._frame = None
@@ -0,0 +1,347 @@
+"""成绩单和班级报告
+
+按模板为每名学生生成成绩单、为每个班级生成统计报告, 写入输出目录:
+    <输出目录>/students/<学号>.<格式>
+    <输出目录>/classes/<班级>.<格式>
+
+- 格式: txt(纯文本)、md(Markdown)、html。模板为string.Template, 内置模板可以用模板目录中的
+  student.<格式>和class.<格式>替换, 可用的变量见STUDENT_VARIABLES和CLASS_VARIABLES
+- 班级为学号的前CLASS_PREFIX位, 与分片存储的分片相同
+- 增量生成: 输出目录中的.reports.<格式>.json记录每份报告内容的指纹(用到的记录、名次、
+  考试成绩、班级统计和模板), 指纹没有变化的报告不再生成, 已删除的学生和班级的报告一并删除。
+  内置模板只重新生成成绩有变化的学生。自定义模板可以使用总分名次($rank/$count), 它依赖
+  其他学生: 一名学生的总分变化时, 名次在新旧总分之间的学生的成绩单也要重新生成
+- 需要生成的报告不少于PARALLEL_THRESHOLD份且有多个CPU时, 按CHUNK_SIZE份一块交给进程池,
+  各进程直接写文件, 生成的内容不经过主进程
+"""
+import os
+import html
+import json
+import heapq
+import hashlib
+import unicodedata
+from string import Template
+from time import perf_counter
+from urllib.parse import quote
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from schema import SCHEMA
+from storage import SCORE_FIELDS
+from sharding import SHARD_PREFIX
+from stats import class_statistics
+
+FORMATS = ('txt', 'md', 'html')
+CLASS_PREFIX = SHARD_PREFIX
+CLASS_TOP = 10              # 班级报告中列出的总分前几名
+PARALLEL_THRESHOLD = 2000
+CHUNK_SIZE = 500
+MANIFEST_VERSION = 1
+
+STUDENT_VARIABLES = ('id', 'name', 'class', 'scores', 'total', 'average', 'gpa', 'rank', 'count', 'history')
+CLASS_VARIABLES = ('class', 'count', 'statistics', 'top', 'top_count')
+
+# 成绩单中依赖其他学生的变量, 模板没有用到时不查询名次, 也就不计入指纹
+_RANK_VARIABLES = {'rank', 'count'}
+_FIELDS = SCHEMA.keys + ('total', 'average', 'gpa')
+_LABELS = {field: SCHEMA.label(field) for field in SCORE_FIELDS}
+
+TEMPLATES = {
+    'txt': {
+        'student': """成绩单
+==========
+学号: $id
+姓名: $name
+班级: $class
+
+$scores
+
+历次考试
+$history
+""",
+        'class': """班级报告: $class
+==========
+人数: $count
+
+$statistics
+
+总分前${top_count}名
+$top
+""",
+    },
+    'md': {
+        'student': """# 成绩单: $name
+
+- 学号: $id
+- 班级: $class
+
+$scores
+
+## 历次考试
+
+$history
+""",
+        'class': """# 班级报告: $class
+
+人数: $count
+
+$statistics
+
+## 总分前${top_count}名
+
+$top
+""",
+    },
+    'html': {
+        'student': """<!DOCTYPE html>
+<html lang="zh-CN">
+<head><meta charset="utf-8"><title>成绩单 $id $name</title></head>
+<body>
+<h1>成绩单: $name</h1>
+<p>学号: $id<br>班级: $class</p>
+$scores
+<h2>历次考试</h2>
+$history
+</body>
+</html>
+""",
+        'class': """<!DOCTYPE html>
+<html lang="zh-CN">
+<head><meta charset="utf-8"><title>班级报告 $class</title></head>
+<body>
+<h1>班级报告: $class</h1>
+<p>人数: $count</p>
+$statistics
+<h2>总分前${top_count}名</h2>
+$top
+</body>
+</html>
+""",
+    },
+}
+
+
+class ReportStats:
+    """生成统计: 生成、跳过(内容未变化)和删除的报告数以及耗时"""
+
+    def __init__(self, rendered, skipped, removed, seconds):
+        self.rendered = rendered
+        self.skipped = skipped
+        self.removed = removed
+        self.seconds = seconds
+
+
+def _width(text):
+    return sum(2 if unicodedata.east_asian_width(ch) in 'WF' else 1 for ch in text)
+
+
+def _escape(fmt, text):
+    text = str(text)
+    if fmt == 'html':
+        return html.escape(text)
+    if fmt == 'md':
+        return text.replace('|', '\\|')
+    return text
+
+
+def render_table(fmt, header, rows):
+    """按格式排版表格, 单元格已转换为字符串"""
+    if fmt == 'html':
+        lines = ['<table>', '<tr>' + ''.join(f'<th>{html.escape(cell)}</th>' for cell in header) + '</tr>']
+        lines.extend('<tr>' + ''.join(f'<td>{html.escape(cell)}</td>' for cell in row) + '</tr>'
+                     for row in rows)
+        lines.append('</table>')
+        return '\n'.join(lines)
+    if fmt == 'md':
+        lines = ['| ' + ' | '.join(_escape(fmt, cell) for cell in header) + ' |',
+                 '|' + ' --- |' * len(header)]
+        lines.extend('| ' + ' | '.join(_escape(fmt, cell) for cell in row) + ' |' for row in rows)
+        return '\n'.join(lines)
+    widths = [max(_width(row[i]) for row in [header] + rows) + 2 for i in range(len(header))]
+    return '\n'.join(''.join(cell + ' ' * (width - _width(cell)) for cell, width in zip(row, widths)).rstrip()
+                     for row in [header] + rows)
+
+
+def _number(value, fmt='.1f'):
+    return '-' if value is None else format(value, fmt)
+
+
+def _student_document(fmt, template, item):
+    """item为student_items生成的元组"""
+    student_id, name, class_name, scores, rank, count, exams = item
+    rows = [[_LABELS[field], _number(scores[field], '.2f' if field in ('average', 'gpa') else '.1f')]
+            for field in _FIELDS]
+    if exams:
+        header = ['考试'] + [_LABELS[field] for field in SCHEMA.keys + ('total',)]
+        history = render_table(fmt, header, [[exam] + [_number(score) for score in values]
+                                             for exam, values in exams])
+    else:
+        history = _escape(fmt, "暂无考试记录")
+    return template.substitute(
+        id=_escape(fmt, student_id), name=_escape(fmt, name), **{'class': _escape(fmt, class_name)},
+        scores=render_table(fmt, ['科目', '成绩'], rows),
+        total=_number(scores['total']), average=_number(scores['average'], '.2f'),
+        gpa=_number(scores['gpa'], '.2f'), rank=rank, count=count, history=history)
+
+
+def _class_document(fmt, template, item):
+    """item为class_items生成的元组"""
+    class_name, count, statistics, top = item
+    rows = [[_LABELS[field], f"{s['mean']:.2f}", f"{s['median']:.1f}", f"{s['max']:.1f}",
+             f"{s['min']:.1f}", f"{s['pass_rate']:.1%}"] for field, s in statistics]
+    top_rows = [[str(i), student_id, name, f"{total:.1f}"] for i, (student_id, name, total) in enumerate(top, 1)]
+    return template.substitute(
+        count=count, top_count=len(top), **{'class': _escape(fmt, class_name)},
+        statistics=render_table(fmt, ['科目', '平均分', '中位数', '最高', '最低', '及格率'], rows),
+        top=render_table(fmt, ['名次', '学号', '姓名', '总分'], top_rows))
+
+
+_DOCUMENTS = {'student': _student_document, 'class': _class_document}
+_DIRECTORIES = {'student': 'students', 'class': 'classes'}
+
+
+def _file_name(key, fmt):
+    """学号或班级对应的文件名, 不能直接作为文件名的字符转义"""
+    return quote(key, safe='') + '.' + fmt
+
+
+def _render_chunk(out_dir, fmt, kind, template_text, items):
+    """生成一块报告并写入文件, 在进程池中执行, 返回生成的份数"""
+    template = Template(template_text)
+    document = _DOCUMENTS[kind]
+    directory = os.path.join(out_dir, _DIRECTORIES[kind])
+    for item in items:
+        with open(os.path.join(directory, _file_name(item[0], fmt)), 'w', encoding='utf-8') as f:
+            f.write(document(fmt, template, item))
+    return len(items)
+
+
+def load_templates(fmt, directory=None):
+    """格式对应的模板文本{'student': 文本, 'class': 文本}, directory中有同名文件时使用它
+
+    模板中有未知的变量或格式错误时抛出ValueError。
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"不支持的报告格式: {fmt}, 可选 {', '.join(FORMATS)}")
+    templates = dict(TEMPLATES[fmt])
+    for kind, variables in (('student', STUDENT_VARIABLES), ('class', CLASS_VARIABLES)):
+        path = os.path.join(directory, f"{kind}.{fmt}") if directory else None
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                templates[kind] = f.read()
+        try:
+            Template(templates[kind]).substitute({name: '' for name in variables})
+        except KeyError as e:
+            raise ValueError(f"{kind}.{fmt}模板中有未知的变量: {e.args[0]}") from None
+        except ValueError as e:
+            raise ValueError(f"{kind}.{fmt}模板格式错误: {e}") from None
+    return templates
+
+
+def _variables(template_text):
+    """模板中用到的变量名"""
+    return {match.group('named') or match.group('braced')
+            for match in Template.pattern.finditer(template_text)} - {None}
+
+
+def _fingerprint(item, template_digest):
+    data = json.dumps(item, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=8, key=template_digest).hexdigest()
+
+
+def student_items(students, ranking=None, exams=None):
+    """每名学生成绩单需要的数据, 逐条生成(学号, 姓名, 班级, 成绩, 总分名次, 总人数, 考试成绩)
+
+    ranking为None时名次和总人数为None。
+    """
+    history = exams.exams() if exams is not None else []
+    for student_id, record in students.items():
+        rank, count = ranking.rank('total', record['total']) if ranking is not None else (None, None)
+        scores = {field: record.get(field) for field in _FIELDS}
+        trajectory = []
+        if history:
+            trajectory = [[exam.name, [values[field] for field in SCHEMA.keys + ('total',)]]
+                          for exam, values in exams.trajectory(student_id, SCHEMA.keys + ('total',))]
+        yield student_id, record['name'], student_id[:CLASS_PREFIX], scores, rank, count, trajectory
+
+
+def class_items(students):
+    """每个班级报告需要的数据, 生成(班级, 人数, [(字段, 统计)], 总分前CLASS_TOP名)"""
+    classes = {}
+    for student_id, record in students.items():
+        classes.setdefault(student_id[:CLASS_PREFIX], {})[student_id] = record
+    for class_name in sorted(classes):
+        members = classes[class_name]
+        statistics = class_statistics(members, _FIELDS, use_numpy=False)
+        top = heapq.nlargest(CLASS_TOP, members.items(), key=lambda item: (item[1]['total'], item[0]))
+        yield (class_name, len(members),
+               [[field, {key: statistics[field][key] for key in ('mean', 'median', 'max', 'min', 'pass_rate')}]
+                for field in _FIELDS if field in statistics],
+               [[student_id, record['name'], record['total']] for student_id, record in top])
+
+
+def _read_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    return manifest if manifest.get('version') == MANIFEST_VERSION else {}
+
+
+def _write_manifest(path, manifest):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def _render(out_dir, fmt, kind, template_text, items, workers):
+    """生成items中的报告, 数量较多时分块在进程池中并行"""
+    chunks = [items[i:i + CHUNK_SIZE] for i in range(0, len(items), CHUNK_SIZE)]
+    if len(items) < PARALLEL_THRESHOLD or (workers or os.cpu_count() or 1) < 2:
+        return sum(_render_chunk(out_dir, fmt, kind, template_text, chunk) for chunk in chunks)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_render_chunk, out_dir, fmt, kind, template_text, chunk) for chunk in chunks]
+        return sum(future.result() for future in futures)
+
+
+@metrics.timed('report.generate')
+def generate_reports(students, ranking, out_dir, fmt='html', template_dir=None, exams=None,
+                     workers=None, force=False):
+    """生成全部学生的成绩单和各班级报告, 返回ReportStats
+
+    ranking为RankingIndex, exams为ExamHistory(为None时成绩单中没有历次考试)。
+    force为True时忽略上次生成的记录, 全部重新生成。
+    """
+    start = perf_counter()
+    templates = load_templates(fmt, template_dir)
+    manifest_path = os.path.join(out_dir, f".reports.{fmt}.json")
+    previous = {} if force else _read_manifest(manifest_path)
+    manifest = {'version': MANIFEST_VERSION}
+    rendered = skipped = removed = 0
+    if not _RANK_VARIABLES & _variables(templates['student']):
+        ranking = None
+    for kind, items in (('student', student_items(students, ranking, exams)), ('class', class_items(students))):
+        table = _DIRECTORIES[kind]
+        os.makedirs(os.path.join(out_dir, table), exist_ok=True)
+        digest = hashlib.blake2b(templates[kind].encode('utf-8'), digest_size=16).digest()
+        old = previous.get(table, {})
+        current = {}
+        pending = []
+        for item in items:
+            fingerprint = _fingerprint(item, digest)
+            current[item[0]] = fingerprint
+            if old.get(item[0]) != fingerprint:
+                pending.append(item)
+        rendered += _render(out_dir, fmt, kind, templates[kind], pending, workers)
+        skipped += len(current) - len(pending)
+        for key in old.keys() - current.keys():
+            try:
+                os.remove(os.path.join(out_dir, table, _file_name(key, fmt)))
+            except FileNotFoundError:
+                pass
+            removed += 1
+        manifest[table] = current
+    _write_manifest(manifest_path, manifest)
+    return ReportStats(rendered, skipped, removed, perf_counter() - start)
@@ -0,0 +1,198 @@
+"""科目配置与派生成绩
+
+科目、权重、满分和及格线由当前目录下的schema.json(或环境变量STUDENT_MANAGER_SCHEMA
+指定的文件)定义, 没有该文件时为语文、数学、英语三科, 权重1、满分100、及格60:
+
+    {"subjects": [
+        {"key": "chinese", "label": "语文", "weight": 1, "full_mark": 150, "pass_mark": 90},
+        {"key": "physics", "label": "物理", "weight": 0.5, "default": 0},
+        ...
+    ]}
+
+新增科目时已有的学生没有该科成绩, 只有为它设置了default(默认成绩)才能迁移已有数据,
+否则启动时抛出SchemaError, 避免悄悄记为0分拉低所有人的总分、平均分和绩点。
+
+每条学生记录保存各科成绩和由它们计算出的派生成绩:
+- total: 各科成绩之和
+- average: 按权重加权的平均分
+- gpa: 各科成绩按满分折算为百分制后查GPA_SCALE得到绩点, 再按权重加权平均
+
+派生成绩随记录一起保存(存储后端的索引、排名和范围查询直接使用它们),
+只由Schema.build_record计算, 科目成绩没有变化时沿用记录中已有的值。
+"""
+import os
+import re
+import json
+
+DERIVED_FIELDS = ('total', 'average', 'gpa')
+DERIVED_LABELS = {'total': '总分', 'average': '平均分', 'gpa': '绩点'}
+# 百分制成绩 -> 绩点, 从高到低
+GPA_SCALE = ((90, 4.0), (85, 3.7), (82, 3.3), (78, 3.0), (75, 2.7),
+             (72, 2.3), (68, 2.0), (64, 1.5), (60, 1.0))
+RESERVED_KEYS = ('id', 'name') + DERIVED_FIELDS
+
+DEFAULT_SUBJECTS = [
+    {'key': 'chinese', 'label': '语文'},
+    {'key': 'math', 'label': '数学'},
+    {'key': 'english', 'label': '英语'},
+]
+
+_KEY_PATTERN = re.compile(r'[a-z_][a-z0-9_]*$')
+
+
+class SchemaError(ValueError):
+    """已有数据不能按当前科目配置迁移"""
+
+
+def grade_point(percent):
+    """百分制成绩对应的绩点"""
+    for low, point in GPA_SCALE:
+        if percent >= low:
+            return point
+    return 0.0
+
+
+class Subject:
+    """一个科目: 键名(同时是数据文件中的字段名)、显示名称、权重、满分、及格线和默认成绩
+
+    默认成绩只用于迁移没有该科成绩的已有记录, 为None时这样的记录不能迁移。
+    """
+
+    def __init__(self, key, label=None, weight=1.0, full_mark=100.0, pass_mark=None, default=None):
+        if not isinstance(key, str) or not _KEY_PATTERN.match(key) or key in RESERVED_KEYS:
+            raise ValueError(f"科目键名不合法: {key!r}(只能由小写字母、数字和下划线组成)")
+        self.key = key
+        self.label = str(label or key)
+        self.weight = float(weight)
+        self.full_mark = float(full_mark)
+        self.pass_mark = float(pass_mark) if pass_mark is not None else self.full_mark * 0.6
+        self.default = float(default) if default is not None else None
+        if self.weight <= 0 or self.full_mark <= 0 or not 0 <= self.pass_mark <= self.full_mark:
+            raise ValueError(f"科目{self.label}的权重、满分或及格线不合法")
+        if self.default is not None and not 0 <= self.default <= self.full_mark:
+            raise ValueError(f"科目{self.label}的默认成绩不合法")
+
+    def to_dict(self):
+        data = {'key': self.key, 'label': self.label, 'weight': self.weight,
+                'full_mark': self.full_mark, 'pass_mark': self.pass_mark}
+        if self.default is not None:  # 没有设置时不写出, 已有配置的指纹不变
+            data['default'] = self.default
+        return data
+
+
+class Schema:
+    """科目配置和派生成绩的计算"""
+
+    def __init__(self, subjects):
+        if not subjects:
+            raise ValueError("至少需要一个科目")
+        self.subjects = tuple(subjects)
+        self.keys = tuple(subject.key for subject in self.subjects)
+        if len(set(self.keys)) != len(self.keys):
+            raise ValueError("科目键名重复")
+        self._by_key = {subject.key: subject for subject in self.subjects}
+        self._weights = [subject.weight for subject in self.subjects]
+        self._total_weight = sum(self._weights)
+        self._percent = [100.0 / subject.full_mark for subject in self.subjects]
+
+    @classmethod
+    def from_dict(cls, data):
+        try:
+            return cls([Subject(**item) for item in data['subjects']])
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"科目配置格式不正确: {e}")
+
+    def to_dict(self):
+        return {'subjects': [subject.to_dict() for subject in self.subjects]}
+
+    def subject(self, key):
+        return self._by_key[key]
+
+    def label(self, field):
+        """字段的显示名称"""
+        if field in self._by_key:
+            return self._by_key[field].label
+        return DERIVED_LABELS.get(field, field)
+
+    def full_mark(self, field):
+        """字段的满分: 总分为各科满分之和, 平均分为满分的加权平均"""
+        if field in self._by_key:
+            return self._by_key[field].full_mark
+        if field == 'total':
+            return sum(subject.full_mark for subject in self.subjects)
+        if field == 'average':
+            return self._weighted(subject.full_mark for subject in self.subjects)
+        return GPA_SCALE[0][1]
+
+    def pass_mark(self, field):
+        """字段的及格线, 计算方式与full_mark相同, 绩点以百分制60分对应的绩点为及格"""
+        if field in self._by_key:
+            return self._by_key[field].pass_mark
+        if field == 'total':
+            return sum(subject.pass_mark for subject in self.subjects)
+        if field == 'average':
+            return self._weighted(subject.pass_mark for subject in self.subjects)
+        return GPA_SCALE[-1][1]
+
+    def _weighted(self, values):
+        return sum(w * v for w, v in zip(self._weights, values)) / self._total_weight
+
+    def derive(self, scores):
+        """按科目顺序的成绩序列计算派生成绩"""
+        points = [grade_point(score * scale) for score, scale in zip(scores, self._percent)]
+        return {
+            'total': sum(scores),
+            'average': self._weighted(scores),
+            'gpa': self._weighted(points),
+        }
+
+    def build_record(self, name, scores, previous=None):
+        """由姓名和 {科目: 成绩} 生成完整记录
+
+        scores中缺少的科目沿用previous中的成绩, previous中也没有(None/NaN)时使用该科的默认成绩,
+        没有默认成绩时抛出SchemaError; 各科成绩与previous相同时直接沿用其中的派生成绩, 不重新计算。
+        """
+        previous = previous or {}
+        record = dict(previous, name=name)
+        values = []
+        for subject in self.subjects:
+            score = scores.get(subject.key)
+            if score is None:
+                score = previous.get(subject.key)
+            if score is None or score != score:
+                if subject.default is None:
+                    raise SchemaError(f"缺少{subject.label}成绩, 科目配置中也没有为它设置默认成绩(default)")
+                score = subject.default
+            values.append(score)
+            record[subject.key] = score
+        if any(previous.get(key) != value for key, value in zip(self.keys, values)) or \
+                any(field not in previous for field in DERIVED_FIELDS):
+            record.update(self.derive(values))
+        return record
+
+    def is_current(self, record):
+        """记录的科目是否齐全且派生成绩与当前配置一致"""
+        values = [record.get(key) for key in self.keys]
+        if any(value is None or value != value for value in values):
+            return False
+        return all(record.get(field) == value for field, value in self.derive(values).items())
+
+    def fingerprint(self):
+        """配置的规范化JSON, 用于判断数据是否按当前配置计算过派生成绩"""
+        return json.dumps(self.to_dict(), ensure_ascii=False, sort_keys=True)
+
+
+def load_schema(path):
+    """读取科目配置文件, 文件不存在时返回默认的三科配置"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        data = {'subjects': DEFAULT_SUBJECTS}
+    except ValueError as e:
+        raise ValueError(f"科目配置文件{path}不是有效的JSON: {e}")
+    return Schema.from_dict(data)
+
+
+SCHEMA_FILE = os.environ.get('STUDENT_MANAGER_SCHEMA', 'schema.json')
+SCHEMA = load_schema(SCHEMA_FILE)
@@ -0,0 +1,155 @@
+"""学号/姓名模糊搜索
+
+- 前缀匹配: 学号、姓名和姓名拼音首字母(如"张三" -> "zs")放在同一个有序序列中,
+  按前缀二分定位, 每次查询只需O(log n + 结果数)。序列元素是"检索键\0学号"
+  拼成的字符串, 比元组排序快且占用内存少
+- 子串匹配: 姓名按相邻两个字符建立倒排表, 查询时从最短的倒排表中取候选再校验
+
+索引在第一次搜索时才建立, 之后随增删改同步更新。
+"""
+from bisect import bisect_right
+
+import metrics
+from ranking import SortedList
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:  # 未安装pypinyin时用GB2312编码区间推算一级汉字的首字母
+    lazy_pinyin = None
+
+# GB2312一级汉字按拼音排序, 每个字母对应一段连续的编码
+_GB2312_INITIALS = (
+    (0xB0A1, 'a'), (0xB0C5, 'b'), (0xB2C1, 'c'), (0xB4EE, 'd'), (0xB6EA, 'e'),
+    (0xB7A2, 'f'), (0xB8C1, 'g'), (0xB9FE, 'h'), (0xBBF7, 'j'), (0xBFA6, 'k'),
+    (0xC0AC, 'l'), (0xC2E8, 'm'), (0xC4C3, 'n'), (0xC5B6, 'o'), (0xC5BE, 'p'),
+    (0xC6DA, 'q'), (0xC8BB, 'r'), (0xC8F6, 's'), (0xCBFA, 't'), (0xCDDA, 'w'),
+    (0xCEF4, 'x'), (0xD1B9, 'y'), (0xD4D1, 'z'),
+)
+_GB2312_LEVEL1_END = 0xD7FA
+_GB2312_STARTS = [start for start, _ in _GB2312_INITIALS]
+
+DEFAULT_LIMIT = 50
+_SEP = '\0'  # 检索键与学号之间的分隔符
+
+
+def _initial(ch):
+    """单个字符的拼音首字母, 非一级汉字原样返回"""
+    try:
+        code = int.from_bytes(ch.encode('gb2312'), 'big')
+    except UnicodeEncodeError:
+        return ch
+    if not _GB2312_STARTS[0] <= code < _GB2312_LEVEL1_END:
+        return ch
+    return _GB2312_INITIALS[bisect_right(_GB2312_STARTS, code) - 1][1]
+
+
+class _InitialTable(dict):
+    """供str.translate使用的 码位 -> 首字母 映射, 用到哪个字符才计算并缓存"""
+
+    def __missing__(self, code):
+        letter = self[code] = _initial(chr(code)).lower()
+        return letter
+
+
+_INITIAL_TABLE = _InitialTable()
+
+
+def pinyin_initials(text):
+    """姓名的拼音首字母, 如"张三" -> "zs", 非汉字部分保持不变"""
+    if lazy_pinyin is not None:
+        return ''.join(lazy_pinyin(text, style=Style.FIRST_LETTER)).lower()
+    return text.translate(_INITIAL_TABLE)
+
+
+def _bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class SearchIndex:
+    """学号和姓名的搜索索引"""
+
+    def __init__(self, students):
+        self._students = students
+        self._prefix = None   # SortedList["检索键\0学号"]
+        self._grams = None    # 两字片段 -> {学号}
+        self._names = None    # 学号 -> 小写姓名, 用于校验子串
+
+    @property
+    def built(self):
+        """索引是否已经建立"""
+        return self._prefix is not None
+
+    def _entries(self, student_id, name):
+        keys = {student_id.lower(), name, pinyin_initials(name)}
+        return [f"{key}{_SEP}{student_id}" for key in keys if key]
+
+    @metrics.timed('index.search_build')
+    def build(self):
+        """建立索引, 第一次搜索时会自动调用"""
+        entries = []
+        self._grams = {}
+        self._names = {}
+        for student_id, record in self._students.items():
+            name = record['name'].lower()
+            self._names[student_id] = name
+            entries.extend(self._entries(student_id, name))
+            for gram in _bigrams(name):
+                self._grams.setdefault(gram, set()).add(student_id)
+        self._prefix = SortedList(entries)
+
+    def _add(self, student_id, name):
+        name = name.lower()
+        self._names[student_id] = name
+        for entry in self._entries(student_id, name):
+            self._prefix.add(entry)
+        for gram in _bigrams(name):
+            self._grams.setdefault(gram, set()).add(student_id)
+
+    def _remove(self, student_id):
+        name = self._names.pop(student_id)
+        for entry in self._entries(student_id, name):
+            self._prefix.remove(entry)
+        for gram in _bigrams(name):
+            ids = self._grams[gram]
+            ids.discard(student_id)
+            if not ids:
+                del self._grams[gram]
+
+    def update(self, key, old, new):
+        """学生记录由old变为new, 与RankingIndex.update的约定相同"""
+        if self._prefix is None:
+            return
+        if old is not None and new is not None and old['name'] == new['name']:
+            return
+        if old is not None:
+            self._remove(key)
+        if new is not None:
+            self._add(key, new['name'])
+
+    @metrics.timed('index.search')
+    def search(self, text, limit=DEFAULT_LIMIT):
+        """返回匹配的学号列表, 前缀匹配在前, 姓名子串匹配在后"""
+        text = text.strip().lower().replace(_SEP, '')
+        if not text or limit <= 0:
+            return []
+        if self._prefix is None:
+            self.build()
+
+        found = {}  # 用字典去重并保持顺序
+        pos = self._prefix.bisect_left(text)
+        for entry in self._prefix.islice(pos):
+            if not entry.startswith(text):
+                break
+            found[entry.rpartition(_SEP)[2]] = None
+            if len(found) >= limit:
+                return list(found)
+
+        if len(text) >= 2:
+            candidates = [self._grams.get(gram) for gram in _bigrams(text)]
+            if all(candidates):
+                for student_id in min(candidates, key=len):
+                    if student_id not in found and text in self._names[student_id]:
+                        found[student_id] = None
+                        if len(found) >= limit:
+                            break
+        return list(found)
@@ -0,0 +1,525 @@
+"""HTTP/JSON接口
+
+基于asyncio的HTTP/1.1服务(只用标准库), 提供与管理员菜单和学生菜单相同的操作,
+多个教师可以同时通过浏览器或脚本录入成绩。
+
+- 登录后获得会话令牌, 之后的请求带上 Authorization: Bearer <令牌>,
+  权限取自accounts中的role: 管理员可以访问全部接口, 学生只能查看自己的成绩和修改自己的密码
+- 读请求直接在事件循环中处理内存数据, 不会互相阻塞
+- 写请求进入同一个写队列, 由唯一的写任务按顺序执行; 队列中积压的写操作合并为一次提交,
+  提交完成后才返回响应
+- PBKDF2计算较慢, 在线程池中进行(hashlib计算时会释放GIL), 不阻塞其他请求
+
+接口(请求和响应均为JSON):
+    POST   /login                {"username", "password"} -> {"token", "role"}
+    POST   /logout
+    GET    /students?offset=&limit=       学生列表(管理员), 按存储顺序
+    GET    /students?sort=&order=asc|desc&filter=&after=&before=&limit=
+                                 排序、筛选后的学生列表(管理员), filter如 english:<60,math:90-100,
+                                 after/before为上一次响应的next/prev游标(键集分页)
+    POST   /students             {"id", "name", 各科成绩}(管理员), 科目见schema.json, 默认chinese/math/english
+    GET    /students/<学号>      学生信息和总分排名
+    PATCH  /students/<学号>      {要修改的科目成绩}(管理员)
+    DELETE /students/<学号>      (管理员)
+    GET    /search?q=&limit=     按学号/姓名/拼音首字母搜索(管理员)
+    GET    /statistics           成绩统计(管理员)
+    GET    /rankings/<字段>?top=N 或 ?bottom=N, 或 ?id=<学号> 查询各科名次(管理员)
+    POST   /import               请求体为CSV文本, 格式同批量导入(管理员)
+    POST   /password             {"new_password", "old_password"(学生), "username"(管理员重置他人)}
+"""
+import io
+import re
+import json
+import asyncio
+import secrets
+from itertools import islice
+from time import monotonic
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import metrics
+from storage import SUBJECTS, ConflictError
+from stats import class_statistics
+from ranking import RANK_FIELDS
+from query import RosterQuery, parse_range, encode_cursor, decode_cursor
+from importer import iter_csv_rows, parse_rows, apply_rows, parse_score
+from auth import hash_password, hash_passwords, needs_rehash
+from service import DEFAULT_PASSWORD, WriteError
+
+MAX_BODY = 16 * 1024 * 1024
+SESSION_TTL = 8 * 3600  # 会话令牌的有效期(秒)
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+REASONS = {
+    200: 'OK', 201: 'Created', 400: 'Bad Request', 401: 'Unauthorized',
+    403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+    409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error',
+}
+
+
+class HttpError(Exception):
+    """以指定状态码返回错误信息"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Request:
+    def __init__(self, method, target, headers, body):
+        self.method = method
+        parts = urlsplit(target)
+        self.path = unquote(parts.path)
+        self.query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        self.headers = headers
+        self.body = body
+        self.session = None
+
+    def json(self):
+        if not self.body:
+            return {}
+        try:
+            data = json.loads(self.body)
+        except ValueError:
+            raise HttpError(400, "请求体不是有效的JSON")
+        if not isinstance(data, dict):
+            raise HttpError(400, "请求体必须是JSON对象")
+        return data
+
+    def int_param(self, name, default, maximum=None):
+        try:
+            value = int(self.query.get(name, default))
+        except ValueError:
+            raise HttpError(400, f"参数{name}必须是整数")
+        if value < 0:
+            raise HttpError(400, f"参数{name}不能为负数")
+        return min(value, maximum) if maximum is not None else value
+
+
+class SessionStore:
+    """会话令牌 -> (用户名, 过期时间)
+
+    角色不保存在会话中, 每次请求时从accounts读取, 账户被删除后令牌立即失效。
+    """
+
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = {}
+
+    def create(self, username):
+        token = secrets.token_urlsafe(32)
+        self._sessions[token] = (username, monotonic() + self.ttl)
+        return token
+
+    def get(self, token):
+        session = self._sessions.get(token)
+        if session is None:
+            return None
+        username, expires = session
+        if expires <= monotonic():
+            del self._sessions[token]
+            return None
+        return username
+
+    def delete(self, token):
+        self._sessions.pop(token, None)
+
+    def delete_user(self, username):
+        """使某个用户的全部会话失效, 修改密码后调用"""
+        for token in [t for t, (user, _) in self._sessions.items() if user == username]:
+            del self._sessions[token]
+
+
+class ApiServer:
+    """把GradeService的操作映射为HTTP接口"""
+
+    def __init__(self, service):
+        self.service = service
+        self.sessions = SessionStore()
+        self._queue = None
+        self._writer_task = None
+        self._stats_cache = None    # (写入代数, 统计结果)
+        self._generation = 0        # 每提交一批写操作或合并其他进程的修改时加一
+        self._routes = [
+            ('POST', r'/login', self.login, None),
+            ('POST', r'/logout', self.logout, 'any'),
+            ('GET', r'/students', self.list_students, 'admin'),
+            ('POST', r'/students', self.add_student, 'admin'),
+            ('GET', r'/students/([^/]+)', self.get_student, 'any'),
+            ('PATCH', r'/students/([^/]+)', self.update_student, 'admin'),
+            ('DELETE', r'/students/([^/]+)', self.delete_student, 'admin'),
+            ('GET', r'/search', self.search, 'admin'),
+            ('GET', r'/statistics', self.statistics, 'admin'),
+            ('GET', r'/rankings/([^/]+)', self.rankings, 'admin'),
+            ('POST', r'/import', self.import_csv, 'admin'),
+            ('POST', r'/password', self.change_password, 'any'),
+        ]
+        self._routes = [(method, re.compile(pattern + '$'), handler, role)
+                        for method, pattern, handler, role in self._routes]
+
+    # ---- 写队列 ----
+
+    async def write(self, job):
+        """把写操作放入写队列, 提交完成后返回job的结果"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((job, future))
+        return await future
+
+    async def _writer(self):
+        while True:
+            batch = [await self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            metrics.increment('http.write_jobs', len(batch))
+            results = []    # [(future, 结果, 异常, 写入的(表名, 键))]
+            with metrics.timer('http.write_batch'):
+                for job, future in batch:
+                    with self.service.recording_writes() as written:
+                        try:
+                            results.append((future, job(), None, written))
+                        except Exception as e:
+                            results.append((future, None, e, written))
+                failed = next((error for _, _, error, _ in results if isinstance(error, WriteError)), None)
+                if failed is not None:
+                    # 写入存储后端失败时这批修改不知道写入了多少, 全部放弃
+                    failure = HttpError(500, str(failed))
+                    results = [(future, None, job_error or failure, written)
+                               for future, _, job_error, written in results]
+                    self.service.rollback()
+                elif not self.service.save():  # 一批写操作只提交一次
+                    error = self.service.save_error
+                    if isinstance(error, ConflictError):
+                        # 其余修改已经保存, 只有写到冲突记录的操作失败; 内存中冲突的记录已是其他进程的版本
+                        conflicts = set(error.changes)
+                        failure = HttpError(409, f"保存数据失败: {error}")
+                        results = [(future, None, job_error or failure, written) if written & conflicts
+                                   else (future, value, job_error, written)
+                                   for future, value, job_error, written in results]
+                    else:
+                        # 这批修改可能只写入了一部分, 全部按失败返回, 内存中的数据重新从文件读取
+                        failure = HttpError(500, f"保存数据失败: {error}")
+                        results = [(future, None, job_error or failure, written)
+                                   for future, _, job_error, written in results]
+                        self.service.rollback()
+            self._generation += 1
+            for future, value, error, _ in results:
+                if future.cancelled():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(value)
+
+    # ---- HTTP ----
+
+    async def start(self, host='127.0.0.1', port=8000):
+        self._queue = asyncio.Queue()
+        self._writer_task = asyncio.create_task(self._writer())
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode('latin-1').split()
+        except ValueError:
+            raise HttpError(400, "无效的请求行")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HttpError(400, "无效的Content-Length")
+        if length > MAX_BODY:
+            raise HttpError(413, "请求体过大")
+        body = await reader.readexactly(length) if length else b''
+        return Request(method.upper(), target, headers, body)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HttpError as e:
+                    await self._respond(writer, e.status, {'error': str(e)}, False)
+                    return
+                if request is None:
+                    return
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                status, data = await self._dispatch(request)
+                await self._respond(writer, status, data, keep_alive)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, data, keep_alive):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    async def _dispatch(self, request):
+        allowed = False
+        for method, pattern, handler, role in self._routes:
+            match = pattern.match(request.path)
+            if not match:
+                continue
+            if method != request.method:
+                allowed = True
+                continue
+            try:
+                with metrics.timer(f'http.{handler.__name__}'):
+                    # 其他进程(如命令行批处理)可能修改过数据, 没有变化时只需检查文件状态
+                    if self.service.refresh():
+                        self._generation += 1   # 缓存的统计结果不再有效
+                    self._authorize(request, role)
+                    result = await handler(request, *match.groups())
+            except HttpError as e:
+                return e.status, {'error': str(e)}
+            except WriteError as e:
+                return 500, {'error': str(e)}
+            except ValueError as e:
+                return 400, {'error': str(e)}
+            except Exception as e:
+                return 500, {'error': f"服务器内部错误: {e}"}
+            if isinstance(result, tuple):
+                return result
+            return 200, result
+        if allowed:
+            return 405, {'error': "不支持该请求方法"}
+        return 404, {'error': "接口不存在"}
+
+    def _authorize(self, request, role):
+        if role is None:
+            return
+        auth = request.headers.get('authorization', '')
+        token = auth[7:] if auth[:7].lower() == 'bearer ' else ''
+        username = self.sessions.get(token) if token else None
+        account = self.service.accounts.get(username) if username else None
+        if account is None:
+            raise HttpError(401, "请先登录")
+        if role == 'admin' and account['role'] != 'admin':
+            raise HttpError(403, "只有管理员可以执行此操作")
+        request.session = (token, username, account['role'])
+
+    # ---- 接口 ----
+
+    async def login(self, request):
+        data = request.json()
+        username = str(data.get('username', ''))
+        password = str(data.get('password', ''))
+        account = self.service.accounts.get(username)
+        if account is None:
+            raise HttpError(401, "用户名或密码错误")
+        stored = account['password']
+        loop = asyncio.get_running_loop()
+        ok = await loop.run_in_executor(None, self.service.credential_cache.verify,
+                                        username, stored, password)
+        if not ok:
+            raise HttpError(401, "用户名或密码错误")
+        if needs_rehash(stored):
+            # 旧格式的哈希升级后写回, 期间密码被修改则放弃升级
+            new_hash = await loop.run_in_executor(None, hash_password, password)
+
+            def upgrade():
+                if self.service.accounts.get(username, {}).get('password') == stored:
+                    self.service.set_password_hash(username, new_hash)
+            await self.write(upgrade)
+        return {'token': self.sessions.create(username), 'role': account['role']}
+
+    async def logout(self, request):
+        self.sessions.delete(request.session[0])
+        return {'ok': True}
+
+    async def list_students(self, request):
+        if any(name in request.query for name in ('sort', 'order', 'filter', 'after', 'before')):
+            return self._query_students(request)
+        offset = request.int_param('offset', 0)
+        limit = request.int_param('limit', DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        students = self.service.students
+        # 只取出这一页的记录, 按需读取的存储不必解码前面的记录
+        page = [dict(students[student_id], id=student_id)
+                for student_id in islice(students, offset, offset + limit)]
+        return {'total': len(students), 'offset': offset, 'students': page}
+
+    def _query_students(self, request):
+        """排序、筛选后的一页学生, next/prev为向后和向前翻页的游标, 没有更多时为None"""
+        params = request.query
+        limit = request.int_param('limit', DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        order = params.get('order', 'asc')
+        if order not in ('asc', 'desc'):
+            raise HttpError(400, "参数order必须是asc或desc")
+        try:
+            filters = []
+            for item in filter(None, params.get('filter', '').split(',')):
+                field, sep, text = item.partition(':')
+                if not sep:
+                    raise ValueError(f"筛选条件格式错误: {item}, 应为 字段:范围")
+                filters.append((field, *parse_range(text)))
+            query = RosterQuery(params.get('sort', 'id'), order == 'desc', filters)
+            backward = 'before' in params
+            cursor = params.get('before' if backward else 'after')
+            cursor = decode_cursor(cursor) if cursor is not None else None
+        except ValueError as e:
+            raise HttpError(400, str(e))
+        index = self.service.query_index
+        page = index.page(query, cursor, limit, backward)
+        students = self.service.students
+        more_after = page.has_more if not backward else page.last is not None
+        more_before = page.has_more if backward else cursor is not None
+        return {
+            'total': index.count(query),
+            'students': [dict(students[student_id], id=student_id) for student_id in page.ids],
+            'next': encode_cursor(page.last) if more_after and page.last is not None else None,
+            'prev': encode_cursor(page.first) if more_before and page.first is not None else None,
+        }
+
+    def _student_id(self, request, student_id):
+        _, username, role = request.session
+        if role != 'admin' and student_id != username:
+            raise HttpError(403, "学生只能查看自己的信息")
+        if student_id not in self.service.students:
+            raise HttpError(404, f"未找到该学号的学生: {student_id}")
+        return student_id
+
+    async def get_student(self, request, student_id):
+        student = self.service.students[self._student_id(request, student_id)]
+        rank, count = self.service.ranking.rank('total', student['total'])
+        return dict(student, id=student_id, rank=rank, rank_count=count)
+
+    async def add_student(self, request):
+        data = request.json()
+        student_id = str(data.get('id', '')).strip()
+        name = str(data.get('name', '')).strip()
+        scores = {}
+        for subject in SUBJECTS:
+            if subject not in data:
+                raise HttpError(400, f"缺少字段: {subject}")
+            scores[subject] = parse_score(data[subject], subject)
+        password_hash = await asyncio.get_running_loop().run_in_executor(
+            None, hash_password, DEFAULT_PASSWORD)
+
+        def job():
+            self.service.register_student(student_id, name, scores, create_account=False)
+            if student_id not in self.service.accounts:
+                self.service.add_account(student_id, password_hash)
+            return dict(self.service.students[student_id], id=student_id)
+        return 201, await self.write(job)
+
+    async def update_student(self, request, student_id):
+        data = request.json()
+        scores = {subject: parse_score(data[subject], subject) for subject in SUBJECTS if subject in data}
+        self._student_id(request, student_id)
+
+        def job():
+            return dict(self.service.update_scores(student_id, scores), id=student_id)
+        return await self.write(job)
+
+    async def delete_student(self, request, student_id):
+        self._student_id(request, student_id)
+
+        def job():
+            self.service.remove_student(student_id)
+            self.sessions.delete_user(student_id)
+            return {'ok': True}
+        return await self.write(job)
+
+    async def search(self, request):
+        limit = request.int_param('limit', DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        students = self.service.students
+        ids = self.service.search_index.search(request.query.get('q', ''), limit)
+        return {'students': [dict(students[student_id], id=student_id) for student_id in ids]}
+
+    async def statistics(self, request):
+        # 统计结果按写入代数缓存, 没有新的写操作时直接返回
+        if self._stats_cache is None or self._stats_cache[0] != self._generation:
+            stats = class_statistics(self.service.students)
+            for field in stats.values():
+                field['percentiles'] = {str(p): v for p, v in field['percentiles'].items()}
+                field['histogram'] = [list(item) for item in field['histogram']]
+            self._stats_cache = (self._generation, stats)
+        return self._stats_cache[1]
+
+    async def rankings(self, request, field):
+        if field not in RANK_FIELDS:
+            raise HttpError(404, f"不支持按该字段排名: {field}")
+        ranking = self.service.ranking
+        students = self.service.students
+        if 'id' in request.query:
+            student_id = self._student_id(request, request.query['id'])
+            rank, count = ranking.rank(field, students[student_id][field])
+            return {'id': student_id, 'rank': rank, 'count': count}
+        if 'bottom' in request.query:
+            entries = ranking.bottom(field, request.int_param('bottom', 10, MAX_PAGE_SIZE))
+        else:
+            entries = ranking.top(field, request.int_param('top', 10, MAX_PAGE_SIZE))
+        return {'field': field, 'entries': [
+            {'rank': rank, 'id': student_id, 'name': students[student_id]['name'], 'score': score}
+            for rank, student_id, score in entries
+        ]}
+
+    async def import_csv(self, request):
+        try:
+            text = request.body.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise HttpError(400, "CSV必须是UTF-8编码")
+
+        def prepare():
+            parsed, result = parse_rows(iter_csv_rows(io.StringIO(text)))
+            return parsed, result, hash_passwords([DEFAULT_PASSWORD] * len(parsed))
+        # 解析和PBKDF2在线程池中进行, 写队列中只做内存中的写入
+        parsed, result, hashes = await asyncio.get_running_loop().run_in_executor(None, prepare)
+
+        def job():
+            apply_rows(self.service, parsed, result, hashes)
+            return {'imported': len(result.imported),
+                    'errors': [{'line': line_no, 'error': message}
+                               for line_no, message in result.errors]}
+        return await self.write(job)
+
+    async def change_password(self, request):
+        data = request.json()
+        _, username, role = request.session
+        new_password = str(data.get('new_password', ''))
+        if not new_password:
+            raise HttpError(400, "新密码不能为空")
+        target = str(data.get('username', username))
+        loop = asyncio.get_running_loop()
+        if role != 'admin':
+            if target != username:
+                raise HttpError(403, "学生只能修改自己的密码")
+            stored = self.service.accounts[username]['password']
+            ok = await loop.run_in_executor(None, self.service.credential_cache.verify,
+                                            username, stored, str(data.get('old_password', '')))
+            if not ok:
+                raise HttpError(403, "原密码错误")
+        if target not in self.service.accounts:
+            raise HttpError(404, f"该用户不存在: {target}")
+        password_hash = await loop.run_in_executor(None, hash_password, new_password)
+
+        def job():
+            self.service.set_password_hash(target, password_hash)
+            if target != username:
+                self.sessions.delete_user(target)
+            return {'ok': True}
+        return await self.write(job)
+
+
+async def serve(service, host='127.0.0.1', port=8000):
+    """启动服务并一直运行"""
+    api = ApiServer(service)
+    server = await api.start(host, port)
+    async with server:
+        await server.serve_forever()
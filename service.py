@@ -0,0 +1,500 @@
+"""成绩管理业务逻辑
+
+GradeService负责数据的加载与保存、学生和账户的增删改查以及密码校验, 不依赖curses,
+可以直接在脚本、定时任务和命令行批处理中使用, 交互界面(main.py)在它的基础上实现。
+
+修改类方法只写入存储后端而不提交, 调用方完成一批修改后调用一次save()。
+参数不合法、学号不存在等情况抛出ValueError, 消息可以直接显示给用户; 写入存储后端失败时抛出
+WriteError(也是ValueError), 此前已写入的修改保留在内存中, 由之后的save()提交或rollback()放弃。
+多个进程可以同时使用同一份数据, refresh()合并其他进程的修改, 数据没有变化时开销很小。
+科目和派生成绩(总分、加权平均分、绩点)由schema.py的科目配置决定, 配置变化后启动时自动迁移已有数据。
+每次save()提交的修改记入操作历史(history.py), 可以用undo()/redo()多级撤销和重做。
+record_exam()把全体学生的当前成绩记为一次考试, 各次考试的成绩保存在exams(timeseries.py)中。
+generate_reports()按模板生成成绩单和班级报告(report.py), 只重新生成内容有变化的报告。
+保存时每隔BACKUP_INTERVAL秒在后台线程中自动备份一次已提交的数据(backup.py), restore_backup()恢复到某个备份。
+"""
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+import metrics
+from schema import SCHEMA, DERIVED_FIELDS, SchemaError
+from storage import open_storage, SUBJECTS, ConflictError
+from ranking import RankingIndex
+from search import SearchIndex
+from query import QueryIndex
+from stats import class_statistics
+from history import History
+from timeseries import ExamHistory
+from importer import import_file
+from report import generate_reports
+from backup import BackupSet, read_snapshot
+from auth import hash_password, hash_passwords, needs_rehash, CredentialCache
+
+DEFAULT_PASSWORD = 's123456'  # 新建学生账户的初始密码
+
+
+class WriteError(ValueError):
+    """修改写入存储后端失败, 这条修改没有生效"""
+
+
+class GradeService:
+    DATA_FILE = 'data.json'
+    SQLITE_FILE = 'data.db'
+    # 存储后端: 'json'(快照+日志)、'sqlite'(带索引, 按需读取) 或 'sharded'(按班级分片的JSON, 见sharding.py)
+    STORAGE_BACKEND = os.environ.get('STUDENT_MANAGER_STORAGE', 'json')
+    JOURNAL_MODE = True  # False时JSON后端每次修改都重写整个data.json
+    # JSON后端使用列式内存存储, 大量学生时显著减少内存占用
+    COLUMNAR_STORE = os.environ.get('STUDENT_MANAGER_COLUMNAR') == '1'
+    # JSON后端通过偏移索引按需读取记录, 启动时不解析整个data.json
+    LAZY_LOAD = os.environ.get('STUDENT_MANAGER_LAZY', '1') != '0'
+    # 保存后距上次备份超过这么多秒时自动备份, 0表示不自动备份
+    BACKUP_INTERVAL = float(os.environ.get('STUDENT_MANAGER_BACKUP_INTERVAL', '3600'))
+
+    def __init__(self):
+        self.students = {}
+        self.accounts = {
+            'admin': {'password': self._hash_password('123456'), 'role': 'admin'}
+        }
+        self.credential_cache = CredentialCache()
+        self.save_error = None  # 最近一次save()失败的异常, 成功时为None
+        self.migrated = 0       # 启动时按新的科目配置迁移的记录数
+        self.storage = self._open_storage()
+        self.storage.on_change = self._on_storage_change
+        self.storage.on_reload = self._on_storage_reload
+        self.history = History(self._data_file() + '.audit')
+        self.exams = ExamHistory(self._data_file() + '.exams')
+        self.backups = BackupSet(self._data_file() + '.backups')
+        self._backup_thread = None  # 正在进行的自动备份
+        self._backup_error = None   # 自动备份失败的异常, 下次保存时报告
+        self._written = None        # recording_writes()正在记录的写入
+        self._load_data()
+
+    def _show_error(self, message):
+        """报告加载或写入数据时的错误, 交互界面会改为在状态栏显示"""
+        print(message, file=sys.stderr)
+
+    def _hash_password(self, password):
+        """使用加盐的PBKDF2哈希密码"""
+        return hash_password(password)
+
+    def check_password(self, username, password):
+        """校验用户密码, 旧格式的哈希在验证成功后自动升级"""
+        account = self.accounts.get(username)
+        if account is None or not self.credential_cache.verify(username, account['password'], password):
+            return False
+        if needs_rehash(account['password']):
+            account = dict(account)
+            account['password'] = self._hash_password(password)
+            try:
+                with self.history.paused():  # 哈希升级不是用户的操作, 不进入历史
+                    self._commit_change('accounts', username, account)
+            except WriteError as e:
+                self._show_error(str(e))  # 旧哈希仍然有效, 下次登录时再升级
+            else:
+                self.save()
+        return True
+
+    @metrics.timed('service.load')
+    def _load_data(self):
+        """从存储后端加载数据"""
+        try:
+            self.students, self.accounts = self.storage.load(self.accounts)
+        except Exception as e:
+            self._show_error(f"加载数据失败: {e}")
+            loaded = False
+        else:
+            loaded = True
+        self.ranking = RankingIndex(self.students)
+        self.search_index = SearchIndex(self.students)
+        self.query_index = QueryIndex(self.students, self.ranking)
+        if loaded:
+            self._check_schema()
+
+    def _open_storage(self):
+        return open_storage(self.STORAGE_BACKEND, self.DATA_FILE, self.SQLITE_FILE,
+                            journal=self.JOURNAL_MODE, columnar=self.COLUMNAR_STORE, lazy=self.LAZY_LOAD)
+
+    def _data_file(self):
+        """当前存储后端的数据文件, 科目配置状态和审计日志放在它旁边"""
+        return self.SQLITE_FILE if self.STORAGE_BACKEND == 'sqlite' else self.DATA_FILE
+
+    def _schema_state_file(self):
+        """记录数据按哪份科目配置计算过派生成绩的文件"""
+        return self._data_file() + '.schema'
+
+    def _check_schema(self):
+        """数据是按其他科目配置(或旧版本)保存的时, 迁移全部记录, 迁移的记录数记在migrated中
+
+        只比较配置文件, 配置没有变化时启动不需要读取任何学生记录。
+        不能迁移时抛出SchemaError, 不能带着缺少科目的记录继续运行。
+        """
+        try:
+            with open(self._schema_state_file(), 'r', encoding='utf-8') as f:
+                applied = f.read()
+        except FileNotFoundError:
+            applied = None
+        if applied != SCHEMA.fingerprint():
+            self.migrated = self.migrate_schema()
+
+    @metrics.timed('service.migrate')
+    def migrate_schema(self):
+        """按当前科目配置迁移全部记录并提交, 返回修改的记录数
+
+        缺少的科目记为配置中该科的默认成绩, 派生成绩全部重新计算; 配置中已删除的科目保留在记录中
+        但不再参与计算。有记录缺少没有默认成绩的科目时抛出SchemaError, 不修改任何记录。
+        """
+        updates = {}
+        for student_id, record in self.students.items():
+            if SCHEMA.is_current(record):
+                continue
+            inputs = {key: value for key, value in record.items() if key not in DERIVED_FIELDS}
+            try:
+                updates[student_id] = SCHEMA.build_record(record['name'], {}, inputs)
+            except SchemaError as e:
+                raise SchemaError(f"学号{student_id}: {e}") from None
+        try:
+            with self.history.paused():
+                for student_id, record in updates.items():
+                    self._commit_change('students', student_id, record)
+        except WriteError:
+            self.rollback()  # 不提交只迁移了一部分的数据
+            raise
+        if updates and not self.flush():
+            return 0
+        try:
+            with open(self._schema_state_file(), 'w', encoding='utf-8') as f:
+                f.write(SCHEMA.fingerprint())
+        except OSError as e:
+            self._show_error(f"保存科目配置状态失败: {e}")
+        return len(updates)
+
+    def _commit_change(self, table, key, value=None):
+        """写入一条修改: value为None表示删除
+
+        存储后端写入失败时抛出WriteError, 操作历史和索引只在写入成功后更新。
+        """
+        try:
+            old = getattr(self, table).get(key)
+            if value is None:
+                self.storage.delete(table, key)
+            else:
+                self.storage.put(table, key, value)
+        except Exception as e:
+            raise WriteError(f"写入数据失败: {e}") from e
+        if self._written is not None:
+            self._written.add((table, key))
+        self.history.record(table, key, old, value)
+        if table == 'students':
+            self.ranking.update(key, old, value)
+            self.search_index.update(key, old, value)
+            self.query_index.update(key, old, value)
+
+    @contextmanager
+    def recording_writes(self):
+        """with语句块中写入的(表名, 键)记在返回的集合中, 提交冲突时据此找出受影响的操作"""
+        written = set()
+        self._written = written
+        try:
+            yield written
+        finally:
+            self._written = None
+
+    def _on_storage_change(self, table, key, old, new):
+        """其他进程的修改被合并到内存时同步更新索引"""
+        if table == 'students':
+            self.ranking.update(key, old, new)
+            self.search_index.update(key, old, new)
+            self.query_index.update(key, old, new)
+
+    def _on_storage_reload(self):
+        """数据被整体重新加载后重建索引"""
+        self.ranking = RankingIndex(self.students)
+        self.search_index = SearchIndex(self.students)
+        self.query_index = QueryIndex(self.students, self.ranking)
+
+    def refresh(self):
+        """合并其他进程已提交的修改, 返回数据是否有变化"""
+        try:
+            return self.storage.refresh()
+        except Exception as e:
+            self._show_error(f"读取数据失败: {e}")
+            return False
+
+    def rollback(self):
+        """放弃未提交的修改, 重新读取存储后端中已提交的数据, 返回是否成功"""
+        self.history.discard()
+        try:
+            self.storage.rollback()
+        except Exception as e:
+            self._show_error(f"读取数据失败: {e}")
+            return False
+        return True
+
+    def save(self):
+        """提交修改到存储后端, 返回是否成功, 失败的原因记在save_error中"""
+        try:
+            self.storage.commit()
+        except ConflictError as e:
+            # 只有冲突的记录没有保存(内存中已是其他进程的版本), 其余修改照常记入操作历史
+            self.save_error = e
+            self.history.discard(e.changes)
+            self._checkpoint_history()
+            self._show_error(f"保存数据失败: {e}")
+            return False
+        except Exception as e:
+            self.save_error = e
+            self.history.discard()  # 可能只提交了一部分, 这批修改不能撤销
+            self._show_error(f"保存数据失败: {e}")
+            return False
+        self.save_error = None
+        self._saved()
+        return True
+
+    def flush(self):
+        """提交修改并确认已经写入, 返回是否成功(子类的save可能在后台延迟提交)"""
+        return self.save()
+
+    def _saved(self):
+        """一批修改已提交之后调用: 记入操作历史, 到时间时开始自动备份"""
+        self._checkpoint_history()
+        self._auto_backup()
+
+    def _checkpoint_history(self):
+        """把上次以来的修改记为一条操作历史"""
+        try:
+            self.history.commit()
+        except OSError as e:
+            self._show_error(f"写入审计日志失败: {e}")
+
+    def undo(self):
+        """撤销最近一次提交的修改并提交, 返回该操作的说明
+
+        没有可撤销的操作, 或相关记录已被其他操作修改时抛出ValueError。
+        """
+        return self._replay_history(True)
+
+    def redo(self):
+        """重做最近一次撤销的修改并提交, 返回该操作的说明"""
+        return self._replay_history(False)
+
+    def _replay_history(self, undo):
+        entry, writes = self.history.plan(undo, lambda table, key: getattr(self, table).get(key))
+        try:
+            with self.history.paused():
+                for table, key, value in writes:
+                    self._commit_change(table, key, value)
+        except WriteError:
+            self.rollback()  # 不提交只执行了一半的撤销
+            raise
+        if not self.flush():   # 确认写入后才移到另一个栈
+            self.rollback()    # 内存中不留下没有写入的撤销
+            raise ValueError("保存数据失败, 请稍后重试")
+        try:
+            self.history.finish(undo)
+        except OSError as e:
+            self._show_error(f"写入审计日志失败: {e}")
+        return entry.describe()
+
+    def shard_statistics(self):
+        """按分片(班级)分别统计, 返回 {分片名: class_statistics的结果}
+
+        分片存储中各分片在进程池中并行计算; 其他存储不分片, 只有一项"全部"。
+        """
+        if hasattr(self.storage, 'map_shards'):
+            return self.storage.map_shards(class_statistics)
+        return {'全部': class_statistics(self.students)}
+
+    def record_exam(self, name):
+        """把全体学生的当前成绩(包括尚未提交的修改)记为一次考试, 返回timeseries.Exam"""
+        if not self.students:
+            raise ValueError("当前没有学生信息")
+        return self.exams.record(name, self.students)
+
+    def import_exam(self, name, path):
+        """把以前保存的data.json副本(连同它的日志)中的成绩记为一次考试, 返回timeseries.Exam
+
+        只读取副本, 不影响当前数据; 应按考试的先后顺序导入。
+        """
+        if not os.path.exists(path):
+            raise ValueError(f"文件不存在: {path}")
+        storage = open_storage('json', path, None)
+        try:
+            students, _ = storage.load({})
+            if not students:
+                raise ValueError(f"{path}中没有学生信息")
+            return self.exams.record(name, students)
+        finally:
+            storage.close()
+
+    def generate_reports(self, out_dir, fmt='html', template_dir=None, workers=None, force=False):
+        """生成全体学生的成绩单和各班级报告(包括尚未提交的修改), 返回report.ReportStats"""
+        if not self.students:
+            raise ValueError("当前没有学生信息")
+        return generate_reports(self.students, self.ranking, out_dir, fmt, template_dir,
+                                self.exams, workers, force)
+
+    def backup(self, codec='zlib'):
+        """把当前数据(包括尚未提交的修改)备份到备份目录并轮换旧备份, 返回backup.Backup"""
+        return self.backups.create(self.students, self.accounts, codec)
+
+    def _auto_backup(self):
+        """距上次备份已超过BACKUP_INTERVAL秒时在后台线程中备份, 不等待备份完成"""
+        error, self._backup_error = self._backup_error, None
+        if error is not None:
+            self._show_error(f"自动备份失败: {error}")
+        if not self.BACKUP_INTERVAL or (self._backup_thread is not None and self._backup_thread.is_alive()):
+            return
+        try:
+            if not self.backups.due(self.BACKUP_INTERVAL):
+                return
+        except OSError as e:
+            self._show_error(f"自动备份失败: {e}")
+            return
+        self._backup_thread = threading.Thread(target=self._backup_committed, name='auto-backup', daemon=True)
+        self._backup_thread.start()
+
+    def _backup_committed(self):
+        """单独打开一次存储, 读取已提交的数据并备份(在后台线程中执行, 不访问本对象的内存数据)"""
+        try:
+            storage = self._open_storage()
+            try:
+                students, accounts = storage.load({})
+                self.backups.create(students, accounts)
+            finally:
+                storage.close()
+        except Exception as e:
+            self._backup_error = e
+
+    def restore_backup(self, path):
+        """把学生和账户恢复为备份文件path中的数据并提交, 返回有变化的记录数
+
+        恢复前先把当前数据备份一次, 恢复错了可以再恢复回来; 恢复不进入操作历史。
+        备份文件损坏时抛出ValueError, 当前数据不变。
+        """
+        students, accounts = read_snapshot(path)
+        try:
+            self.backup()
+        except OSError as e:
+            raise ValueError(f"恢复前备份当前数据失败: {e}") from None
+        changed = 0
+        try:
+            with self.history.paused():
+                for table, records in (('students', students), ('accounts', accounts)):
+                    current = getattr(self, table)
+                    for key in [key for key in current if key not in records]:
+                        self._commit_change(table, key)
+                        changed += 1
+                    for key, record in records.items():
+                        if current.get(key) != record:
+                            self._commit_change(table, key, record)
+                            changed += 1
+        except WriteError:
+            self.rollback()  # 不提交只恢复了一部分的数据
+            raise
+        if changed and not self.flush():
+            raise ValueError("保存数据失败, 请稍后重试")
+        self.migrate_schema()  # 备份可能是旧的科目配置下的数据
+        return changed
+
+    def close(self):
+        if self._backup_thread is not None:
+            self._backup_thread.join()  # 等待进行中的自动备份写完
+        self.storage.close()
+
+    def add_student_account(self, student_id, name):
+        """添加学生账户"""
+        self.add_student_accounts([student_id])
+
+    def add_student_accounts(self, student_ids, password_hashes=None):
+        """批量添加学生账户, 已有账户的学号跳过(不提交)
+
+        密码哈希计算较慢, 数量较多时在进程池中并行计算; password_hashes为预先在其他线程中
+        计算好的初始密码哈希时直接使用, 不够时才补算。
+        """
+        new_ids = [student_id for student_id in student_ids if student_id not in self.accounts]
+        hashes = list(password_hashes or [])[:len(new_ids)]
+        hashes += hash_passwords([DEFAULT_PASSWORD] * (len(new_ids) - len(hashes)))
+        for student_id, password_hash in zip(new_ids, hashes):
+            self.add_account(student_id, password_hash)
+
+    def add_account(self, username, password_hash, role='student'):
+        """写入一个账户, 密码为已经计算好的哈希(不提交)"""
+        self._commit_change('accounts', username, {
+            'password': password_hash,
+            'role': role
+        })
+
+    def create_student(self, student_id, name, scores):
+        """写入一条新的学生信息, scores为 {科目: 成绩}, 派生成绩按科目配置计算(不提交)"""
+        missing = [SCHEMA.label(subject) for subject in SUBJECTS if scores.get(subject) is None]
+        if missing:
+            raise ValueError(f"缺少成绩: {'、'.join(missing)}")
+        self._commit_change('students', student_id, SCHEMA.build_record(name, scores))
+
+    def register_student(self, student_id, name, scores, create_account=True):
+        """添加新学生并创建初始密码的账户(不提交)
+
+        create_account为False时不创建账户, 批量添加时可以之后统一调用add_student_accounts。
+        """
+        if not student_id:
+            raise ValueError("学号不能为空")
+        if not name:
+            raise ValueError("姓名不能为空")
+        if student_id in self.students:
+            raise ValueError(f"学号已存在: {student_id}")
+        self.create_student(student_id, name, scores)
+        if create_account:
+            self.add_student_account(student_id, name)
+
+    def get_student(self, student_id):
+        """返回学生记录, 不存在时抛出ValueError"""
+        student = self.students.get(student_id)
+        if student is None:
+            raise ValueError(f"未找到该学号的学生: {student_id}")
+        return student
+
+    def update_scores(self, student_id, scores):
+        """修改学生成绩, scores为 {科目: 成绩}, 未给出或为None的科目保持不变
+
+        只有科目成绩确实变化时才重新计算派生成绩并写入, 返回修改后的记录(不提交)。
+        """
+        student = self.get_student(student_id)
+        for subject in scores:
+            if subject not in SUBJECTS:
+                raise ValueError(f"未知的科目: {subject}")
+        record = SCHEMA.build_record(student['name'], scores, student)
+        if record != student:
+            self._commit_change('students', student_id, record)
+        return record
+
+    def remove_student(self, student_id):
+        """删除学生及其账户, 返回被删除的记录(不提交)"""
+        student = self.get_student(student_id)
+        self._commit_change('students', student_id)
+        if student_id in self.accounts:
+            self._commit_change('accounts', student_id)
+        return student
+
+    def set_password(self, username, password):
+        """设置用户密码(不提交)"""
+        self.set_password_hash(username, self._hash_password(password))
+
+    def set_password_hash(self, username, password_hash):
+        """设置已经计算好的密码哈希, 哈希可以在其他线程中预先计算(不提交)"""
+        if username not in self.accounts:
+            raise ValueError(f"该用户不存在: {username}")
+        account = dict(self.accounts[username])
+        account['password'] = password_hash
+        self._commit_change('accounts', username, account)
+
+    def bulk_import(self, path, encoding='utf-8-sig'):
+        """从CSV文件批量导入学生, 全部导入后只提交一次"""
+        try:
+            result = import_file(self, path, encoding)
+        except WriteError:
+            self.rollback()  # 不提交只导入了一部分的数据
+            raise
+        self.save()
+        return result
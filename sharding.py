@@ -0,0 +1,389 @@
+"""按班级分片的存储
+
+学生记录没有班级字段, 按学号的前SHARD_PREFIX位(默认6位, 如入学年份+班级)分片:
+同一分片的学生和他们的账户保存在data.shards/<分片名>.json中, 每个分片是一个独立的
+JsonStorage(快照+日志+锁+偏移索引)。管理员等非学生账户仍保存在data.json中。
+
+data.shards/manifest.json是分片清单, 记录前缀长度和每个分片的学生数、账户数:
+- 按学号查询时由前缀直接确定分片, 清单中没有该分片时不需要打开任何文件
+- 分片在第一次被访问时才加载, 提交时只写入有修改的分片
+- 学生总数由清单得到, 不需要加载分片
+跨分片的统计用map_shards()在进程池中并行读取和计算各分片, 已加载的分片在本进程中计算
+(其中可能有尚未提交的修改)。
+
+第一次以分片方式启动时, data.json中已有的学生和学生账户迁移到各分片。
+前缀长度在创建清单时确定, 之后修改环境变量不会重新分片。
+"""
+import os
+import re
+import json
+import heapq
+from array import array
+from itertools import islice
+from functools import partial
+from contextlib import contextmanager
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from storage import Storage, JsonStorage, ConflictError, _check_field, _file_signature
+from stats import collect_columns
+
+try:
+    import fcntl
+except ImportError:  # Windows没有fcntl, 此时不支持多个进程同时使用同一份数据
+    fcntl = None
+
+MANIFEST_VERSION = 1
+SHARD_PREFIX = int(os.environ.get('STUDENT_MANAGER_SHARD_PREFIX', '6'))
+PARALLEL_SHARDS = 2     # 未加载的分片至少有这么多时才使用进程池
+_SAFE_NAME = re.compile(r'[0-9A-Za-z_-]+$')
+
+
+def _run_on_shard(path, func):
+    """在子进程中读取一个分片并对其学生映射调用func"""
+    storage = JsonStorage(path)
+    try:
+        students, _ = storage.load({})
+        return func(students)
+    finally:
+        storage.close()
+
+
+class _ShardedTable(Mapping):
+    """跨分片的只读映射, 按学号路由到分片, 修改通过ShardedStorage.put/delete完成"""
+
+    def __init__(self, storage, table):
+        self._storage = storage
+        self._table = table
+
+    def _tables(self):
+        """依次返回各部分的映射: 账户表先是data.json, 之后按分片名排序"""
+        if self._table == 'accounts':
+            yield self._storage.root.accounts
+        for name in self._storage.shard_names():
+            yield getattr(self._storage._shard(name), self._table)
+
+    def __getitem__(self, key):
+        mapping = self._storage._locate(self._table, key)
+        if mapping is None:
+            raise KeyError(key)
+        return mapping[key]
+
+    def __contains__(self, key):
+        return self._storage._locate(self._table, key) is not None
+
+    def __iter__(self):
+        for mapping in self._tables():
+            yield from mapping
+
+    def __len__(self):
+        return self._storage._count(self._table)
+
+    def items(self):
+        for mapping in self._tables():
+            yield from mapping.items()
+
+    def values(self):
+        for mapping in self._tables():
+            yield from mapping.values()
+
+    def columns(self, fields):
+        """按列读取各分片的数值字段并拼接, 未加载的分片在进程池中并行读取"""
+        columns = {field: array('d') for field in fields}
+        for part in self._storage.map_shards(partial(collect_columns, fields=tuple(fields))).values():
+            for field in fields:
+                columns[field].extend(part[field])
+        return columns
+
+
+class ShardedStorage(Storage):
+    """按学号前缀分片的JSON存储"""
+
+    def __init__(self, data_file, journal=True, lazy=False, prefix_length=None):
+        self.data_file = data_file
+        self.journal = journal
+        self.lazy = lazy
+        self.shard_dir = os.path.splitext(data_file)[0] + '.shards'
+        self.manifest_file = os.path.join(self.shard_dir, 'manifest.json')
+        self.lock_file = os.path.join(self.shard_dir, 'manifest.lock')
+        self.prefix_length = prefix_length or SHARD_PREFIX
+        self.root = JsonStorage(data_file, journal=journal, lazy=lazy)
+        self._manifest = {}         # 分片名 -> {'students': 学生数, 'accounts': 账户数}
+        self._manifest_sig = None
+        self._shards = {}           # 已加载的分片: 分片名 -> JsonStorage
+        self._touched = set()       # 有未提交修改的分片名, None表示data.json
+        self._lock_fd = None
+        self._defer_compact = False
+
+    @property
+    def defer_compact(self):
+        return self._defer_compact
+
+    @defer_compact.setter
+    def defer_compact(self, value):
+        self._defer_compact = value
+        for storage in [self.root] + list(self._shards.values()):
+            storage.defer_compact = value
+
+    @contextmanager
+    def _locked(self):
+        """修改清单时持有清单的排他锁, 没有fcntl的平台(Windows)上不加锁"""
+        if fcntl is None:
+            yield
+            return
+        if self._lock_fd is None:
+            self._lock_fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _forward_change(self, table, key, old, new):
+        if self.on_change is not None:
+            self.on_change(table, key, old, new)
+
+    def _forward_reload(self):
+        if self.on_reload is not None:
+            self.on_reload()
+
+    def _attach(self, storage):
+        storage.on_change = self._forward_change
+        storage.on_reload = self._forward_reload
+        storage.defer_compact = self._defer_compact
+
+    @metrics.timed('storage.load')
+    def load(self, default_accounts):
+        os.makedirs(self.shard_dir, exist_ok=True)
+        self._attach(self.root)
+        self.root.load(default_accounts)
+        with self._locked():
+            self._read_manifest()
+            if not os.path.exists(self.manifest_file):
+                self._write_manifest()  # 记下前缀长度
+            if len(self.root.students):
+                self._migrate()
+        self.students = _ShardedTable(self, 'students')
+        self.accounts = _ShardedTable(self, 'accounts')
+        return self.students, self.accounts
+
+    def _read_manifest(self):
+        """读取清单, 返回分片集合是否变化"""
+        signature = _file_signature(self.manifest_file)
+        if signature is None or signature == self._manifest_sig:
+            return False
+        with open(self.manifest_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != MANIFEST_VERSION:
+            raise ValueError(f"不支持的分片清单版本: {data.get('version')}")
+        self._manifest_sig = signature
+        self.prefix_length = data['prefix_length']
+        changed = data['shards'].keys() != self._manifest.keys()
+        self._manifest = data['shards']
+        return changed
+
+    def _write_manifest(self):
+        """写出清单(调用方持有锁)"""
+        data = {'version': MANIFEST_VERSION, 'prefix_length': self.prefix_length,
+                'shards': dict(sorted(self._manifest.items()))}
+        tmp_file = f"{self.manifest_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_file, self.manifest_file)
+        self._manifest_sig = _file_signature(self.manifest_file)
+
+    @metrics.timed('storage.shard_migrate')
+    def _migrate(self):
+        """把data.json中的学生和学生账户移到各分片(调用方持有清单的锁)
+
+        先提交各分片和清单, 再从data.json中删除, 中途崩溃时下次启动会重新迁移。
+        """
+        keys = list(self.root.students)
+        for key in keys:
+            shard = self._shard(self.shard_of(key), create=True)
+            shard.put('students', key, self.root.students[key])
+            account = self.root.accounts.get(key)
+            if account is not None and account.get('role') == 'student':
+                shard.put('accounts', key, account)
+        for name in {self.shard_of(key) for key in keys}:
+            shard = self._shards[name]
+            shard.compact()
+            self._manifest[name] = self._shard_counts(shard)
+        self._write_manifest()
+        for key in keys:
+            self.root.delete('students', key)
+            if key in self._shards[self.shard_of(key)].accounts:
+                self.root.delete('accounts', key)
+        self.root.compact()
+
+    def shard_of(self, key):
+        """学号所属的分片名"""
+        return key[:self.prefix_length]
+
+    def shard_names(self):
+        return sorted(self._manifest)
+
+    def shard_sizes(self):
+        """各分片的学生数, 由清单得到, 不加载分片"""
+        return {name: self._manifest[name]['students'] for name in self.shard_names()}
+
+    def loaded_shards(self):
+        return sorted(self._shards)
+
+    def _shard_path(self, name):
+        filename = name if _SAFE_NAME.match(name) else 'x' + name.encode('utf-8').hex()
+        return os.path.join(self.shard_dir, filename + '.json')
+
+    def _shard(self, name, create=False):
+        """已加载的分片, 尚未加载时加载; 清单中没有该分片时create为False返回None"""
+        storage = self._shards.get(name)
+        if storage is None and (create or name in self._manifest):
+            metrics.increment('storage.shard_load')
+            storage = JsonStorage(self._shard_path(name), journal=self.journal, lazy=self.lazy)
+            self._attach(storage)
+            storage.load({})
+            self._shards[name] = storage
+        return storage
+
+    @staticmethod
+    def _shard_counts(storage):
+        return {'students': len(storage.students), 'accounts': len(storage.accounts)}
+
+    def _count(self, table):
+        """学生数或账户数: 已加载的分片按内存中的数据, 其余按清单"""
+        total = len(self.root.accounts) if table == 'accounts' else 0
+        for name, counts in self._manifest.items():
+            storage = self._shards.get(name)
+            total += len(getattr(storage, table)) if storage is not None else counts[table]
+        return total
+
+    def _locate(self, table, key):
+        """包含该记录的映射, 不存在时返回None"""
+        storage = self._shard(self.shard_of(key))
+        if storage is not None and key in getattr(storage, table):
+            return getattr(storage, table)
+        if table == 'accounts' and key in self.root.accounts:
+            return self.root.accounts
+        return None
+
+    def _home(self, table, key, value):
+        """写入该记录的(分片名, 存储): 学生和学生账户在分片中, 其他账户在data.json中"""
+        name = self.shard_of(key)
+        if table == 'students' or value is not None and value.get('role') == 'student':
+            return name, self._shard(name, create=True)
+        storage = self._shard(name)
+        if value is None and storage is not None and key in storage.accounts:
+            return name, storage
+        return None, self.root
+
+    def put(self, table, key, value):
+        name, storage = self._home(table, key, value)
+        storage.put(table, key, value)
+        self._touched.add(name)
+
+    def delete(self, table, key):
+        name, storage = self._home(table, key, None)
+        storage.delete(table, key)
+        self._touched.add(name)
+
+    @metrics.timed('storage.commit')
+    def commit(self):
+        """只提交有修改的分片, 分片的学生数变化时更新清单
+
+        各分片分别提交, 某个分片发生冲突不影响其他分片, 冲突的键合并后抛出ConflictError。
+        """
+        conflicts = []
+        counts = {}
+        touched = sorted(self._touched, key=lambda name: name or '')
+        try:
+            while touched:
+                name = touched[0]
+                storage = self.root if name is None else self._shards[name]
+                try:
+                    storage.commit()
+                except ConflictError as e:
+                    conflicts.extend(e.changes)
+                touched.pop(0)
+                self._touched.discard(name)
+                if name is not None and self._manifest.get(name) != self._shard_counts(storage):
+                    counts[name] = self._shard_counts(storage)
+        finally:
+            if counts:
+                with self._locked():
+                    self._manifest_sig = None
+                    self._read_manifest()
+                    self._manifest.update(counts)
+                    self._write_manifest()
+        if conflicts:
+            raise ConflictError(conflicts)
+
+    def rollback(self):
+        """各分片重新读取时不逐个通知on_reload, 全部完成后只通知一次"""
+        for storage in [self.root] + list(self._shards.values()):
+            storage.on_reload = None
+            try:
+                storage.rollback()
+            finally:
+                storage.on_reload = self._forward_reload
+        self._touched.clear()
+        self._forward_reload()
+
+    def compact(self):
+        self.commit()
+        for storage in [self.root] + list(self._shards.values()):
+            storage.compact()
+
+    @metrics.timed('storage.refresh')
+    def refresh(self):
+        """合并其他进程对data.json和已加载分片的修改; 其他进程新建了分片时通知on_reload"""
+        changed = [storage.refresh() for storage in [self.root] + list(self._shards.values())]
+        if self._read_manifest():
+            self._forward_reload()
+            return True
+        return any(changed)
+
+    @metrics.timed('storage.shard_map')
+    def map_shards(self, func, workers=None):
+        """对每个分片的学生映射调用func, 返回{分片名: 结果}, 按分片名排序
+
+        未加载的分片不少于PARALLEL_SHARDS个且有多个CPU时, 这些分片在进程池中读取和计算,
+        func和结果都需要可以pickle; 已加载的分片在本进程中计算, 包含尚未提交的修改。
+        """
+        names = self.shard_names()
+        remote = [name for name in names if name not in self._shards]
+        workers = min(workers or os.cpu_count() or 1, len(remote))
+        results = {}
+        if len(remote) >= PARALLEL_SHARDS and workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {name: executor.submit(_run_on_shard, self._shard_path(name), func)
+                           for name in remote}
+                for name in names:
+                    if name in self._shards:
+                        results[name] = func(self._shards[name].students)
+                for name, future in futures.items():
+                    results[name] = future.result()
+        for name in names:
+            if name not in results:
+                results[name] = func(self._shard(name).students)
+        return {name: results[name] for name in names}
+
+    def close(self):
+        self.root.close()
+        for storage in self._shards.values():
+            storage.close()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def range_query(self, field, low=None, high=None, reverse=False, limit=None):
+        """合并各分片已排序的结果"""
+        _check_field(field)
+        if field == 'id':
+            key = lambda item: item[0]
+        else:
+            key = lambda item: (item[1][field], item[0])
+        parts = [self._shard(name).range_query(field, low, high, reverse)
+                 for name in self.shard_names()]
+        merged = heapq.merge(*parts, key=key, reverse=reverse)
+        return islice(merged, limit) if limit is not None else merged
@@ -0,0 +1,669 @@
+"""数据存储后端
+
+EnhancedStudentGradeSystem 只通过这里的 Storage 接口读写数据:
+- JsonStorage: data.json 快照 + data.json.log 追加日志, 可通过偏移索引data.json.idx按需读取
+- SqliteStorage: data.db, 学号/姓名/各科成绩均有索引, 记录按需读取
+- ShardedStorage(sharding.py): 按学号前缀(班级)分片, 每个分片是一个JsonStorage
+"""
+import os
+import re
+import json
+import sqlite3
+from array import array
+from time import time
+from contextlib import contextmanager
+from collections.abc import MutableMapping
+
+import metrics
+from lazystore import LazyTable, SnapshotReader, write_index
+from schema import SCHEMA, DERIVED_FIELDS
+
+try:
+    import fcntl
+except ImportError:  # Windows没有fcntl, 此时不支持多个进程同时使用同一份数据
+    fcntl = None
+
+SUBJECTS = SCHEMA.keys     # 科目由schema.json配置, 默认为语文、数学、英语
+SCORE_FIELDS = SUBJECTS + DERIVED_FIELDS
+# 可用于范围查询和排序的字段, 'id'表示学号
+QUERY_FIELDS = ('id', 'name') + SCORE_FIELDS
+
+
+class ConflictError(Exception):
+    """提交时发现要修改的记录已被其他进程修改
+
+    changes为冲突的[(表名, 键)], 这些修改被放弃, 内存中是其他进程的版本; 其余修改已经保存。
+    keys为其中不重复的键。
+    """
+
+    def __init__(self, changes):
+        self.changes = changes
+        self.keys = list(dict.fromkeys(key for _, key in changes))
+        shown = ', '.join(self.keys[:5]) + (' 等' if len(self.keys) > 5 else '')
+        super().__init__(f"以下记录已被其他进程修改, 这些记录的修改未保存(其余修改已保存): {shown}")
+
+
+class Storage:
+    """存储接口
+
+    load()返回(students, accounts)两个映射, 调用方只读;
+    所有修改都通过put/delete完成, commit表示一批修改结束。
+    其他进程的修改被合并到内存时调用on_change(表名, 键, 旧值, 新值),
+    数据被整体重新加载时调用on_reload()。
+    defer_compact为True时commit只做与修改量成正比的工作, 耗时与数据量有关的整理
+    (如JSON快照的合并)推迟到close(), 交互界面用它保证提交耗时不随学生数量增长。
+    """
+    on_change = None
+    on_reload = None
+    defer_compact = False
+
+    def load(self, default_accounts):
+        raise NotImplementedError
+
+    def put(self, table, key, value):
+        raise NotImplementedError
+
+    def delete(self, table, key):
+        raise NotImplementedError
+
+    def commit(self):
+        pass
+
+    def refresh(self):
+        """检查并合并其他进程的修改, 返回数据是否有变化"""
+        return False
+
+    def rollback(self):
+        """放弃未提交的修改, 重新读取已提交的数据(提交失败后使内存与文件一致)"""
+        pass
+
+    def close(self):
+        pass
+
+    def range_query(self, field, low=None, high=None, reverse=False, limit=None):
+        """按字段范围查询, 结果按该字段排序, 返回(学号, 记录)迭代器"""
+        raise NotImplementedError
+
+
+def _file_signature(path):
+    """文件的(inode, mtime, 大小), 文件不存在时为None"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _raw_items(table):
+    """遍历 (键, 值的JSON编码), 按需读取的表直接复制快照中未修改的记录"""
+    if isinstance(table, LazyTable):
+        return table.raw_items()
+    return ((key, json.dumps(value).encode('ascii')) for key, value in table.items())
+
+
+def _check_field(field):
+    if field not in QUERY_FIELDS:
+        raise ValueError(f"不支持的查询字段: {field}")
+
+
+class JsonStorage(Storage):
+    """JSON快照 + 追加写日志
+
+    修改先在内存中生效并记为待提交, commit时统一追加到日志并落盘, 日志累计到
+    COMPACT_THRESHOLD条后合并为新快照。journal=False时每次commit都重写整个快照。
+
+    多个进程可以同时使用同一份数据: 提交和合并快照时持有data.json.lock的排他锁(fcntl),
+    并先合并其他进程已提交的修改(乐观并发): 本进程修改的记录如果在此期间被其他进程
+    改过, 放弃本进程对它的修改(其余修改照常提交)并抛出ConflictError。快照开头记录代数(generation),
+    每次重写快照加一; 通过快照的mtime/大小和代数以及日志长度判断数据是否被其他进程
+    修改过, 没有变化时不读取文件, 有变化时只重放新增的日志。
+
+    lazy为True时写快照的同时写出偏移索引, 加载时只校验索引, 记录在访问时才从快照中解码,
+    启动时间与学生数量基本无关(见lazystore)。没有索引的旧快照在第一次加载时重写一次。
+    Windows上被映射的文件不能被替换, 因此不使用。
+    """
+    JOURNAL_FSYNC = True        # commit时日志落盘, 崩溃时最多丢失最后一次提交
+    COMPACT_THRESHOLD = 1000    # 日志条数达到该值时合并为新快照
+
+    def __init__(self, data_file, journal=True, columnar=False, lazy=False):
+        self.data_file = data_file
+        self.journal_file = data_file + '.log'
+        self.lock_file = data_file + '.lock'
+        self.index_file = data_file + '.idx'
+        self.journal = journal
+        self.columnar = columnar
+        self.lazy = lazy and not columnar and os.name != 'nt'
+        self.students = {}
+        self.accounts = {}
+        self._default_accounts = {}
+        self._journal = None        # 日志文件句柄(追加模式)
+        self._journal_entries = 0   # 快照之后累计的日志条数
+        self._journal_offset = 0    # 已经应用到内存的日志字节数
+        self._snapshot_sig = None   # 已加载快照的(inode, mtime, 大小)
+        self._generation = 0        # 已加载快照的代数
+        self._pending = []          # 未提交的修改: (表名, 键, 修改前的值, 修改后的值, 时间戳)
+        self._lock_fd = None
+        self._reader = None         # lazy模式下当前快照的SnapshotReader
+
+    @contextmanager
+    def _locked(self, exclusive):
+        """持有数据文件的咨询锁, 没有fcntl的平台(Windows)上不加锁"""
+        if fcntl is None:
+            yield
+            return
+        if self._lock_fd is None:
+            self._lock_fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    @metrics.timed('storage.load')
+    def load(self, default_accounts):
+        self._default_accounts = dict(default_accounts)
+        if self.columnar:
+            # 延迟导入, 避免循环依赖
+            from columnar import ColumnarStudentStore
+            self.students = ColumnarStudentStore()
+        elif self.lazy:
+            self.students = LazyTable('students')
+            self.accounts = LazyTable('accounts')
+        with self._locked(True):
+            self._truncate_journal(self._read_all())
+            if self.lazy and self._reader is None and os.path.exists(self.data_file):
+                self._write_snapshot()  # 旧快照没有索引, 重写一次
+        return self.students, self.accounts
+
+    @metrics.timed('storage.read_all')
+    def _read_all(self):
+        """清空内存数据, 重新读取快照和全部日志(调用方持有锁), 返回日志文件的大小"""
+        self._snapshot_sig = _file_signature(self.data_file)
+        self._close_reader()
+        if self.lazy:
+            self._reader = SnapshotReader.open(self.data_file, self.index_file,
+                                               self._read_generation())
+        if self._reader is not None:
+            # 只校验了索引, 记录在访问时才读取
+            self.students.attach(self._reader)
+            self.accounts.attach(self._reader)
+            self._generation = self._reader.generation
+        else:
+            self.students.clear()
+            self.accounts.clear()
+            try:
+                with open(self.data_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                data = {}
+            self.students.update(data.get('students', {}))
+            self.accounts.update(data.get('accounts', self._default_accounts))
+            self._generation = data.get('generation', 0)
+        self._journal_offset = 0
+        self._journal_entries = 0
+        return self._replay_journal() if self.journal else 0
+
+    def _read_generation(self):
+        """只读取快照开头的代数, 不解析整个文件"""
+        try:
+            with open(self.data_file, 'r', encoding='utf-8') as f:
+                head = f.readline() + f.readline()
+        except FileNotFoundError:
+            return None
+        match = re.search(r'"generation":\s*(\d+)', head)
+        return int(match.group(1)) if match else 0
+
+    def _external_state(self):
+        """判断其他进程是否修改过数据
+
+        返回None表示没有变化, 'tail'表示日志有新记录, 'full'表示快照已被重写。
+        """
+        signature = _file_signature(self.data_file)
+        if signature != self._snapshot_sig:
+            if self._read_generation() != self._generation:
+                return 'full'
+            self._snapshot_sig = signature  # 快照内容没有变化(如只是被touch)
+        if not self.journal:
+            return None
+        size = (_file_signature(self.journal_file) or (0, 0, 0))[2]
+        if size < self._journal_offset:
+            return 'full'   # 日志被截断, 说明快照已被合并
+        if size > self._journal_offset:
+            return 'tail'
+        return None
+
+    def _replay_journal(self, notify=False):
+        """从上次的位置继续重放日志, 遇到崩溃时写了一半的记录即停止
+
+        返回日志文件的大小, 大于已应用的位置时说明末尾有不完整的记录。
+        """
+        try:
+            f = open(self.journal_file, 'rb')
+        except FileNotFoundError:
+            return 0
+        with f:
+            f.seek(self._journal_offset)
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break  # 末尾记录不完整
+                try:
+                    entry = json.loads(raw)
+                except ValueError:
+                    break
+                self._apply(entry, notify)
+                self._journal_entries += 1
+                self._journal_offset += len(raw)
+            return f.seek(0, os.SEEK_END)
+
+    def _truncate_journal(self, size):
+        """截掉损坏的尾部, 保证后续追加的记录可以被正确读取(调用方持有排他锁)"""
+        if size > self._journal_offset:
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(self._journal_offset)
+
+    def _apply(self, entry, notify=False):
+        """将一条日志应用到内存数据"""
+        value = entry['value'] if entry['op'] == 'put' else None
+        self._set(entry['table'], entry['key'], value, notify)
+
+    def _set(self, table, key, value, notify=False):
+        """修改内存中的一条记录, value为None表示删除; notify为True时通知on_change"""
+        mapping = self.students if table == 'students' else self.accounts
+        old = mapping.get(key) if notify else None
+        if value is None:
+            mapping.pop(key, None)
+        else:
+            mapping[key] = value
+        if notify and self.on_change is not None and old != value:
+            self.on_change(table, key, old, value)
+
+    def _record(self, table, key, value):
+        mapping = self.students if table == 'students' else self.accounts
+        self._pending.append((table, key, mapping.get(key), value, round(time(), 3)))
+        self._set(table, key, value)
+
+    def put(self, table, key, value):
+        self._record(table, key, value)
+
+    def delete(self, table, key):
+        self._record(table, key, None)
+
+    def _merge_external(self):
+        """合并其他进程已提交的修改(调用方持有排他锁), 返回冲突的[(表名, 键)]
+
+        先撤销本进程未提交的修改, 应用其他进程的修改, 再重新应用本进程的修改;
+        某条记录当前的值与本进程修改前看到的值不同, 说明它被其他进程改过, 放弃本进程的修改。
+        """
+        state = self._external_state()
+        if state is None:
+            return []
+        pending = self._pending
+        for table, key, old, _, _ in reversed(pending):
+            self._set(table, key, old, notify=True)
+        if state == 'full':
+            size = self._read_all()
+            if self.on_reload is not None:
+                self.on_reload()
+        else:
+            size = self._replay_journal(notify=True)
+        self._truncate_journal(size)
+
+        self._pending = []
+        conflicts = {}
+        for item in pending:
+            table, key, old, new, _ = item
+            mapping = self.students if table == 'students' else self.accounts
+            if (table, key) in conflicts or mapping.get(key) != old:
+                conflicts[(table, key)] = None
+                continue
+            self._set(table, key, new, notify=True)
+            self._pending.append(item)
+        return list(conflicts)
+
+    @metrics.timed('storage.journal_write')
+    def _write_journal(self):
+        """把待提交的修改追加到日志并落盘(调用方持有排他锁)"""
+        if not self._pending:
+            return
+        if self._journal is None:
+            self._journal = open(self.journal_file, 'ab')
+        for table, key, _, value, ts in self._pending:
+            entry = {'op': 'del' if value is None else 'put', 'table': table, 'key': key}
+            if value is not None:
+                entry['value'] = value
+            entry['ts'] = ts
+            line = json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n'
+            self._journal.write(line.encode('utf-8'))
+        self._journal.flush()
+        if self.JOURNAL_FSYNC:
+            os.fsync(self._journal.fileno())
+        self._journal_entries += len(self._pending)
+        self._journal_offset = os.fstat(self._journal.fileno()).st_size
+
+    @metrics.timed('storage.commit')
+    def commit(self, compact=False):
+        """提交待提交的修改, 仅在日志过长(或compact为True)时合并快照
+
+        其他进程修改过的记录不会被覆盖, 这些记录的修改被放弃, 其余修改照常写入后抛出ConflictError。
+        """
+        if not self._pending and not compact:
+            return
+        with self._locked(True):
+            conflicts = self._merge_external()
+            if self.journal:
+                self._write_journal()
+            self._pending = []
+            if compact or not self.journal or (not self.defer_compact and
+                                               self._journal_entries >= self.COMPACT_THRESHOLD):
+                self._write_snapshot()
+        if conflicts:
+            metrics.increment('storage.conflict', len(conflicts))
+            raise ConflictError(conflicts)
+
+    def compact(self):
+        """写出完整快照并清空日志"""
+        self.commit(compact=True)
+
+    @metrics.timed('storage.snapshot_write')
+    def _write_snapshot(self):
+        """写出完整快照并清空日志(调用方持有排他锁)"""
+        # 先写临时文件再替换, 避免崩溃时留下半个快照
+        generation = self._generation + 1
+        tmp_file = f"{self.data_file}.{os.getpid()}.tmp"
+        spans = {}  # 表名: (UTF-8编码的学号, 每条记录的值的[起始, 结束)偏移)
+        with open(tmp_file, 'wb') as f:
+            # 逐条写出, 每个学生一行, 不需要先构造完整的JSON字符串
+            pos = f.write(f'{{\n  "generation": {generation}'.encode('ascii'))
+            for name, table in (('students', self.students), ('accounts', self.accounts)):
+                pos += f.write(f',\n  "{name}": {{'.encode('ascii'))
+                keys, offsets = [], array('Q')
+                sep = b'\n'
+                for key, raw in _raw_items(table):
+                    pos += f.write(sep + b'    ' + json.dumps(key).encode('ascii') + b': ')
+                    offsets.append(pos)
+                    pos += f.write(raw)
+                    offsets.append(pos)
+                    keys.append(key.encode('utf-8'))
+                    sep = b',\n'
+                pos += f.write(b'\n  }')
+                spans[name] = (keys, offsets)
+            pos += f.write(b'\n}\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.data_file)
+        self._generation = generation
+        self._snapshot_sig = _file_signature(self.data_file)
+        if self.lazy:
+            write_index(self.index_file, generation, pos, spans)
+            # 改为读取新快照, 释放内存中已写入快照的修改
+            reader = SnapshotReader.open(self.data_file, self.index_file, generation)
+            if reader is not None:
+                self.students.attach(reader)
+                self.accounts.attach(reader)
+                self._close_reader()
+                self._reader = reader
+
+        # 快照已包含日志中的全部修改, 此时截断日志是安全的
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if os.path.exists(self.journal_file):
+            open(self.journal_file, 'wb').close()
+        self._journal_entries = 0
+        self._journal_offset = 0
+
+    @metrics.timed('storage.refresh')
+    def refresh(self):
+        if self._pending or self._external_state() is None:
+            return False    # 没有变化时只需要两次stat
+        with self._locked(False):
+            state = self._external_state()
+            if state == 'full':
+                self._read_all()
+                if self.on_reload is not None:
+                    self.on_reload()
+            elif state == 'tail':
+                self._replay_journal(notify=True)
+        return state is not None
+
+    def rollback(self):
+        self._pending = []
+        with self._locked(True):  # 写入失败时日志可能留下半条记录, 需要截掉
+            self._truncate_journal(self._read_all())
+        if self.on_reload is not None:
+            self.on_reload()
+
+    def _close_reader(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def close(self):
+        if self.defer_compact and self.journal and self._journal_entries >= self.COMPACT_THRESHOLD:
+            self.compact()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        self._close_reader()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def range_query(self, field, low=None, high=None, reverse=False, limit=None):
+        _check_field(field)
+        if field == 'id':
+            key = lambda item: item[0]
+        else:
+            key = lambda item: item[1][field]
+        items = [
+            item for item in self.students.items()
+            if (low is None or key(item) >= low) and (high is None or key(item) <= high)
+        ]
+        items.sort(key=lambda item: (key(item), item[0]), reverse=reverse)
+        return iter(items[:limit] if limit is not None else items)
+
+
+class _SqliteTable(MutableMapping):
+    """把一张表包装成字典, 每次访问只读取需要的行"""
+
+    def __init__(self, conn, table, columns):
+        self._conn = conn
+        self._table = table
+        self._columns = columns
+        names = ', '.join(columns)
+        marks = ', '.join('?' for _ in columns)
+        updates = ', '.join(f"{c} = excluded.{c}" for c in columns)
+        self._select = f"SELECT {names} FROM {table} WHERE id = ?"
+        self._upsert = (f"INSERT INTO {table} (id, {names}) VALUES (?, {marks}) "
+                        f"ON CONFLICT(id) DO UPDATE SET {updates}")
+
+    def __getitem__(self, key):
+        row = self._conn.execute(self._select, (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return dict(zip(self._columns, row))
+
+    def __setitem__(self, key, value):
+        self._conn.execute(self._upsert, [key] + [value.get(c) for c in self._columns])
+
+    def __delitem__(self, key):
+        cur = self._conn.execute(f"DELETE FROM {self._table} WHERE id = ?", (key,))
+        if cur.rowcount == 0:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        sql = f"SELECT 1 FROM {self._table} WHERE id = ?"
+        return self._conn.execute(sql, (key,)).fetchone() is not None
+
+    def __iter__(self):
+        for (key,) in self._conn.execute(f"SELECT id FROM {self._table} ORDER BY rowid"):
+            yield key
+
+    def __len__(self):
+        return self._conn.execute(f"SELECT COUNT(*) FROM {self._table}").fetchone()[0]
+
+    def items(self):
+        """用一次查询遍历全部记录, 避免逐个学号查询"""
+        names = ', '.join(self._columns)
+        for row in self._conn.execute(f"SELECT id, {names} FROM {self._table} ORDER BY rowid"):
+            yield row[0], dict(zip(self._columns, row[1:]))
+
+    def values(self):
+        for _, value in self.items():
+            yield value
+
+    def columns(self, fields):
+        """按列读取数值字段, 返回{字段: array('d')}"""
+        for field in fields:
+            if field not in self._columns:
+                raise ValueError(f"不支持的查询字段: {field}")
+        columns = {field: array('d') for field in fields}
+        appends = [columns[field].append for field in fields]
+        cursor = self._conn.execute(f"SELECT {', '.join(fields)} FROM {self._table}")
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            for row in rows:
+                for append, value in zip(appends, row):
+                    append(value)
+        return columns
+
+
+class SqliteStorage(Storage):
+    """SQLite存储, 启动时不加载任何学生记录
+
+    首次创建数据库时, 如果存在旧的data.json会自动导入。
+    """
+    STUDENT_COLUMNS = ('name',) + SCORE_FIELDS
+    ACCOUNT_COLUMNS = ('password', 'role')
+
+    def __init__(self, db_file, migrate_from=None):
+        self.db_file = db_file
+        self.migrate_from = migrate_from
+        self.conn = None
+        self._data_version = None
+
+    @metrics.timed('storage.load')
+    def load(self, default_accounts):
+        self.conn = sqlite3.connect(self.db_file)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        created = self._create_schema()
+
+        self.students = _SqliteTable(self.conn, 'students', self.STUDENT_COLUMNS)
+        self.accounts = _SqliteTable(self.conn, 'accounts', self.ACCOUNT_COLUMNS)
+
+        if created and self.migrate_from and (os.path.exists(self.migrate_from) or
+                                              os.path.exists(self.migrate_from + '.log')):
+            self._migrate(default_accounts)
+        if len(self.accounts) == 0:
+            for key, value in default_accounts.items():
+                self.accounts[key] = value
+        self.conn.commit()
+        self._data_version = self._read_data_version()
+        return self.students, self.accounts
+
+    def _read_data_version(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _create_schema(self):
+        """建表建索引, 返回是否为新建的数据库
+
+        科目配置中新增的科目和派生字段会作为新列加入已有的表。
+        """
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'students'"
+        ).fetchone()
+        score_columns = ', '.join(f"{c} REAL" for c in SCORE_FIELDS)
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS students (id TEXT PRIMARY KEY, name TEXT, {score_columns})"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS accounts (id TEXT PRIMARY KEY, password TEXT, role TEXT)"
+        )
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(students)")}
+        for column in SCORE_FIELDS:
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE students ADD COLUMN {column} REAL")
+        for column in self.STUDENT_COLUMNS:
+            self.conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_students_{column} ON students ({column}, id)"
+            )
+        return exists is None
+
+    def _migrate(self, default_accounts):
+        """从JSON存储导入全部数据"""
+        source = JsonStorage(self.migrate_from)
+        students, accounts = source.load(default_accounts)
+        source.close()
+        for key, value in students.items():
+            self.students[key] = value
+        for key, value in accounts.items():
+            self.accounts[key] = value
+
+    def put(self, table, key, value):
+        getattr(self, table)[key] = value
+
+    def delete(self, table, key):
+        getattr(self, table).pop(key, None)
+
+    @metrics.timed('storage.commit')
+    def commit(self):
+        self.conn.commit()
+
+    @metrics.timed('storage.refresh')
+    def refresh(self):
+        """检查其他连接是否提交过修改
+
+        记录本身总是按需读取, data_version变化时只需通知调用方重建内存中的索引。
+        """
+        version = self._read_data_version()
+        if version == self._data_version:
+            return False
+        self._data_version = version
+        if self.on_reload is not None:
+            self.on_reload()
+        return True
+
+    def rollback(self):
+        self.conn.rollback()
+        if self.on_reload is not None:
+            self.on_reload()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+    def range_query(self, field, low=None, high=None, reverse=False, limit=None):
+        _check_field(field)
+        conditions, params = [], []
+        if low is not None:
+            conditions.append(f"{field} >= ?")
+            params.append(low)
+        if high is not None:
+            conditions.append(f"{field} <= ?")
+            params.append(high)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = 'DESC' if reverse else 'ASC'
+        sql = (f"SELECT id, {', '.join(self.STUDENT_COLUMNS)} FROM students {where} "
+               f"ORDER BY {field} {order}, id {order}")
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        for row in self.conn.execute(sql, params):
+            yield row[0], dict(zip(self.STUDENT_COLUMNS, row[1:]))
+
+
+def open_storage(backend, data_file, db_file, journal=True, columnar=False, lazy=False):
+    """根据配置创建存储后端"""
+    if backend == 'sqlite':
+        return SqliteStorage(db_file, migrate_from=data_file)
+    if backend == 'json':
+        return JsonStorage(data_file, journal=journal, columnar=columnar, lazy=lazy)
+    if backend == 'sharded':
+        from sharding import ShardedStorage  # 延迟导入, 避免循环依赖
+        return ShardedStorage(data_file, journal=journal, lazy=lazy)
+    raise ValueError(f"未知的存储后端: {backend}")
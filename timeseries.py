@@ -0,0 +1,297 @@
+"""多次考试的成绩历史
+
+学生记录只保存当前成绩, 每次考试(或学期)结束时把全体学生的当前成绩记为一次考试,
+追加到数据文件旁边的data.json.exams(SQLite存储为data.db.exams)。以前按学期保存的
+data.json副本可以按时间顺序导入。
+
+文件只追加不改写, 每次考试是一段:
+- 一行JSON头部: 考试名称、时间、字段、这次新出现的学号、各字段的汇总
+  (人数、总和、平方和、最低、最高)和与上一次考试相比进步最多的IMPROVED_TOP名学生
+- 之后每个字段一列成绩, array('d'), 按学号第一次出现的顺序(行号)排列, 缺考为NaN
+
+学号在整个文件中只保存一次, 每个学生每科每次考试占8字节。头部用空格补齐到8字节的倍数,
+成绩列通过mmap按需读取, 查询一名学生的成绩变化只访问每次考试的一个数据页;
+各次考试的平均分直接由头部的汇总得到, 相邻两次考试的进步排名由头部的前IMPROVED_TOP名
+得到, 都不需要扫描全体学生。
+"""
+import os
+import sys
+import json
+import math
+import mmap
+import heapq
+from array import array
+from time import time
+
+try:
+    import fcntl
+except ImportError:  # Windows没有fcntl, 此时不支持多个进程同时记录考试
+    fcntl = None
+
+import metrics
+from storage import SCORE_FIELDS
+
+FORMAT_VERSION = 1
+IMPROVED_TOP = 100      # 每次考试头部保存的进步最多的学生数
+_ALIGN = 8
+_MISSING = float('nan')
+
+
+class Exam:
+    """一次考试: 头部信息和按需读取的成绩列"""
+
+    def __init__(self, header, data, offset):
+        self.name = header['exam']
+        self.time = header['time']
+        self.fields = tuple(header['fields'])
+        self.rows = header['rows']              # 这次考试时已知的学号数, 即每列的长度
+        self.count = header['count']            # 参加考试的人数
+        self.stats = header['stats']            # 字段 -> [人数, 总和, 平方和, 最低, 最高]
+        self.improved = header['improved']      # 字段 -> [[行号, 进步分数]], 从大到小
+        self._byteswap = header['byteorder'] != sys.byteorder
+        self._data = data
+        self._offset = offset
+        self._columns = {}
+
+    def size(self):
+        """成绩列占用的字节数"""
+        return len(self.fields) * self.rows * _ALIGN
+
+    def column(self, field):
+        """字段的成绩列(按行号), 这次考试没有该字段时返回None"""
+        column = self._columns.get(field)
+        if column is None and field in self.fields:
+            start = self._offset + self.fields.index(field) * self.rows * _ALIGN
+            view = memoryview(self._data)[start:start + self.rows * _ALIGN]
+            if self._byteswap:
+                column = array('d')
+                column.frombytes(view)
+                column.byteswap()
+            else:
+                column = view.cast('d')
+            self._columns[field] = column
+        return column
+
+    def score(self, row, field):
+        """第row行学生的成绩, 缺考或没有该字段时返回None"""
+        column = self.column(field)
+        if column is None or row >= self.rows:
+            return None
+        score = column[row]
+        return None if score != score else score
+
+    def mean(self, field):
+        stat = self.stats.get(field)
+        return stat[1] / stat[0] if stat and stat[0] else None
+
+    def std(self, field):
+        """总体标准差"""
+        stat = self.stats.get(field)
+        if not stat or not stat[0]:
+            return None
+        mean = stat[1] / stat[0]
+        return math.sqrt(max(0.0, stat[2] / stat[0] - mean * mean))
+
+
+def _summarize(column):
+    """一列成绩的[人数, 总和, 平方和, 最低, 最高], 跳过NaN"""
+    values = [score for score in column if score == score]
+    if not values:
+        return [0, 0.0, 0.0, None, None]
+    return [len(values), math.fsum(values), math.fsum(score * score for score in values),
+            min(values), max(values)]
+
+
+def _improvements(before, after, n):
+    """两列成绩中两次都有成绩的学生按进步分数从大到小的前n名, [(行号, 进步分数)]
+
+    分数相同时行号小的在前。
+    """
+    rows = min(len(before), len(after))
+    deltas = ((after[row] - before[row], row) for row in range(rows)
+              if before[row] == before[row] and after[row] == after[row])
+    best = heapq.nsmallest(n, deltas, key=lambda item: (-item[0], item[1]))
+    return [(row, delta) for delta, row in best]
+
+
+class ExamHistory:
+    """考试成绩历史文件, 第一次查询时才读取"""
+
+    def __init__(self, path):
+        self.path = path
+        self._ids = []              # 行号 -> 学号
+        self._rows = {}             # 学号 -> 行号
+        self._exams = []
+        self._by_name = {}
+        self._size = 0              # 已读取的完整段的字节数
+        self._loaded = False
+
+    def _read_segments(self, data, start):
+        """从start开始解析data中的完整段, 返回解析到的位置"""
+        pos = start
+        while pos < len(data):
+            end = data.find(b'\n', pos)
+            if end < 0:
+                break
+            try:
+                header = json.loads(bytes(data[pos:end]))
+            except ValueError:
+                break
+            offset = end + 1
+            exam = Exam(header, data, offset)
+            if header.get('version') != FORMAT_VERSION or offset + exam.size() > len(data):
+                break   # 未写完的段(写入时崩溃), 下次记录考试时截掉
+            for student_id in header['new_ids']:
+                self._rows[student_id] = len(self._ids)
+                self._ids.append(student_id)
+            self._exams.append(exam)
+            self._by_name[exam.name] = exam
+            pos = offset + exam.size()
+        return pos
+
+    @metrics.timed('exams.load')
+    def refresh(self):
+        """读取其他进程新记录的考试"""
+        self._loaded = True
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size <= self._size:
+            return
+        with open(self.path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # 之前的段仍引用旧的映射, 新映射只用于解析新增的段
+        self._size = self._read_segments(data, self._size)
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.refresh()
+
+    def exams(self):
+        """全部考试, 按记录顺序"""
+        self._ensure_loaded()
+        return list(self._exams)
+
+    def get(self, name):
+        """按名称查找考试, 不存在时抛出ValueError"""
+        self._ensure_loaded()
+        exam = self._by_name.get(name)
+        if exam is None:
+            raise ValueError(f"没有这次考试: {name}")
+        return exam
+
+    def trajectory(self, student_id, fields=SCORE_FIELDS):
+        """学生在各次考试中的成绩, [(考试, {字段: 成绩})], 只包含参加了的考试"""
+        self._ensure_loaded()
+        row = self._rows.get(student_id)
+        if row is None:
+            return []
+        result = []
+        for exam in self._exams:
+            scores = {field: exam.score(row, field) for field in fields}
+            if any(score is not None for score in scores.values()):
+                result.append((exam, scores))
+        return result
+
+    def averages(self, field):
+        """各次考试该字段的平均分, [(考试, 平均分)], 由头部的汇总得到"""
+        return [(exam, exam.mean(field)) for exam in self.exams()]
+
+    def most_improved(self, field, n, start=None, end=None):
+        """从start到end两次考试之间该字段进步最多的n名学生, [(学号, 之前, 之后, 进步分数)]
+
+        默认比较最近两次考试, 只给出end时与它的前一次比较, start必须早于end。
+        相邻两次考试且n不超过IMPROVED_TOP时直接使用end头部中预先计算的结果, 否则扫描两次考试的成绩列。
+        """
+        if n < 1:
+            raise ValueError("人数必须是正整数")
+        self._ensure_loaded()
+        if len(self._exams) < 2 and (start is None or end is None):
+            raise ValueError("至少需要两次考试")
+        after = self.get(end) if end is not None else self._exams[-1]
+        position = self._exams.index(after)
+        if start is None:
+            if position == 0:
+                raise ValueError(f"{after.name}之前没有考试")
+            before = self._exams[position - 1]
+        else:
+            before = self.get(start)
+        if before is after:
+            raise ValueError("请选择两次不同的考试")
+        if self._exams.index(before) > position:
+            raise ValueError(f"{before.name}在{after.name}之后, 请先给出较早的考试")
+        if after.column(field) is None or before.column(field) is None:
+            raise ValueError(f"两次考试没有共同的字段: {field}")
+        if position > 0 and self._exams[position - 1] is before and n <= IMPROVED_TOP:
+            best = after.improved.get(field, [])[:n]
+        else:
+            best = _improvements(before.column(field), after.column(field), n)
+        return [(self._ids[row], before.score(row, field), after.score(row, field), delta)
+                for row, delta in best]
+
+    @metrics.timed('exams.record')
+    def record(self, name, students, fields=SCORE_FIELDS):
+        """把students({学号: 记录})的当前成绩追加为一次考试, 返回Exam
+
+        名称为空或与已有的考试重名时抛出ValueError。记录中缺少的字段记为缺考。
+        """
+        name = str(name).strip()
+        if not name:
+            raise ValueError("考试名称不能为空")
+        fields = tuple(fields)
+        with open(self.path, 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            self.refresh()  # 持有锁后读取其他进程刚记录的考试, 保证行号一致
+            if name in self._by_name:
+                raise ValueError(f"考试名称已存在: {name}")
+            if os.path.getsize(self.path) > self._size:
+                f.truncate(self._size)  # 丢弃上次崩溃时未写完的段
+            f.seek(0, os.SEEK_END)
+            f.write(self._encode(name, students, fields))
+            f.flush()
+            os.fsync(f.fileno())
+        self.refresh()
+        return self._exams[-1]
+
+    def _encode(self, name, students, fields):
+        """生成一次考试的完整段"""
+        new_ids = []
+        known = len(self._ids)
+        columns = {field: array('d', [_MISSING]) * known for field in fields}
+        count = 0
+        for student_id, record in students.items():
+            row = self._rows.get(student_id)
+            if row is None:
+                row = known + len(new_ids)
+                new_ids.append(student_id)
+                for column in columns.values():
+                    column.append(_MISSING)
+            for field in fields:
+                score = record.get(field)
+                if score is not None:
+                    columns[field][row] = score
+            count += 1
+
+        previous = self._exams[-1] if self._exams else None
+        improved = {}
+        for field in fields:
+            before = previous.column(field) if previous else None
+            if before is not None:
+                improved[field] = _improvements(before, columns[field], IMPROVED_TOP)
+        header = {
+            'version': FORMAT_VERSION,
+            'exam': name,
+            'time': round(time(), 3),
+            'byteorder': sys.byteorder,
+            'fields': list(fields),
+            'rows': known + len(new_ids),
+            'count': count,
+            'new_ids': new_ids,
+            'stats': {field: _summarize(column) for field, column in columns.items()},
+            'improved': improved,
+        }
+        line = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        line += b' ' * (-(len(line) + 1) % _ALIGN) + b'\n'
+        return line + b''.join(columns[field].tobytes() for field in fields)